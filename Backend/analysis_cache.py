@@ -0,0 +1,253 @@
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+# Module the analysis jobs read their settings from
+CONFIG_PATH = "config.py"
+# Settings that do not change the results of an analysis
+IGNORED_CONFIG = {"RESOURCE_CONFIG", "ANALYSIS_CACHE_CONFIG", "RETENTION_CONFIG", "PROGRESS_INTERVAL", "RECORD_CONFIG",
+	"LIVE_METRICS_CONFIG"}
+# Code of the analysis jobs
+SOURCE_PATTERNS = ["*.py", "deep_sort/*.py"]
+
+# path -> ((size, mtime), sha256)
+_file_digests = {}
+# (config.py digest, settings digest, model paths)
+_settings_digest = (None, None, None)
+# Guards both, digests are computed by concurrent requests
+_digest_lock = threading.Lock()
+
+def file_digest(path, block_size=1 << 20):
+	# sha256 of a file, remembered until its size or modification time changes
+	stat = os.stat(path)
+	version = (stat.st_size, stat.st_mtime_ns)
+	with _digest_lock:
+		cached = _file_digests.get(path)
+	if cached is not None and cached[0] == version:
+		return cached[1]
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b""):
+			digest.update(block)
+	with _digest_lock:
+		_file_digests[path] = (version, digest.hexdigest())
+	return digest.hexdigest()
+
+def remember_digest(path, digest):
+	# Record a digest computed while the file was written, so it is not read again
+	stat = os.stat(path)
+	with _digest_lock:
+		_file_digests[path] = ((stat.st_size, stat.st_mtime_ns), digest)
+
+def _load_settings():
+	# Settings as a job started now would see them, without reloading the server's config module
+	spec = importlib.util.spec_from_file_location("analysis_config", CONFIG_PATH)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return {name: value for (name, value) in vars(module).items() if name.isupper()}
+
+def _model_paths(settings):
+	yolo = settings["YOLO_CONFIG"]
+	precision = yolo["PRECISION"]
+	# Same naming as tracking.reid_model_path
+	reid = yolo["REID_MODEL_PATH"]
+	if precision != "fp32":
+		reid = "{}_{}.tflite".format(os.path.splitext(reid)[0], precision)
+	paths = [yolo["WEIGHTS_PATH"], yolo["CONFIG_PATH"], reid]
+	if precision == "int8":
+		paths.append(yolo["CALIBRATION_PATH"])
+	return paths
+
+def pipeline_digest():
+	"""
+	Hash of everything besides the video that decides the results: the
+	effective settings of config.py, the model files and the analysis code.
+	"""
+	global _settings_digest
+	config_digest = file_digest(CONFIG_PATH)
+	with _digest_lock:
+		if _settings_digest[0] != config_digest:
+			settings = _load_settings()
+			relevant = {name: value for (name, value) in settings.items() if name not in IGNORED_CONFIG}
+			_settings_digest = (config_digest, hashlib.sha256(json.dumps(relevant, sort_keys=True, default=str).encode()).hexdigest(),
+				_model_paths(settings))
+		(_, digest, model_paths) = _settings_digest
+
+	pipeline = hashlib.sha256(digest.encode())
+	# config.py counts through its effective settings only
+	sources = sorted(path for pattern in SOURCE_PATTERNS for path in glob.glob(pattern) if path != CONFIG_PATH)
+	for path in model_paths + sources:
+		pipeline.update(path.encode())
+		pipeline.update(file_digest(path).encode() if os.path.exists(path) else b"missing")
+	return pipeline.hexdigest()
+
+def directory_size(path):
+	size = 0
+	for (dirpath, _, filenames) in os.walk(path):
+		for filename in filenames:
+			try:
+				size += os.path.getsize(os.path.join(dirpath, filename))
+			except OSError:
+				pass
+	return size
+
+class AnalysisCache:
+	"""
+	Finished analyses kept in `root/<key>`, where the key hashes the video
+	content together with pipeline_digest(), so a repeated request is
+	answered from the earlier run. The index of cached runs is kept in
+	`root/cache_index.json`. Once the cached runs take more than
+	`quota_bytes`, the least recently used ones are deleted, except runs
+	inside claim() or reading().
+	"""
+
+	INDEX_FILENAME = "cache_index.json"
+
+	def __init__(self, root, quota_bytes):
+		self.root = root
+		self.quota_bytes = quota_bytes
+		self.index_path = os.path.join(root, self.INDEX_FILENAME)
+		self._lock = threading.Lock()
+		# key -> Event set once the run producing it finished
+		self._in_flight = {}
+		# key -> number of claims and readers of the run, it is not evicted meanwhile
+		self._readers = {}
+		self.entries = {}
+		if os.path.exists(self.index_path):
+			with open(self.index_path) as f:
+				self.entries = json.load(f)
+		# Runs deleted by hand
+		self.entries = {key: entry for (key, entry) in self.entries.items() if os.path.isdir(self.path(key))}
+
+	def key(self, video_path):
+		return hashlib.sha256((file_digest(video_path) + pipeline_digest()).encode()).hexdigest()[:32]
+
+	def path(self, key):
+		return os.path.join(self.root, key)
+
+	def contains(self, key):
+		with self._lock:
+			return key in self.entries
+
+	@contextmanager
+	def claim(self, key):
+		"""
+		Yield True if the run of `key` is cached. Otherwise yield False, the
+		caller produces it in path(key) and calls store() or discard().
+		Claims of a key that is being produced wait for that run. The run is
+		not evicted before the claim ends, the caller reads it meanwhile.
+		"""
+		while True:
+			with self._lock:
+				event = None
+				if key in self.entries:
+					self.entries[key]["last_used"] = time.time()
+					self._save()
+					hit = True
+				else:
+					event = self._in_flight.get(key)
+					if event is None:
+						self._in_flight[key] = threading.Event()
+						hit = False
+				# Cached, or claimed for this caller to produce
+				if event is None:
+					self._readers[key] = self._readers.get(key, 0) + 1
+					break
+			event.wait()
+		try:
+			if hit:
+				yield True
+				return
+			shutil.rmtree(self.path(key), ignore_errors=True)
+			os.makedirs(self.path(key))
+			try:
+				yield False
+			finally:
+				with self._lock:
+					self._in_flight.pop(key).set()
+		finally:
+			self._release(key)
+
+	@contextmanager
+	def reading(self, key):
+		# Keep the run of `key` from being evicted while it is read
+		with self._lock:
+			self._readers[key] = self._readers.get(key, 0) + 1
+		try:
+			yield
+		finally:
+			self._release(key)
+
+	def in_use(self, key):
+		# Whether the run of `key` is inside claim() or reading()
+		with self._lock:
+			return key in self._readers
+
+	def _release(self, key):
+		with self._lock:
+			self._readers[key] -= 1
+			if not self._readers[key]:
+				del self._readers[key]
+
+	def store(self, key, video):
+		# Record a finished run and evict the least recently used runs over the quota
+		now = time.time()
+		entry = {"video": video, "size": directory_size(self.path(key)), "created": now, "last_used": now}
+		with self._lock:
+			self.entries[key] = entry
+			self._evict(key)
+			self._save()
+
+	def discard(self, key):
+		shutil.rmtree(self.path(key), ignore_errors=True)
+
+	def forget(self, key):
+		# The run was deleted or compacted by the retention sweeper
+		with self._lock:
+			if self.entries.pop(key, None) is not None:
+				self._save()
+
+	def record_size(self, key):
+		# The run's files changed size, e.g. after its CSVs were compressed
+		with self._lock:
+			if key in self.entries:
+				self.entries[key]["size"] = directory_size(self.path(key))
+				self._save()
+
+	def adopt(self, key, output_dir, video):
+		# Cache a run produced outside claim(), returns the request id it is found under
+		with self._lock:
+			if key in self.entries:
+				if os.path.abspath(output_dir) != os.path.abspath(self.path(key)):
+					shutil.rmtree(output_dir, ignore_errors=True)
+				self.entries[key]["last_used"] = time.time()
+				self._save()
+				return key
+			if key in self._in_flight:
+				return os.path.basename(output_dir)
+			os.replace(output_dir, self.path(key))
+		self.store(key, video)
+		return key
+
+	def _evict(self, protected):
+		total = sum(entry["size"] for entry in self.entries.values())
+		for key in sorted(self.entries, key=lambda key: self.entries[key]["last_used"]):
+			if total <= self.quota_bytes:
+				break
+			if key == protected or key in self._readers:
+				continue
+			print(f"Evicting cached analysis {key} ({self.entries[key]['video']})")
+			shutil.rmtree(self.path(key), ignore_errors=True)
+			total -= self.entries.pop(key)["size"]
+
+	def _save(self):
+		temp_path = self.index_path + ".tmp"
+		with open(temp_path, 'w') as f:
+			json.dump(self.entries, f, indent=1)
+		os.replace(temp_path, self.index_path)
@@ -0,0 +1,38 @@
+import json
+
+# Bit flags of an annotated box
+VIOLATION = 1
+RESTRICTED = 2
+ABNORMAL = 4
+
+class AnnotationWriter:
+	"""
+	Writes the annotations of every processed frame as JSON lines, for the
+	frontend to draw over the original video instead of encoding a
+	processed one. The first line describes the processed frames, each
+	following line one frame:
+	{"frame", "time", "count", "boxes": [[id, x1, y1, x2, y2, flags, violations]],
+	"warnings": {"violation_count", "restricted", "abnormal"}}
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._file = None
+
+	def write(self, frame_count, time, frame_shape, fps, human_count, boxes, warnings):
+		if self._file is None:
+			self._file = open(self.path, 'w')
+			self._write({
+				"width": frame_shape[1],
+				"height": frame_shape[0],
+				"fps": fps,
+				"flags": {"violation": VIOLATION, "restricted": RESTRICTED, "abnormal": ABNORMAL}
+			})
+		self._write({"frame": frame_count, "time": time, "count": human_count, "boxes": boxes, "warnings": warnings})
+
+	def _write(self, record):
+		self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
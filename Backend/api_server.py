@@ -1,16 +1,29 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, make_response
 from flask_cors import CORS
 import os
 import json
+import contextlib
 import csv
+import math
+import functools
+import gzip
 import subprocess
 import shutil
+import threading
 import uuid
 from werkzeug.utils import secure_filename
 from pathlib import Path
+from config import RESOURCE_CONFIG, ANALYSIS_CACHE_CONFIG, RETENTION_CONFIG, SERVER_CONFIG, LIVE_METRICS_CONFIG
+from resources import CoreAllocator, job_environment
+from analysis_cache import AnalysisCache
+from uploads import UploadSession
+from retention import RetentionManager, SUMMARY_FILENAME
+from job_progress import ProgressBroker, run_with_progress
+from live_metrics import read_live_metrics
 
 app = Flask(__name__)
-CORS(app)
+# Retry-After is read by the frontend when a pool turns a request away
+CORS(app, expose_headers=['Retry-After'])
 
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed_data'
@@ -19,14 +32,101 @@ ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
+# Slow endpoints run in bounded pools, so the fast read endpoints always find a free server thread
+request_pools = {
+    'analysis': threading.BoundedSemaphore(SERVER_CONFIG["ANALYSIS_THREADS"]),
+    'upload': threading.BoundedSemaphore(SERVER_CONFIG["UPLOAD_THREADS"]),
+    'stream': threading.BoundedSemaphore(SERVER_CONFIG["STREAM_THREADS"])
+}
+
+def pool_full(pool):
+    response = jsonify({'error': f'Too many {pool} requests in progress, retry later'})
+    response.headers['Retry-After'] = str(SERVER_CONFIG["RETRY_AFTER"])
+    return response, 503
+
+def pooled(pool):
+    """Run the endpoint in a slot of the pool, answer 503 with Retry-After when all slots are taken"""
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            if not request_pools[pool].acquire(blocking=False):
+                return pool_full(pool)
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                request_pools[pool].release()
+        return wrapper
+    return decorator
+
+# Reserves a CPU budget for each concurrent analysis job
+core_allocator = CoreAllocator(RESOURCE_CONFIG["JOB_CORES"])
+
+# Finished analyses by video content and settings, the least recently used are deleted over the quota
+analysis_cache = None
+if ANALYSIS_CACHE_CONFIG["ENABLED"]:
+    analysis_cache = AnalysisCache(PROCESSED_FOLDER, int(ANALYSIS_CACHE_CONFIG["QUOTA_GB"] * 1024 ** 3))
+
+# Progress events of the running analyses, streamed by /api/progress/<progress_id>
+progress_broker = ProgressBroker()
+
+# Resumable uploads in progress, by upload id
+upload_sessions = {}
+upload_lock = threading.Lock()
+
+def prune_upload_sessions():
+    # Forget uploads that stopped receiving chunks and are not being analysed, their files are left to the sweeper
+    with upload_lock:
+        for (upload_id, session) in list(upload_sessions.items()):
+            if session.idle(SERVER_CONFIG["UPLOAD_SESSION_TIMEOUT"]):
+                del upload_sessions[upload_id]
+
+def active_uploads():
+    # Uploads still receiving chunks or being analysed while they arrive
+    with upload_lock:
+        sessions = list(upload_sessions.values())
+    active = set()
+    for session in sessions:
+        if session.receiving(SERVER_CONFIG["UPLOAD_SESSION_TIMEOUT"]):
+            active.add(os.path.basename(session.partial_path))
+        if session.analysis is not None and session.analysis['thread'].is_alive():
+            active.add(os.path.basename(session.path))
+    return active
+
+def forget_upload(filename):
+    # An upload deleted by the sweeper can no longer be resumed or analysed
+    with upload_lock:
+        for (upload_id, session) in list(upload_sessions.items()):
+            if filename in (os.path.basename(session.path), os.path.basename(session.partial_path)):
+                del upload_sessions[upload_id]
+
+# Compresses, compacts and deletes old runs and uploads in the background
+retention = RetentionManager(PROCESSED_FOLDER, UPLOAD_FOLDER, RETENTION_CONFIG, cache=analysis_cache,
+                             summarize=lambda request_id: get_analysis_results(request_id, touch=False)['summary'],
+                             active_uploads=active_uploads, forget_upload=forget_upload)
+if RETENTION_CONFIG["SWEEP_INTERVAL"] > 0:
+    retention.start()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def send_artifact(path, mimetype, missing_message):
+    """Send a result file with byte ranges for seeking and ETag/Last-Modified validators,
+    so repeat requests are answered with 304 Not Modified"""
+    retention.touch(os.path.dirname(path))
+    try:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+    except FileNotFoundError:
+        return jsonify({'error': missing_message}), 404
+    # Advertise range support on full responses too, browsers only seek when they see it
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'ok', 'message': 'Crowd Analysis API is running'})
 
 @app.route('/api/upload', methods=['POST'])
+@pooled('upload')
 def upload_video():
     if 'video' not in request.files:
         return jsonify({'error': 'No video file provided'}), 400
@@ -48,103 +148,286 @@ def upload_video():
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    Starts a resumable upload.
+    Expects JSON: {"filename": "video.mp4", "size": 123456, "analyze_early": false}
+    The chunks are then PUT to /api/uploads/<upload_id> in order.
+    """
+    data = request.get_json()
+    if not data or not data.get('filename') or not isinstance(data.get('size'), int) or data['size'] <= 0:
+        return jsonify({'error': 'filename and size are required'}), 400
+    if not allowed_file(data['filename']):
+        return jsonify({'error': 'Invalid file type'}), 400
+
+    prune_upload_sessions()
+    session = UploadSession(UPLOAD_FOLDER, secure_filename(data['filename']), data['size'])
+    session.analyze_early = bool(data.get('analyze_early'))
+    with upload_lock:
+        upload_sessions[session.upload_id] = session
+    return jsonify(session.status()), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Report how much of an upload arrived, a client resumes by sending the chunk starting at 'received'"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(session.status())
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@pooled('upload')
+def append_upload(upload_id):
+    """
+    Appends the raw request body to an upload.
+    Expects the header Content-Range: bytes <start>-<end>/<size>, where start is the 'received' offset.
+    The body is streamed to disk without being buffered in memory.
+    """
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        try:
+            (unit, byte_range) = content_range.split(' ', 1)
+            (byte_range, size) = byte_range.split('/', 1)
+            (start, end) = (int(value) for value in byte_range.split('-', 1))
+        except ValueError:
+            return jsonify({'error': f'Invalid Content-Range: {content_range}'}), 400
+        if unit != 'bytes' or size not in ('*', str(session.size)) or end < start:
+            return jsonify({'error': f'Invalid Content-Range: {content_range}'}), 400
+    else:
+        # A single request with the whole file
+        (start, end) = (0, session.size - 1)
+
+    if not session.append(request.stream, start, end - start + 1):
+        return jsonify({'error': 'Chunk does not continue the upload', **session.status()}), 409
+
+    if not session.check():
+        with upload_lock:
+            upload_sessions.pop(upload_id, None)
+        session.discard()
+        return jsonify({'error': 'Not a readable video file'}), 415
+
+    with upload_lock:
+        if session.analyze_early and session.analysis is None and session.followable and not is_cached(session):
+            start_analysis(session)
+    return jsonify(session.status())
+
+def run_analysis(video_path, output_dir, request_id, follow=None, progress_id=None):
+    """
+    Runs main.py and the visualization scripts for one request.
+    Returns None on success, or (error, details) when the analysis failed.
+    Progress events are published under progress_id meanwhile.
+    With follow (the UploadSession of a video still arriving) main.py reads
+    the upload as it grows, and the timeout starts once it is complete.
+    """
+    # The retention sweeper leaves the run and its video alone meanwhile
+    with retention.active(output_dir, video_path):
+        return run_pipeline(video_path, output_dir, request_id, follow, progress_id)
+
+def run_pipeline(video_path, output_dir, request_id, follow, progress_id):
+    # Run analysis with video path and output directory as command-line arguments
+    # No config file modification needed!
+    command = ['python', 'main.py', video_path, output_dir]
+    if follow is not None:
+        command.append('--follow')
+    try:
+        # The job waits for a free CPU budget and is pinned to it
+        progress_broker.publish(progress_id, 'stage', {'stage': 'queued'})
+        with core_allocator.reserve() as cores:
+            if cores is not None:
+                print(f"Reserved cores {cores} for request: {request_id}")
+            progress_broker.publish(progress_id, 'stage', {'stage': 'analysis'})
+            # Frame progress and crowd metrics of the job are forwarded as they arrive
+            result = run_with_progress(
+                command,
+                timeout=SERVER_CONFIG["ANALYSIS_TIMEOUT"],
+                timeout_from=follow.completed if follow is not None else None,
+                on_progress=lambda data: progress_broker.publish(progress_id, 'progress', data),
+                env=job_environment(cores),
+                cores=cores
+            )
+    except subprocess.TimeoutExpired:
+        return f'Analysis timeout (exceeded {SERVER_CONFIG["ANALYSIS_TIMEOUT"]} seconds)', None
+
+    if result.returncode != 0:
+        print(f"ERROR: Analysis failed with return code {result.returncode}")
+        print(f"STDERR: {result.stderr}")
+        print(f"STDOUT: {result.stdout}")
+        return 'Analysis failed', result.stderr
+
+    # Generate visualization plots (run these after main analysis completes)
+    print("Generating visualization plots...")
+    progress_broker.publish(progress_id, 'stage', {'stage': 'visualization'})
+    try:
+        # Generate crowd analysis plot
+        print("Running crowd_data_present.py...")
+        result_viz = subprocess.run(['python', 'crowd_data_present.py', output_dir], 
+                     capture_output=True, text=True, timeout=30)
+        if result_viz.returncode != 0:
+            print(f"Crowd analysis plot error (returncode={result_viz.returncode}):")
+            print(f"STDERR: {result_viz.stderr}")
+            print(f"STDOUT: {result_viz.stdout}")
+        else:
+            print(f"Crowd analysis plot generated successfully")
+    except Exception as e:
+        print(f"Warning: Could not generate crowd analysis plot: {e}")
+    
+    try:
+        # Generate movement heatmap and tracks
+        print("Running movement_data_present.py...")
+        result_viz = subprocess.run(['python', 'movement_data_present.py', output_dir, video_path], 
+                     capture_output=True, text=True, timeout=30)
+        if result_viz.returncode != 0:
+            print(f"Movement visualization error (returncode={result_viz.returncode}):")
+            print(f"STDERR: {result_viz.stderr}")
+            print(f"STDOUT: {result_viz.stdout}")
+        else:
+            print(f"Movement visualizations generated successfully")
+    except Exception as e:
+        print(f"Warning: Could not generate movement visualizations: {e}")
+    
+    try:
+        # Generate energy distribution plot
+        print("Running abnormal_data_process.py...")
+        result_viz = subprocess.run(['python', 'abnormal_data_process.py', output_dir], 
+                     capture_output=True, text=True, timeout=30)
+        if result_viz.returncode != 0:
+            print(f"Energy distribution error (returncode={result_viz.returncode}):")
+            print(f"STDERR: {result_viz.stderr}")
+            print(f"STDOUT: {result_viz.stdout}")
+        else:
+            print(f"Energy distribution plot generated successfully")
+    except Exception as e:
+        print(f"Warning: Could not generate energy distribution plot: {e}")
+    
+    print("Visualization generation complete.")
+    return None
+
+def is_cached(session):
+    # A complete upload whose analysis is already in the cache does not need an early run
+    return session.complete and analysis_cache is not None and analysis_cache.contains(analysis_cache.key(session.path))
+
+def start_analysis(session):
+    """Analyze an upload in the background while it is still arriving, /api/analyze then waits for it"""
+    request_id = str(uuid.uuid4())
+    output_dir = os.path.join(PROCESSED_FOLDER, request_id)
+    os.makedirs(output_dir, exist_ok=True)
+    analysis = {'request_id': request_id, 'error': None}
+    # Streamed under the upload id, until /api/analyze reports the outcome
+    progress_broker.reset(session.upload_id)
+
+    def run():
+        try:
+            analysis['error'] = run_analysis(session.path, output_dir, request_id,
+                                             follow=None if session.complete else session,
+                                             progress_id=session.upload_id)
+        except Exception as e:
+            analysis['error'] = (f'Analysis error: {str(e)}', None)
+
+    print(f"Starting early analysis for request: {request_id} (upload {session.upload_id})")
+    analysis['thread'] = threading.Thread(target=run, daemon=True)
+    analysis['thread'].start()
+    session.analysis = analysis
+
 @app.route('/api/analyze', methods=['POST'])
+@pooled('analysis')
 def analyze_video():
     """
     Analyzes a previously uploaded video file.
-    Expects JSON: {"filename": "video.mp4"}
+    Expects JSON: {"filename": "video.mp4"} or {"upload_id": "..."} for a chunked upload,
+    and optionally "progress_id" (the upload id by default) to follow /api/progress/<progress_id>
     """
     # Get filename from JSON request
     data = request.get_json()
     
-    if not data or 'filename' not in data:
+    if not data or ('filename' not in data and 'upload_id' not in data):
         return jsonify({'error': 'No filename provided in request'}), 400
     
-    filename = data.get('filename')
+    session = None
+    if data.get('upload_id'):
+        session = upload_sessions.get(data['upload_id'])
+        if session is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        if not session.complete and session.analysis is None:
+            return jsonify({'error': 'Upload not complete', **session.status()}), 409
+        filename = os.path.basename(session.path)
+    else:
+        filename = data.get('filename')
     
     if not filename:
         return jsonify({'error': 'Filename is empty'}), 400
     
     # Check if uploaded file exists
     video_path = os.path.join(UPLOAD_FOLDER, filename)
-    if not os.path.exists(video_path):
+    if session is None and not os.path.exists(video_path):
         return jsonify({'error': f'Video file not found: {filename}'}), 404
     
-    # Generate unique request ID for concurrent processing
-    request_id = str(uuid.uuid4())
-    output_dir = os.path.join(PROCESSED_FOLDER, request_id)
-    
-    # Create request-specific output directory
-    os.makedirs(output_dir, exist_ok=True)
-    
-    print(f"Starting analysis for request: {request_id}")
-    print(f"Video: {video_path}")
-    print(f"Output directory: {output_dir}")
-    
+    progress_id = data.get('progress_id') or data.get('upload_id')
+    # Keeps the cached run being answered from eviction until the response is built
+    served = contextlib.ExitStack()
     try:
-        # Run analysis with video path and output directory as command-line arguments
-        # No config file modification needed!
-        result = subprocess.run(
-            ['python', 'main.py', video_path, output_dir],
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
-        
-        if result.returncode != 0:
-            print(f"ERROR: Analysis failed with return code {result.returncode}")
-            print(f"STDERR: {result.stderr}")
-            print(f"STDOUT: {result.stdout}")
-            return jsonify({
-                'error': 'Analysis failed',
-                'details': result.stderr
-            }), 500
-        
-        # Generate visualization plots (run these after main analysis completes)
-        print("Generating visualization plots...")
-        try:
-            # Generate crowd analysis plot
-            print("Running crowd_data_present.py...")
-            result_viz = subprocess.run(['python', 'crowd_data_present.py', output_dir], 
-                         capture_output=True, text=True, timeout=30)
-            if result_viz.returncode != 0:
-                print(f"Crowd analysis plot error (returncode={result_viz.returncode}):")
-                print(f"STDERR: {result_viz.stderr}")
-                print(f"STDOUT: {result_viz.stdout}")
-            else:
-                print(f"Crowd analysis plot generated successfully")
-        except Exception as e:
-            print(f"Warning: Could not generate crowd analysis plot: {e}")
-        
-        try:
-            # Generate movement heatmap and tracks
-            print("Running movement_data_present.py...")
-            result_viz = subprocess.run(['python', 'movement_data_present.py', output_dir, video_path], 
-                         capture_output=True, text=True, timeout=30)
-            if result_viz.returncode != 0:
-                print(f"Movement visualization error (returncode={result_viz.returncode}):")
-                print(f"STDERR: {result_viz.stderr}")
-                print(f"STDOUT: {result_viz.stdout}")
+        cached = False
+        early = session is not None and session.analysis is not None
+        if early:
+            # Started while the upload was arriving
+            print(f"Waiting for early analysis of request: {session.analysis['request_id']}")
+            session.analysis['thread'].join()
+            if session.analysis['error'] is not None and session.complete:
+                # The upload stalled or broke off while it was followed, the complete video is analysed again
+                print(f"Early analysis {session.analysis['request_id']} failed, analysing the complete upload")
+                early = False
+        if early:
+            request_id = session.analysis['request_id']
+            error = session.analysis['error']
+            if error is None and analysis_cache is not None:
+                # Keep the early run for later requests of the same video
+                key = analysis_cache.key(video_path)
+                served.enter_context(analysis_cache.reading(key))
+                request_id = analysis_cache.adopt(key, os.path.join(PROCESSED_FOLDER, request_id), filename)
+                session.analysis['request_id'] = request_id
+        elif analysis_cache is not None:
+            # The request ID of a cached run is its key, identical videos analysed with identical settings share it
+            request_id = analysis_cache.key(video_path)
+            progress_broker.reset(progress_id)
+            cached = served.enter_context(analysis_cache.claim(request_id))
+            if cached:
+                print(f"Returning cached analysis {request_id} for {filename}")
+                error = None
             else:
-                print(f"Movement visualizations generated successfully")
-        except Exception as e:
-            print(f"Warning: Could not generate movement visualizations: {e}")
-        
-        try:
-            # Generate energy distribution plot
-            print("Running abnormal_data_process.py...")
-            result_viz = subprocess.run(['python', 'abnormal_data_process.py', output_dir], 
-                         capture_output=True, text=True, timeout=30)
-            if result_viz.returncode != 0:
-                print(f"Energy distribution error (returncode={result_viz.returncode}):")
-                print(f"STDERR: {result_viz.stderr}")
-                print(f"STDOUT: {result_viz.stdout}")
-            else:
-                print(f"Energy distribution plot generated successfully")
-        except Exception as e:
-            print(f"Warning: Could not generate energy distribution plot: {e}")
+                output_dir = analysis_cache.path(request_id)
+                print(f"Starting analysis for request: {request_id}")
+                print(f"Video: {video_path}")
+                print(f"Output directory: {output_dir}")
+                error = run_analysis(video_path, output_dir, request_id, progress_id=progress_id)
+                if error is None:
+                    analysis_cache.store(request_id, filename)
+                else:
+                    analysis_cache.discard(request_id)
+        else:
+            # Generate unique request ID for concurrent processing
+            request_id = str(uuid.uuid4())
+            output_dir = os.path.join(PROCESSED_FOLDER, request_id)
+            
+            # Create request-specific output directory
+            os.makedirs(output_dir, exist_ok=True)
+            
+            print(f"Starting analysis for request: {request_id}")
+            print(f"Video: {video_path}")
+            print(f"Output directory: {output_dir}")
+            progress_broker.reset(progress_id)
+            error = run_analysis(video_path, output_dir, request_id, progress_id=progress_id)
         
-        print("Visualization generation complete.")
+        if error is not None:
+            (message, details) = error
+            progress_broker.publish(progress_id, 'failed', {'error': message}, close=True)
+            response = {'error': message}
+            if details is not None:
+                response['details'] = details
+            return jsonify(response), 500
 
         # Read and return analysis results
         print("Calling get_analysis_results()...")
@@ -155,6 +438,7 @@ def analyze_video():
             'success': True,
             'request_id': request_id,
             'filename': filename,
+            'cached': cached,
             'data': analysis_data
         }
         print(f"Response data created successfully")
@@ -165,24 +449,80 @@ def analyze_video():
         import json
         response = make_response(json.dumps(response_data, sort_keys=False))
         response.headers['Content-Type'] = 'application/json'
+        progress_broker.publish(progress_id, 'done', {'request_id': request_id, 'cached': cached}, close=True)
         return response
     
-    except subprocess.TimeoutExpired:
-        return jsonify({'error': 'Analysis timeout (exceeded 5 minutes)'}), 500
-    
     except Exception as e:
         print(f"EXCEPTION CAUGHT: {type(e).__name__}: {str(e)}")
+        progress_broker.publish(progress_id, 'failed', {'error': f'Analysis error: {str(e)}'}, close=True)
         import traceback
         print("Full traceback:")
         traceback.print_exc()
         return jsonify({'error': f'Analysis error: {str(e)}'}), 500
+    finally:
+        served.close()
 
+@app.route('/api/progress/<progress_id>', methods=['GET'])
+def stream_progress(progress_id):
+    """
+    Server-sent events of the analysis started with this progress_id, connect before POST /api/analyze.
+    Events: 'stage' (queued, analysis, visualization), 'progress' (frame, total_frames, fps and the
+    crowd metrics of the latest frame), then 'done' with the request_id or 'failed' with the error, which end the stream.
+    """
+    # A stream holds its thread while the analysis runs, so streams get their own pool
+    if not request_pools['stream'].acquire(blocking=False):
+        return pool_full('stream')
+
+    def events():
+        for message in progress_broker.subscribe(progress_id):
+            if message is None:
+                # Keeps proxies from closing an idle stream, and finds disconnected clients
+                yield ': keepalive\n\n'
+                continue
+            (event, data) = message
+            yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
 
-def get_analysis_results(request_id):
+    response = app.response_class(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Unbuffered behind nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(request_pools['stream'].release)
+    return response
+
+@app.route('/api/live/<stream>', methods=['GET'])
+def get_live_metrics(stream):
+    """
+    Latest crowd metrics of a running live source (main.py in IS_CAM mode or a multi_stream.py stream),
+    with its records of the last ?seconds=, read from shared memory without touching the disk.
+    """
+    try:
+        seconds = float(request.args.get('seconds', LIVE_METRICS_CONFIG["WINDOW_SECONDS"]))
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if not math.isfinite(seconds) or seconds <= 0:
+        return jsonify({'error': 'seconds must be a positive number'}), 400
+    metrics = read_live_metrics(stream, seconds)
+    if metrics is None:
+        return jsonify({'error': f'No live stream named {stream} is running'}), 404
+    response = jsonify(metrics)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def open_csv(path):
+    # The retention sweeper gzips the CSVs of finished runs
+    if os.path.exists(path):
+        return open(path, 'r')
+    return gzip.open(path + '.gz', 'rt')
+
+def get_analysis_results(request_id, touch=True):
     print("Starting get_analysis_results()...")
     
     # Use request-specific output directory
     output_dir = os.path.join(PROCESSED_FOLDER, request_id)
+    # Reading the results counts as a use for the retention sweeper, compacting a run does not
+    if touch:
+        retention.touch(output_dir)
     
     results = {
         'video_data': {},
@@ -205,9 +545,9 @@ def get_analysis_results(request_id):
     # Read crowd data
     print("Reading crowd data...")
     crowd_data_path = os.path.join(output_dir, 'crowd_data.csv')
-    if os.path.exists(crowd_data_path):
+    if os.path.exists(crowd_data_path) or os.path.exists(crowd_data_path + '.gz'):
         try:
-            with open(crowd_data_path, 'r') as f:
+            with open_csv(crowd_data_path) as f:
                 reader = csv.DictReader(f)
                 # Clean None values from rows to prevent JSON serialization errors
                 results['crowd_data'] = [
@@ -222,9 +562,9 @@ def get_analysis_results(request_id):
     # Read movement data
     print("Reading movement data...")
     movement_data_path = os.path.join(output_dir, 'movement_data.csv')
-    if os.path.exists(movement_data_path):
+    if os.path.exists(movement_data_path) or os.path.exists(movement_data_path + '.gz'):
         try:
-            with open(movement_data_path, 'r') as f:
+            with open_csv(movement_data_path) as f:
                 reader = csv.DictReader(f)
                 # Clean None values from rows to prevent JSON serialization errors
                 results['movement_data'] = [
@@ -236,6 +576,12 @@ def get_analysis_results(request_id):
             print(f"Error reading movement data: {e}")
             results['movement_data'] = []
     
+    # Compacted runs only kept the summary of their CSVs
+    summary_path = os.path.join(output_dir, SUMMARY_FILENAME)
+    if not results['crowd_data'] and os.path.exists(summary_path):
+        with open(summary_path, 'r') as f:
+            results['summary'] = json.load(f)
+    
     # Calculate summary statistics
     print("Calculating summary statistics...")
     if results['crowd_data']:
@@ -289,8 +635,25 @@ def get_analysis_results(request_id):
 
 @app.route('/api/results', methods=['GET'])
 def get_results():
-    results = get_analysis_results()
-    return jsonify(results)
+    """Results of a finished analysis, as /api/analyze returned them"""
+    request_id = request.args.get('request_id', '')
+    if not request_id or request_id != secure_filename(request_id) or not os.path.isdir(os.path.join(PROCESSED_FOLDER, request_id)):
+        return jsonify({'error': 'Analysis results not found'}), 404
+    results = get_analysis_results(request_id)
+    # Use json.dumps with sort_keys=False to avoid NoneType comparison errors
+    response = make_response(json.dumps(results, sort_keys=False))
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+@app.route('/api/storage', methods=['GET'])
+def get_storage():
+    """Disk usage of every analysis run and upload, with the retention quota and the last sweep"""
+    return jsonify(retention.usage())
+
+@app.route('/api/storage/sweep', methods=['POST'])
+def sweep_storage():
+    """Run the retention sweep now instead of waiting for the next interval"""
+    return jsonify(retention.sweep())
 
 @app.route('/api/visualizations/heatmap', methods=['GET'])
 def get_heatmap():
@@ -301,9 +664,7 @@ def get_heatmap():
         heatmap_path = os.path.join(PROCESSED_FOLDER, 'heatmap.png')
     else:
         heatmap_path = os.path.join(PROCESSED_FOLDER, request_id, 'heatmap.png')
-    if os.path.exists(heatmap_path):
-        return send_file(heatmap_path, mimetype='image/png')
-    return jsonify({'error': 'Heatmap not available'}), 404
+    return send_artifact(heatmap_path, 'image/png', 'Heatmap not available')
 
 @app.route('/api/visualizations/movement-tracks', methods=['GET'])
 def get_movement_tracks():
@@ -313,9 +674,7 @@ def get_movement_tracks():
         tracks_path = os.path.join(PROCESSED_FOLDER, 'movement_tracks.png')
     else:
         tracks_path = os.path.join(PROCESSED_FOLDER, request_id, 'movement_tracks.png')
-    if os.path.exists(tracks_path):
-        return send_file(tracks_path, mimetype='image/png')
-    return jsonify({'error': 'Movement tracks not available'}), 404
+    return send_artifact(tracks_path, 'image/png', 'Movement tracks not available')
 
 @app.route('/api/visualizations/crowd-analysis', methods=['GET'])
 def get_crowd_analysis():
@@ -325,9 +684,7 @@ def get_crowd_analysis():
         crowd_path = os.path.join(PROCESSED_FOLDER, 'crowd_analysis.png')
     else:
         crowd_path = os.path.join(PROCESSED_FOLDER, request_id, 'crowd_analysis.png')
-    if os.path.exists(crowd_path):
-        return send_file(crowd_path, mimetype='image/png')
-    return jsonify({'error': 'Crowd analysis plot not available'}), 404
+    return send_artifact(crowd_path, 'image/png', 'Crowd analysis plot not available')
 
 @app.route('/api/visualizations/energy-distribution', methods=['GET'])
 def get_energy_distribution():
@@ -340,9 +697,7 @@ def get_energy_distribution():
         # Fallback to non-cleaned version if cleaned doesn't exist
         if not os.path.exists(energy_path):
             energy_path = os.path.join(PROCESSED_FOLDER, request_id, 'energy_distribution.png')
-    if os.path.exists(energy_path):
-        return send_file(energy_path, mimetype='image/png')
-    return jsonify({'error': 'Energy distribution plot not available'}), 404
+    return send_artifact(energy_path, 'image/png', 'Energy distribution plot not available')
 
 @app.route('/api/visualizations', methods=['GET'])
 def list_visualizations():
@@ -363,9 +718,17 @@ def get_processed_video():
         video_path = os.path.join(PROCESSED_FOLDER, 'processed_video.mp4')
     else:
         video_path = os.path.join(PROCESSED_FOLDER, request_id, 'processed_video.mp4')
-    if os.path.exists(video_path):
-        return send_file(video_path, mimetype='video/mp4')
-    return jsonify({'error': 'Processed video not available'}), 404
+    return send_artifact(video_path, 'video/mp4', 'Processed video not available')
+
+@app.route('/api/annotations', methods=['GET'])
+def get_annotations():
+    """Serve the per-frame annotation track (JSON lines) drawn over the original video in overlay mode"""
+    request_id = request.args.get('request_id', 'latest')
+    if request_id == 'latest':
+        annotations_path = os.path.join(PROCESSED_FOLDER, 'annotations.jsonl')
+    else:
+        annotations_path = os.path.join(PROCESSED_FOLDER, request_id, 'annotations.jsonl')
+    return send_artifact(annotations_path, 'application/x-ndjson', 'Annotations not available')
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -377,5 +740,7 @@ if __name__ == '__main__':
     print("   - /api/visualizations/movement-tracks")
     print("   - /api/visualizations/crowd-analysis")
     print("   - /api/visualizations/energy-distribution")
+    print("⚠️  Development server, run python serve.py in production")
     print("=" * 60)
-    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
+    # Debug mode only on request, FLASK_DEBUG=1
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000, use_reloader=False, threaded=True)
@@ -0,0 +1,344 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import imutils
+import cv2
+from config import DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE
+from deep_sort import linear_assignment
+from deep_sort import nn_matching
+from deep_sort.iou_matching import iou
+from deep_sort.tracker import Tracker
+from resources import available_cores, job_environment, pin_to_cores
+
+
+def _gated_cost_matrix(num_people, rng, gate, frame_size=(1920, 1080)):
+    """Build a synthetic cost matrix for a crowd of `num_people`, where only
+    detections within `gate` pixels of a track are feasible.
+    """
+    tracks = rng.uniform((0, 0), frame_size, size=(num_people, 2))
+    detections = tracks + rng.normal(0., 10., size=tracks.shape)
+    distances = np.linalg.norm(tracks[:, None, :] - detections[None, :, :], axis=2)
+    cost_matrix = distances / gate
+    cost_matrix[distances > gate] = linear_assignment.INFTY_COST
+    return cost_matrix
+
+
+def _matches(cost_matrix, max_distance, indices):
+    return {(row, col) for row, col in indices if cost_matrix[row, col] <= max_distance}
+
+
+def benchmark_assignment(args):
+    rng = np.random.default_rng(args.seed)
+    max_distance = 0.7
+    print("%8s %12s %16s %8s" % ("people", "dense (ms)", "partitioned (ms)", "equal"))
+    for num_people in args.sizes:
+        cost_matrix = _gated_cost_matrix(num_people, rng, args.gate)
+        cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            dense = linear_assignment._dense_assignment(cost_matrix.copy())
+        dense_time = (time.perf_counter() - t0) / args.repeat
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            partitioned = linear_assignment._partitioned_assignment(
+                cost_matrix.copy(), max_distance)
+        partitioned_time = (time.perf_counter() - t0) / args.repeat
+
+        dense = _matches(cost_matrix, max_distance, dense)
+        partitioned = _matches(cost_matrix, max_distance, partitioned)
+        dense_cost = sum(cost_matrix[m] for m in dense)
+        partitioned_cost = sum(cost_matrix[m] for m in partitioned)
+        equal = len(dense) == len(partitioned) and np.isclose(dense_cost, partitioned_cost)
+        print("%8d %12.3f %16.3f %8s" % (
+            num_people, dense_time * 1000, partitioned_time * 1000, equal))
+
+
+def _load_models(precision="fp32"):
+    # Imported here so that benchmarks without the re-ID model do not load TensorFlow
+    from tracking import load_detector, load_encoder
+
+    net, ln = load_detector(precision)
+    return net, ln, load_encoder(precision)
+
+
+def _create_tracker(detect_interval=1):
+    metric = nn_matching.NearestNeighborDistanceMetric("cosine", 0.7, None)
+    max_age = min(DATA_RECORD_RATE * TRACK_MAX_AGE, 30)
+    return Tracker(metric, max_age=max(1, int(max_age / detect_interval)))
+
+
+def _sampled_frames(video_path, max_frames):
+    """Return the first `max_frames` frames `video_process` would process,
+    resized to FRAME_SIZE.
+    """
+    # video_process imports the re-ID encoder module, see _load_models
+    from video_process import _read_frames
+
+    cap = cv2.VideoCapture(video_path)
+    data_record_frame = max(1, int(cap.get(cv2.CAP_PROP_FPS) / DATA_RECORD_RATE))
+    frames = []
+    for frame_count, frame in _read_frames(cap, FRAME_SIZE, data_record_frame):
+        if len(frames) == max_frames:
+            break
+        if frame is not None:
+            frames.append((frame_count, frame))
+    cap.release()
+    return frames
+
+
+def _run_tracking(models, frames, detect_interval):
+    """Track frames the way `video_process` does and return the confirmed
+    track boxes (tlwh) and track IDs of every frame and the processing FPS.
+    """
+    from tracking import detect_human, track_human, tracker_uncertain
+    from video_process import _detect_in_batches
+
+    net, ln, encoder = models
+    tracker = _create_tracker(detect_interval)
+    boxes, ids = [], []
+    t0 = time.perf_counter()
+    for frame_count, frame, detections in _detect_in_batches(
+            iter(frames), net, ln, 1, detect_interval):
+        if detections is not None or tracker_uncertain(tracker):
+            humans, _, _ = detect_human(
+                net, ln, frame, encoder, tracker, frame_count, frame_count,
+                detections)
+        else:
+            humans, _, _ = track_human(tracker)
+        boxes.append(np.array([track.to_tlwh() for track in humans]).reshape(-1, 4))
+        ids.append([track.track_id for track in humans])
+    fps = len(boxes) / (time.perf_counter() - t0)
+    return boxes, ids, fps
+
+
+def _match_boxes(reference, candidate, min_iou=0.5):
+    """Greedily match the candidate boxes of a frame to its reference boxes.
+
+    Returns
+    -------
+    List[(int, int)]
+        Indices of matched reference and candidate boxes.
+
+    """
+    pairs = []
+    available = np.ones(len(candidate), dtype=bool)
+    for i, box in enumerate(reference):
+        if not available.any():
+            break
+        overlaps = iou(box, candidate)
+        overlaps[~available] = 0.
+        best = np.argmax(overlaps)
+        if overlaps[best] >= min_iou:
+            available[best] = False
+            pairs.append((i, best))
+    return pairs
+
+
+def _compare_boxes(reference, candidate, min_iou=0.5):
+    """Greedily match candidate boxes to reference boxes per frame.
+
+    Returns
+    -------
+    (float, float, float)
+        Recall and precision of the candidate boxes at `min_iou`, and the mean
+        absolute error of the per-frame box counts.
+
+    """
+    matched, num_reference, num_candidate, count_error = 0, 0, 0, 0
+    for ref, cand in zip(reference, candidate):
+        num_reference += len(ref)
+        num_candidate += len(cand)
+        count_error += abs(len(ref) - len(cand))
+        matched += len(_match_boxes(ref, cand, min_iou))
+    recall = matched / num_reference if num_reference else 1.
+    precision = matched / num_candidate if num_candidate else 1.
+    return recall, precision, count_error / max(1, len(reference))
+
+
+def _id_agreement(reference, reference_ids, candidate, candidate_ids, min_iou=0.5):
+    """Fraction of matched boxes whose candidate track ID is the one most often
+    paired with their reference track ID.
+    """
+    pairs = {}
+    for ref, ref_ids, cand, cand_ids in zip(reference, reference_ids, candidate, candidate_ids):
+        for i, j in _match_boxes(ref, cand, min_iou):
+            counts = pairs.setdefault(ref_ids[i], {})
+            counts[cand_ids[j]] = counts.get(cand_ids[j], 0) + 1
+    total = sum(sum(counts.values()) for counts in pairs.values())
+    agreed = sum(max(counts.values()) for counts in pairs.values())
+    return agreed / total if total else 1.
+
+
+def benchmark_detect_interval(args):
+    models = _load_models()
+    frames = _sampled_frames(args.video, args.max_frames)
+    reference, _, reference_fps = _run_tracking(models, frames, 1)
+    print("%9s %8s %8s %10s %10s" % ("interval", "fps", "recall", "precision", "count MAE"))
+    print("%9d %8.2f %8.3f %10.3f %10.3f" % (1, reference_fps, 1., 1., 0.))
+    for interval in args.intervals:
+        if interval == 1:
+            continue
+        boxes, _, fps = _run_tracking(models, frames, interval)
+        recall, precision, count_mae = _compare_boxes(reference, boxes)
+        print("%9d %8.2f %8.3f %10.3f %10.3f" % (interval, fps, recall, precision, count_mae))
+
+
+def benchmark_detect_batch(args):
+    from tracking import detect_frames
+
+    net, ln, _ = _load_models()
+    frames = [frame for _, frame in _sampled_frames(args.video, args.max_frames)]
+    print("%6s %8s" % ("batch", "fps"))
+    for batch_size in args.batch_sizes:
+        t0 = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            detect_frames(net, ln, frames[i:i + batch_size])
+        print("%6d %8.2f" % (batch_size, len(frames) / (time.perf_counter() - t0)))
+
+
+def benchmark_detect_resolution(args):
+    from tracking import detect_frames
+
+    net, ln, _ = _load_models()
+    frames = [frame for _, frame in _sampled_frames(args.video, args.max_frames)]
+    settings = [(size, (tiles, tiles)) for tiles in args.tiles for size in args.input_sizes]
+    results = []
+    for input_size, tiles in settings:
+        t0 = time.perf_counter()
+        boxes = [np.array(detections[0], dtype=np.float64).reshape(-1, 4) for frame in frames
+                 for detections in detect_frames(net, ln, [frame], input_size, tiles)]
+        results.append((input_size, tiles, boxes, len(frames) / (time.perf_counter() - t0)))
+
+    # The largest input with the most tiles serves as the recall reference
+    reference = max(results, key=lambda r: (r[1], r[0]))
+    print("Reference: input %d, tiles %dx%d" % (reference[0], reference[1][0], reference[1][1]))
+    print("%6s %6s %8s %8s %10s" % ("input", "tiles", "fps", "recall", "people"))
+    for input_size, tiles, boxes, fps in results:
+        recall, _, _ = _compare_boxes(reference[2], boxes)
+        print("%6d %6s %8.2f %8.3f %10.2f" % (
+            input_size, "%dx%d" % tiles, fps, recall, np.mean([len(b) for b in boxes])))
+
+
+def benchmark_precision(args):
+    frames = _sampled_frames(args.video, args.max_frames)
+    reference, reference_ids, reference_fps = _run_tracking(_load_models("fp32"), frames, 1)
+    print("%9s %8s %8s %10s %10s %8s" % (
+        "precision", "fps", "recall", "precision", "count MAE", "ID agree"))
+    print("%9s %8.2f %8.3f %10.3f %10.3f %8.3f" % ("fp32", reference_fps, 1., 1., 0., 1.))
+    for precision in args.precisions:
+        boxes, ids, fps = _run_tracking(_load_models(precision), frames, 1)
+        recall, box_precision, count_mae = _compare_boxes(reference, boxes)
+        agreement = _id_agreement(reference, reference_ids, boxes, ids)
+        print("%9s %8.2f %8.3f %10.3f %10.3f %8.3f" % (
+            precision, fps, recall, box_precision, count_mae, agreement))
+
+
+def benchmark_concurrency(args):
+    cap = cv2.VideoCapture(args.video)
+    frame_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    cores = available_cores()
+    print("%5s %10s %10s %14s" % ("jobs", "cores/job", "wall (s)", "aggregate fps"))
+    for num_jobs in args.jobs:
+        cores_per_job = max(1, len(cores) // num_jobs)
+        with tempfile.TemporaryDirectory() as output_root:
+            t0 = time.perf_counter()
+            processes = []
+            for i in range(num_jobs):
+                # Jobs beyond the core count share cores round-robin
+                start = (i * cores_per_job) % len(cores)
+                job_cores = cores[start:start + cores_per_job]
+                processes.append(pin_to_cores(subprocess.Popen(
+                    [sys.executable, "main.py", args.video, "%s/job%d" % (output_root, i)],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    env=job_environment(job_cores)), job_cores))
+            failed = sum(process.wait() != 0 for process in processes)
+            wall = time.perf_counter() - t0
+        print("%5d %10d %10.2f %14.2f%s" % (
+            num_jobs, cores_per_job, wall, frame_total * num_jobs / wall,
+            "  (%d failed)" % failed if failed else ""))
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Crowd analysis benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    assignment = subparsers.add_parser(
+        "assignment", help="Dense vs partitioned track assignment scaling")
+    assignment.add_argument(
+        "--sizes", type=int, nargs="+", default=[50, 100, 200, 400, 800],
+        help="Crowd sizes to benchmark.")
+    assignment.add_argument(
+        "--gate", type=float, default=30.,
+        help="Distance in pixels beyond which a track/detection pair is gated.")
+    assignment.add_argument("--repeat", type=int, default=5)
+    assignment.add_argument("--seed", type=int, default=0)
+    assignment.set_defaults(func=benchmark_assignment)
+
+    detect_interval = subparsers.add_parser(
+        "detect-interval",
+        help="Accuracy and speed of DETECT_INTERVAL against full detection")
+    detect_interval.add_argument(
+        "--video", default="uploads/Testing_video.mp4", help="Reference clip.")
+    detect_interval.add_argument(
+        "--intervals", type=int, nargs="+", default=[2, 3, 5],
+        help="Detection intervals to compare with detection on every frame.")
+    detect_interval.add_argument("--max_frames", type=int, default=300)
+    detect_interval.set_defaults(func=benchmark_detect_interval)
+
+    detect_batch = subparsers.add_parser(
+        "detect-batch", help="Detector throughput per DETECT_BATCH_SIZE")
+    detect_batch.add_argument(
+        "--video", default="uploads/Testing_video.mp4", help="Reference clip.")
+    detect_batch.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    detect_batch.add_argument("--max_frames", type=int, default=200)
+    detect_batch.set_defaults(func=benchmark_detect_batch)
+
+    detect_resolution = subparsers.add_parser(
+        "detect-resolution",
+        help="Throughput and recall per detector input size and tiling")
+    detect_resolution.add_argument(
+        "--video", default="uploads/Testing_video.mp4", help="Reference clip.")
+    detect_resolution.add_argument(
+        "--input_sizes", type=int, nargs="+", default=[320, 416, 608])
+    detect_resolution.add_argument(
+        "--tiles", type=int, nargs="+", default=[1, 2],
+        help="Tile grids to compare, N means NxN tiles.")
+    detect_resolution.add_argument("--max_frames", type=int, default=100)
+    detect_resolution.set_defaults(func=benchmark_detect_resolution)
+
+    precision = subparsers.add_parser(
+        "precision", help="Accuracy and speed of quantized models against FP32")
+    precision.add_argument(
+        "--video", default="uploads/Testing_video.mp4", help="Reference clip.")
+    precision.add_argument(
+        "--precisions", nargs="+", choices=["fp16", "int8"], default=["fp16", "int8"])
+    precision.add_argument("--max_frames", type=int, default=300)
+    precision.set_defaults(func=benchmark_precision)
+
+    concurrency = subparsers.add_parser(
+        "concurrency",
+        help="Aggregate throughput of concurrent main.py jobs with per-job core budgets")
+    concurrency.add_argument(
+        "--video", default="uploads/Testing_video.mp4", help="Video analysed by every job.")
+    concurrency.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+    concurrency.set_defaults(func=benchmark_concurrency)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import datetime
+import threading
+import time
+import numpy as np
+import imutils
+
+def is_file_source(source):
+	# Webcam indexes and stream URLs are live, anything else is a video file
+	source = str(source)
+	return not source.isdigit() and "://" not in source
+
+class FrameReader(threading.Thread):
+	"""
+	Reads a capture in the background and keeps only its newest frame.
+	A frame that was not picked up before the next one arrives is dropped,
+	so a consumer that falls behind skips frames instead of letting them
+	queue up. With `paced` the frames are released at the capture's frame
+	rate, so video files can stand in for cameras.
+	"""
+
+	def __init__(self, cap, frame_size, paced=False, fps=0):
+		super().__init__(daemon=True)
+		self.cap = cap
+		self.frame_size = frame_size
+		self.interval = 1 / fps if paced and fps > 0 else 0
+
+		self.frames_read = 0
+		self.frames_dropped = 0
+		self._frame = None
+		self._captured_at = None
+		self._finished = False
+		self._stopped = threading.Event()
+		self._condition = threading.Condition()
+
+	def run(self):
+		next_time = time.time()
+		while not self._stopped.is_set():
+			(ret, frame) = self.cap.read()
+			if not ret:
+				break
+			if self.interval:
+				next_time += self.interval
+				self._stopped.wait(max(0, next_time - time.time()))
+			captured_at = time.time()
+			frame = imutils.resize(frame, width=self.frame_size)
+			with self._condition:
+				if self._frame is not None:
+					self.frames_dropped += 1
+				self._frame = frame
+				self._captured_at = captured_at
+				self.frames_read += 1
+				self._condition.notify()
+		self.cap.release()
+		with self._condition:
+			self._finished = True
+			self._condition.notify()
+
+	def stop(self):
+		self._stopped.set()
+
+	def frames(self):
+		# Yield (frame_count, frame, captured_at) with the newest frame each time the consumer asks for one
+		while True:
+			with self._condition:
+				while self._frame is None and not self._finished:
+					self._condition.wait()
+				if self._frame is None:
+					return
+				(frame, self._frame) = (self._frame, None)
+				(frame_count, captured_at) = (self.frames_read, self._captured_at)
+			yield frame_count, frame, captured_at
+
+class LiveFrames:
+	"""
+	Frames of a live source in the form video_process expects. The latency
+	of every frame, from capture until the next frame is requested, is
+	measured. While the smoothed latency exceeds `latency_budget` detection
+	runs on fewer frames and the tracker extrapolates in between, once the
+	latency is back under half the budget the interval shrinks again.
+	Frames the optional `motion_gate` reports as static are not detected.
+	"""
+
+	def __init__(self, reader, detect, latency_budget, min_interval=1, max_interval=1, motion_gate=None, latency_data_writer=None):
+		self.reader = reader
+		self.detect = detect
+		self.motion_gate = motion_gate
+		self.latency_budget = latency_budget
+		self.min_interval = min_interval
+		self.max_interval = max(min_interval, max_interval)
+		self.detect_interval = min_interval
+		self.latency_data_writer = latency_data_writer
+
+		self.latency = None
+		self.latencies = []
+		self._dropped = 0
+
+	def __iter__(self):
+		captured_at = None
+		since_detection = 0
+		for (frame_count, frame, next_captured_at) in self.reader.frames():
+			if captured_at is not None:
+				self._record(time.time() - captured_at)
+			captured_at = next_captured_at
+			detections = None
+			if since_detection % self.detect_interval == 0:
+				since_detection = 0
+				if self.motion_gate is None or not self.motion_gate.is_static(frame):
+					detections = self.detect(frame)
+			since_detection += 1
+			yield frame_count, frame, detections
+		if captured_at is not None:
+			self._record(time.time() - captured_at)
+
+	def _record(self, latency):
+		self.latencies.append(latency)
+		self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+		if self.latency > self.latency_budget:
+			self.detect_interval = min(self.detect_interval + 1, self.max_interval)
+		elif self.latency < self.latency_budget / 2:
+			self.detect_interval = max(self.detect_interval - 1, self.min_interval)
+
+		dropped = self.reader.frames_dropped - self._dropped
+		self._dropped = self.reader.frames_dropped
+		if self.latency_data_writer is not None:
+			self.latency_data_writer.writerow([datetime.datetime.now(), round(latency * 1000, 1), dropped, self.detect_interval])
+
+	def stats(self):
+		latencies = np.array(self.latencies) * 1000
+		return {
+			"FRAMES_READ": self.reader.frames_read,
+			"FRAMES_DROPPED": self.reader.frames_dropped,
+			"MEAN_LATENCY_MS": round(float(latencies.mean()), 1) if len(latencies) else 0,
+			"P95_LATENCY_MS": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else 0,
+			"FINAL_DETECT_INTERVAL": self.detect_interval
+		}
@@ -0,0 +1,290 @@
+from config import YOLO_CONFIG, VIDEO_CONFIG, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE, DETECT_INTERVAL, CHUNK_OVERLAP, STITCH_DISTANCE,\
+	OUTPUT_VIDEO_CONFIG
+
+# Size the BLAS thread pool before numpy loads it
+from resources import limit_blas_threads, limit_opencv_threads, available_cores, job_environment, pin_to_cores
+limit_blas_threads()
+
+import argparse
+import datetime
+import subprocess
+import time
+import numpy as np
+import cv2
+import os
+import sys
+import csv
+import json
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cosine
+from video_writer import BackgroundVideoWriter
+from data_recorder import CrowdDataRecorder, MovementDataRecorder
+from deep_sort import nn_matching
+from deep_sort.tracker import Tracker
+
+class RecordingTracker(Tracker):
+	"""
+	Tracker of one chunk that keeps every track it records and the re-ID
+	feature of each track at `snapshot_time`, the start of the chunk proper.
+	"""
+
+	def __init__(self, metric, max_age, snapshot_time):
+		super().__init__(metric, max_age=max_age)
+		self.snapshot_time = snapshot_time
+		self.snapshot = None
+		self.recorded = []
+
+	def update(self, detections, time, frame_index):
+		expired = super().update(detections, time, frame_index)
+		self.recorded.extend(expired)
+		if self.snapshot is None and time > self.snapshot_time:
+			self.snapshot = {track.track_id: track.last_feature for track in self.tracks}
+		return expired
+
+class _Rows:
+	# Stands in for a movement data recorder, the chunk's movement data is saved with the features instead
+	def record(self, track_id, entry_time, exit_time, positions):
+		pass
+
+	def flush_due(self):
+		pass
+
+	def flush(self):
+		pass
+
+	def stats(self):
+		return {}
+
+def _chunk_ranges(frame_count, data_record_frame, chunks, overlap):
+	# (warmup start, start, end) frame positions of every chunk, boundaries fall on sampled frames
+	size = int(np.ceil(frame_count / chunks / data_record_frame)) * data_record_frame
+	ranges = []
+	for start in range(0, frame_count, size):
+		ranges.append((max(0, start - overlap), start, min(frame_count, start + size)))
+	return ranges
+
+def process_chunk(video_path, output_dir, warmup_start, start, end):
+	# Imported here so that the parent process does not load TensorFlow
+	from video_process import video_process
+	from tracking import load_detector, load_encoder
+
+	limit_opencv_threads()
+	(net, ln) = load_detector(YOLO_CONFIG["PRECISION"])
+	encoder = load_encoder(YOLO_CONFIG["PRECISION"])
+	cap = cv2.VideoCapture(video_path)
+
+	max_cosine_distance = 0.7
+	nn_budget = None
+	max_age = min(DATA_RECORD_RATE * TRACK_MAX_AGE, 30)
+	# Track age only advances on detection frames
+	max_age = max(1, int(max_age / DETECT_INTERVAL))
+	metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
+	tracker = RecordingTracker(metric, max_age, start)
+
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+	crowd_data_writer = CrowdDataRecorder(os.path.join(output_dir, 'crowd_data.csv'))
+	(_, processing_stats) = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, _Rows(), crowd_data_writer, output_dir,
+		show_output=False, start_frame=warmup_start, end_frame=end)
+	crowd_data_writer.close()
+	cap.release()
+
+	# Tracks recorded during the chunk and those still running at its end
+	snapshot = tracker.snapshot or {}
+	tracks = []
+	for track in tracker.recorded + [t for t in tracker.tracks if t.is_confirmed()]:
+		start_feature = snapshot.get(track.track_id)
+		tracks.append({
+			"id": track.track_id,
+			"entry": track.entry,
+			"exit": track.exit,
+			"positions": track.positions.tolist(),
+			# Frame count of every position
+			"frames": track.frames.tolist(),
+			"feature": track.last_feature.tolist(),
+			"start_feature": None if start_feature is None else start_feature.tolist()
+		})
+	with open(os.path.join(output_dir, 'chunk_data.json'), 'w') as chunk_data_file:
+		json.dump({"PROCESSING_STATS": processing_stats, "TRACKS": tracks}, chunk_data_file)
+
+def _window_positions(track, low, high):
+	return {frame: position for frame, position in zip(track["frames"], track["positions"]) if low < frame <= high}
+
+def _stitch(previous, tracks, low, high, min_frames=3, max_cosine_distance=0.7):
+	"""
+	Match the tracks of a chunk that started in its warmup window (low, high]
+	to the tracks of the previous chunks running in the same window. Both
+	chunks detect the same frames there, so the same person has nearly the
+	same centroids in both, the re-ID features break ties between people
+	walking close together.
+	"""
+	candidates = [track for track in previous if track["exit"] > low]
+	incoming = [i for i, track in enumerate(tracks) if track["entry"] <= high]
+	cost_matrix = np.full((len(candidates), len(incoming)), np.inf)
+	for row, track in enumerate(candidates):
+		positions = _window_positions(track, low, high)
+		for col, i in enumerate(incoming):
+			other_positions = _window_positions(tracks[i], low, high)
+			common = positions.keys() & other_positions.keys()
+			if len(common) < min_frames:
+				continue
+			distance = np.mean([np.linalg.norm(np.subtract(positions[frame], other_positions[frame])) for frame in common])
+			feature = tracks[i]["start_feature"] or tracks[i]["feature"]
+			appearance = cosine(track["feature"], feature)
+			if distance <= STITCH_DISTANCE and appearance <= max_cosine_distance:
+				cost_matrix[row, col] = distance / STITCH_DISTANCE + appearance
+	if cost_matrix.size == 0:
+		return {}
+	feasible = np.isfinite(cost_matrix)
+	(rows, cols) = linear_sum_assignment(np.where(feasible, cost_matrix, 1e5))
+	return {incoming[col]: candidates[row] for row, col in zip(rows, cols) if feasible[row, col]}
+
+def merge_chunks(chunk_dirs, ranges):
+	# Join the tracks of consecutive chunks into tracks with global IDs
+	# Also returns the global ID of every chunk's track IDs
+	merged = []
+	crowd_rows = []
+	id_maps = []
+	next_id = 1
+	for chunk_dir, (warmup_start, start, end) in zip(chunk_dirs, ranges):
+		with open(os.path.join(chunk_dir, 'chunk_data.json')) as chunk_data_file:
+			tracks = json.load(chunk_data_file)["TRACKS"]
+		# Frame counts of the chunk's warmup window
+		(low, high) = (warmup_start, start)
+		matches = _stitch(merged, tracks, low, high) if start > 0 else {}
+		id_map = {}
+		for i, track in sorted(enumerate(tracks), key=lambda item: item[1]["id"]):
+			if i in matches:
+				# Continue the earlier track with the positions after the window
+				joined = matches[i]
+				keep = [j for j, frame in enumerate(joined["frames"]) if frame <= high]
+				later = [j for j, frame in enumerate(track["frames"]) if frame > high]
+				joined["positions"] = [joined["positions"][j] for j in keep] + [track["positions"][j] for j in later]
+				joined["frames"] = [joined["frames"][j] for j in keep] + [track["frames"][j] for j in later]
+				joined["exit"] = track["exit"]
+				joined["feature"] = track["feature"]
+				id_map[track["id"]] = joined["id"]
+			elif track["frames"][-1] > high:
+				id_map[track["id"]] = next_id
+				track["id"] = next_id
+				next_id += 1
+				merged.append(track)
+			# Tracks that ended inside the window belong to the previous chunk
+		id_maps.append(id_map)
+		with open(os.path.join(chunk_dir, 'crowd_data.csv'), newline='') as crowd_data_file:
+			reader = csv.reader(crowd_data_file)
+			# Skip the header
+			next(reader)
+			crowd_rows += [row for row in reader if start < int(row[0]) <= end]
+	return merged, crowd_rows, id_maps
+
+def _merge_annotations(chunk_dirs, ranges, id_maps, output_dir):
+	# Concatenate the chunk annotation tracks without the warmup frames, with global track IDs
+	with open(os.path.join(output_dir, 'annotations.jsonl'), 'w') as annotation_file:
+		for i, (chunk_dir, (warmup_start, start, end), id_map) in enumerate(zip(chunk_dirs, ranges, id_maps)):
+			with open(os.path.join(chunk_dir, 'annotations.jsonl')) as chunk_annotation_file:
+				header = chunk_annotation_file.readline()
+				if i == 0:
+					annotation_file.write(header)
+				for line in chunk_annotation_file:
+					record = json.loads(line)
+					if not start < record["frame"] <= end:
+						continue
+					for box in record["boxes"]:
+						box[0] = id_map.get(box[0], box[0])
+					annotation_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+def _merge_videos(chunk_dirs, ranges, data_record_frame, output_dir, fps):
+	# Concatenate the processed chunk videos, leaving out the warmup frames
+	preview_path = os.path.join(output_dir, 'processed_video_preview.mp4') if OUTPUT_VIDEO_CONFIG["PREVIEW"] else None
+	out = BackgroundVideoWriter(os.path.join(output_dir, 'processed_video.mp4'), fps / data_record_frame, preview_path=preview_path)
+	out.start()
+	for chunk_dir, (warmup_start, start, end) in zip(chunk_dirs, ranges):
+		cap = cv2.VideoCapture(os.path.join(chunk_dir, 'processed_video.mp4'))
+		warmup_frames = start // data_record_frame - warmup_start // data_record_frame
+		(ret, frame) = cap.read()
+		while ret:
+			if warmup_frames > 0:
+				warmup_frames -= 1
+			else:
+				out.write(frame, block=True)
+			(ret, frame) = cap.read()
+		cap.release()
+	out.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Analyse one video in parallel chunks")
+	parser.add_argument("video")
+	parser.add_argument("output_dir")
+	parser.add_argument("--chunks", type=int, default=0, help="number of worker processes, 0 uses one per 4 cores")
+	parser.add_argument("--chunk", type=int, nargs=3, metavar=("WARMUP_START", "START", "END"), help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.chunk:
+		process_chunk(args.video, args.output_dir, *args.chunk)
+		return
+
+	cap = cv2.VideoCapture(args.video)
+	VID_FPS = cap.get(cv2.CAP_PROP_FPS)
+	FRAME_COUNT = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+	cap.release()
+	DATA_RECORD_FRAME = int(VID_FPS / DATA_RECORD_RATE)
+
+	cores = available_cores()
+	chunks = args.chunks or max(1, len(cores) // 4)
+	ranges = _chunk_ranges(FRAME_COUNT, DATA_RECORD_FRAME, chunks, int(CHUNK_OVERLAP * VID_FPS))
+	cores_per_chunk = max(1, len(cores) // len(ranges))
+	chunk_dirs = [os.path.join(args.output_dir, "chunks", "chunk_{}".format(i)) for i in range(len(ranges))]
+	print("Processing {} frames in {} chunks".format(FRAME_COUNT, len(ranges)))
+
+	START_TIME = time.time()
+	workers = []
+	for i, (chunk_dir, chunk_range) in enumerate(zip(chunk_dirs, ranges)):
+		# Each worker gets its own block of cores, like the jobs started by api_server
+		chunk_cores = cores[i * cores_per_chunk:(i + 1) * cores_per_chunk] or None
+		workers.append(pin_to_cores(subprocess.Popen([sys.executable, os.path.abspath(__file__), args.video, chunk_dir, "--chunk"] + [str(frame) for frame in chunk_range],
+			env=job_environment(chunk_cores)), chunk_cores))
+	for i, worker in enumerate(workers):
+		if worker.wait() != 0:
+			print("Chunk {} failed".format(i))
+			sys.exit(1)
+	PROCESS_TIME = time.time() - START_TIME
+
+	(tracks, crowd_rows, id_maps) = merge_chunks(chunk_dirs, ranges)
+	movement_data_writer = MovementDataRecorder(os.path.join(args.output_dir, 'movement_data.csv'))
+	for track in sorted(tracks, key=lambda track: (track["exit"], track["id"])):
+		movement_data_writer.record(track["id"], track["entry"], track["exit"], track["positions"])
+	movement_data_writer.close()
+	crowd_data_writer = CrowdDataRecorder(os.path.join(args.output_dir, 'crowd_data.csv'))
+	for row in crowd_rows:
+		crowd_data_writer.record(*map(int, row))
+	crowd_data_writer.close()
+	if OUTPUT_VIDEO_CONFIG["MODE"] == "overlay":
+		_merge_annotations(chunk_dirs, ranges, id_maps, args.output_dir)
+	else:
+		_merge_videos(chunk_dirs, ranges, DATA_RECORD_FRAME, args.output_dir, VID_FPS)
+
+	chunk_stats = []
+	for chunk_dir in chunk_dirs:
+		with open(os.path.join(chunk_dir, 'chunk_data.json')) as chunk_data_file:
+			chunk_stats.append(json.load(chunk_data_file)["PROCESSING_STATS"])
+	print("Time elapsed: ", PROCESS_TIME)
+	print("Processed FPS: ", round(FRAME_COUNT / PROCESS_TIME, 2))
+	START_TIME = VIDEO_CONFIG["START_TIME"]
+	END_TIME = START_TIME + datetime.timedelta(seconds=round(FRAME_COUNT / VID_FPS))
+	video_data = {
+		"IS_CAM": False,
+		"DATA_RECORD_FRAME" : DATA_RECORD_FRAME,
+		"VID_FPS" : VID_FPS,
+		"PROCESSED_FRAME_SIZE": FRAME_SIZE,
+		"TRACK_MAX_AGE": TRACK_MAX_AGE,
+		"START_TIME": START_TIME.strftime("%d/%m/%Y, %H:%M:%S"),
+		"END_TIME": END_TIME.strftime("%d/%m/%Y, %H:%M:%S"),
+		"PROCESSING_STATS": {"CHUNKS": chunk_stats}
+	}
+	with open(os.path.join(args.output_dir, 'video_data.json'), 'w') as video_data_file:
+		json.dump(video_data, video_data_file)
+	print(f"Analysis complete! Results saved to: {args.output_dir}")
+
+if __name__ == "__main__":
+	main()
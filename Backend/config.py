@@ -6,13 +6,43 @@ VIDEO_CONFIG = {
 	"IS_CAM" : False,
 	"CAM_APPROX_FPS": 3,
 	"HIGH_CAM": False,
+	# Live sources, end-to-end latency (seconds) above which detection runs on fewer frames
+	"LATENCY_BUDGET": 0.5,
+	# Live sources, largest detection interval the latency budget may raise DETECT_INTERVAL to
+	"MAX_DETECT_INTERVAL": 5,
 	"START_TIME": datetime.datetime(2020, 11, 5, 0, 0, 0, 0)
 }
 
 # Load YOLOv3-tiny weights and config
 YOLO_CONFIG = {
 	"WEIGHTS_PATH" : "YOLOv4-tiny/yolov4-tiny.weights",
-	"CONFIG_PATH" : "YOLOv4-tiny/yolov4-tiny.cfg"
+	"CONFIG_PATH" : "YOLOv4-tiny/yolov4-tiny.cfg",
+	# Network input size (320, 416 or 608)
+	"INPUT_SIZE" : 416,
+	# Output decoding, "coco" keeps detections whose best class is person,
+	# "person" thresholds the person score alone and skips the other 79 classes
+	"DECODE_PROFILE" : "coco",
+	# Re-ID appearance model
+	"REID_MODEL_PATH" : "model_data/mars-small128.pb",
+	# Model precision, "fp32", "fp16" or "int8" (run quantize_models.py first)
+	"PRECISION" : "fp32",
+	# Detector calibration frames for int8, regenerate after changing INPUT_SIZE
+	"CALIBRATION_PATH" : "YOLOv4-tiny/calibration.npy"
+}
+# Processed video output
+OUTPUT_VIDEO_CONFIG = {
+	# "burned" draws the annotations into processed_video.mp4, "overlay" writes them to
+	# annotations.jsonl for the frontend to draw over the original video, without encoding
+	"MODE": "burned",
+	# Codecs tried in order until an encoder opens, H.264 plays in every browser
+	"CODECS": ["avc1", "H264", "X264", "XVID", "mp4v"],
+	# Frames waiting for the encoder before processing waits for it
+	"QUEUE_SIZE": 64,
+	# Also write a smaller processed_video_preview.mp4
+	"PREVIEW": False,
+	"PREVIEW_WIDTH": 480,
+	# Preview keeps every Nth frame
+	"PREVIEW_STEP": 2
 }
 # Show individuals detected
 SHOW_PROCESSING_OUTPUT = True
@@ -50,4 +80,112 @@ NMS_THRESH = 0.2
 # Resize frame for processing
 FRAME_SIZE = 1080
 # Tracker max missing age before removing (seconds)
-TRACK_MAX_AGE = 3
\ No newline at end of file
+TRACK_MAX_AGE = 3
+# Run detection every N processed frames, tracks are extrapolated in between
+DETECT_INTERVAL = 1
+# Number of frames passed through the detector in one forward pass
+DETECT_BATCH_SIZE = 1
+# Split frames into (columns, rows) overlapping tiles for detection, (1, 1) disables tiling
+DETECT_TILES = (1, 1)
+# Fraction of a tile shared with its neighbour
+TILE_OVERLAP = 0.2
+# Skip detection on frames that barely changed since the last detection (fixed cameras)
+MOTION_GATE = False
+# Fraction of changed pixels below which a frame is static
+MOTION_THRESH = 0.002
+# Reuse a track's re-ID feature when a detection overlaps its predicted box by at least this IoU (above 1 disables)
+REID_REUSE_IOU = 0.9
+# CPU budget of the processing stages, 0 leaves the library default
+RESOURCE_CONFIG = {
+	# Cores reserved for each analysis job started by api_server, 0 disables budgets
+	"JOB_CORES": 0,
+	# Pin each job to its reserved cores (Linux only)
+	"PIN_CPUS": True,
+	# Threads per stage, 0 uses the job's core count when a budget is set
+	"OPENCV_THREADS": 0,
+	"TF_INTRA_OP_THREADS": 0,
+	"TF_INTER_OP_THREADS": 0,
+	"BLAS_THREADS": 0
+}
+# Production serving of api_server (serve.py)
+SERVER_CONFIG = {
+	"BIND": "0.0.0.0:5000",
+	# Server processes. Uploads in progress, running analyses and CPU budgets are tracked per process,
+	# and the analyses themselves run in their own processes, so one process with threads is enough
+	"WORKERS": 1,
+	# Threads for the fast endpoints (health, results, artifacts, storage)
+	"READ_THREADS": 16,
+	# Concurrent /api/analyze requests, further ones are answered 503 with Retry-After
+	"ANALYSIS_THREADS": 4,
+	# Concurrent uploads and upload chunks, further ones are answered 503 with Retry-After
+	"UPLOAD_THREADS": 4,
+	# Concurrent progress streams, each holds a thread while its analysis runs
+	"STREAM_THREADS": 16,
+	# Seconds suggested to clients turned away by a full pool
+	"RETRY_AFTER": 5,
+	# Seconds a main.py analysis may run before it is stopped, for an upload analysed while it arrives
+	# counted from the moment it is complete
+	"ANALYSIS_TIMEOUT": 300,
+	# Seconds an unfinished upload may go without chunks before it is forgotten and can no longer be resumed
+	"UPLOAD_SESSION_TIMEOUT": 3600,
+	# Seconds a silent worker or idle client connection is given before it is closed
+	"TIMEOUT": 120,
+	# Seconds a keep-alive connection waits for the next request
+	"KEEPALIVE": 5
+}
+# Finished analyses reused for repeated requests of the same video and settings (api_server)
+ANALYSIS_CACHE_CONFIG = {
+	"ENABLED": True,
+	# Disk space (GB) of cached runs in processed_data above which the least recently used are deleted
+	"QUOTA_GB": 20
+}
+# Clean-up of processed_data and uploads by the api_server background sweeper
+RETENTION_CONFIG = {
+	# Seconds between sweeps, 0 disables the sweeper
+	"SWEEP_INTERVAL": 600,
+	# Seconds after a run was last used before its CSVs are gzipped
+	"COMPRESS_AFTER": 0,
+	# Days after a run was last used before its videos and CSVs are dropped, keeping its summary and plots
+	"COMPACT_AFTER_DAYS": 3,
+	# Days after a run was last used before it is deleted
+	"DELETE_AFTER_DAYS": 30,
+	# Days after an upload arrived before it is deleted
+	"UPLOAD_MAX_AGE_DAYS": 2,
+	# Disk space (GB) of processed_data and uploads above which the least recently used are deleted, 0 disables
+	"QUOTA_GB": 50,
+	# Also delete the least recently used while less than this much disk space (GB) is free
+	"MIN_FREE_GB": 5,
+	# Runs that are never cleaned up (the sample outputs shown in the Readme)
+	"PINNED_RUNS": ["3503d1a8-4604-4f34-9339-802ebac47648"]
+}
+# Seconds between the progress events an analysis job streams to the frontend
+PROGRESS_INTERVAL = 0.25
+# Buffered writing of crowd_data.csv and movement_data.csv
+RECORD_CONFIG = {
+	# Rows kept in memory before they are written as one block
+	"BUFFER_ROWS": 1024,
+	# Live sources also write rows once they are this many seconds old, 0 waits for a full buffer
+	"FLUSH_INTERVAL": 5,
+	# fsync after every written block, so rows written survive a crash or power loss
+	"FSYNC": True
+}
+# Latest crowd metrics of live sources in shared memory, served by /api/live/<stream>
+LIVE_METRICS_CONFIG = {
+	"ENABLED": True,
+	# Stream name main.py publishes under in IS_CAM mode, multi_stream.py uses stream_<n>
+	"STREAM": "cam",
+	# Processed frames kept in the ring buffer of each stream
+	"CAPACITY": 4096,
+	# Default seconds of history returned with the latest metrics
+	"WINDOW_SECONDS": 60
+}
+# Switch to density counting without re-ID and tracking above this many detections, 0 disables
+DENSITY_SWITCH_COUNT = 150
+# (columns, rows) grid used to extrapolate the crowd count from detection density
+DENSITY_GRID = (8, 6)
+# Seconds the shared detector of multi_stream.py waits for other streams to fill a batch
+STREAM_BATCH_WAIT = 0.02
+# Seconds of video before each chunk boundary processed by both neighbouring chunks (chunked_process.py)
+CHUNK_OVERLAP = 3
+# Mean centroid distance (pixels) in the overlap under which tracks of neighbouring chunks are joined
+STITCH_DISTANCE = 30
@@ -0,0 +1,126 @@
+import csv
+import os
+import time
+import numpy as np
+from config import RECORD_CONFIG
+
+CROWD_DATA_HEADER = ['Time', 'Human Count', 'Social Distance violate', 'Restricted Entry', 'Abnormal Activity']
+MOVEMENT_DATA_HEADER = ['Track ID', 'Entry time', 'Exit Time', 'Movement Tracks']
+
+class _BufferedRecorder:
+	"""
+	Rows buffered in preallocated buffers and written to a CSV file in
+	blocks of `buffer_rows`, instead of one write per row. With
+	`flush_interval` (live sources) buffered rows are also written once
+	they are that many seconds old. Every flush ends with an fsync when
+	`fsync` is set, so the rows written survive a crash.
+	"""
+
+	header = None
+
+	def __init__(self, path, buffer_rows=RECORD_CONFIG["BUFFER_ROWS"], flush_interval=None, fsync=RECORD_CONFIG["FSYNC"]):
+		self.path = path
+		self.buffer_rows = buffer_rows
+		self.flush_interval = flush_interval or None
+		self.fsync = fsync
+		self._file = open(path, 'w', newline='')
+		self._writer = csv.writer(self._file)
+		self._writer.writerow(self.header)
+		self._rows = 0
+		self._oldest = None
+
+		self.rows_written = 0
+		self.flushes = 0
+		self.write_time = 0
+
+	def _added(self):
+		# Called after a row was buffered
+		if self._rows == 1:
+			self._oldest = time.monotonic()
+		if self._rows == self.buffer_rows:
+			self.flush()
+
+	def flush_due(self):
+		# Write the buffered rows of a live source once the oldest waited flush_interval seconds
+		if self.flush_interval is not None and self._rows and time.monotonic() - self._oldest >= self.flush_interval:
+			self.flush()
+
+	def flush(self):
+		t0 = time.perf_counter()
+		if self._rows:
+			self._writer.writerows(self._buffered_rows())
+			self.rows_written += self._rows
+			self._rows = 0
+		self._file.flush()
+		if self.fsync:
+			os.fsync(self._file.fileno())
+		self.flushes += 1
+		self.write_time += time.perf_counter() - t0
+
+	def close(self):
+		if self._file.closed:
+			return
+		self.flush()
+		self._file.close()
+
+	def stats(self):
+		return {
+			"ROWS": self.rows_written + self._rows,
+			"FLUSHES": self.flushes,
+			"WRITE_MS_PER_FLUSH": round(self.write_time / max(1, self.flushes) * 1000, 3)
+		}
+
+class CrowdDataRecorder(_BufferedRecorder):
+	"""crowd_data.csv, one row per recorded frame, time is a frame count or a datetime"""
+
+	header = CROWD_DATA_HEADER
+
+	def __init__(self, path, **kwargs):
+		super().__init__(path, **kwargs)
+		# Preallocated row slots, storing five scalars in a numpy row costs more than the whole csv row
+		self._buffer = [None] * self.buffer_rows
+
+	def record(self, record_time, human_count, violate_count, restricted_entry, abnormal_activity):
+		self._buffer[self._rows] = (record_time, human_count, violate_count, int(restricted_entry), int(abnormal_activity))
+		self._rows += 1
+		self._added()
+
+	def _buffered_rows(self):
+		return self._buffer[:self._rows]
+
+class MovementDataRecorder(_BufferedRecorder):
+	"""
+	movement_data.csv, one row per finished track: its ID, entry and exit
+	time and the flattened (x, y) positions, copied into one growing array.
+	"""
+
+	header = MOVEMENT_DATA_HEADER
+
+	def __init__(self, path, **kwargs):
+		super().__init__(path, **kwargs)
+		self._ids = np.empty(self.buffer_rows, dtype=np.int64)
+		# Frame counts, or datetimes of live sources
+		self._times = np.empty((self.buffer_rows, 2), dtype=object)
+		# Row i holds _positions[_ends[i - 1]:_ends[i]]
+		self._ends = np.empty(self.buffer_rows, dtype=np.int64)
+		self._positions = np.empty(self.buffer_rows * 64, dtype=np.int32)
+
+	def record(self, track_id, entry_time, exit_time, positions):
+		start = self._ends[self._rows - 1] if self._rows else 0
+		positions = np.ravel(positions)
+		if start + len(positions) > len(self._positions):
+			self._positions = np.concatenate((self._positions[:start],
+				np.empty(max(len(self._positions), len(positions)), dtype=np.int32)))
+		self._positions[start:start + len(positions)] = positions
+		self._ids[self._rows] = track_id
+		self._times[self._rows] = (entry_time, exit_time)
+		self._ends[self._rows] = start + len(positions)
+		self._rows += 1
+		self._added()
+
+	def _buffered_rows(self):
+		starts = np.concatenate(([0], self._ends[:self._rows - 1])).tolist()
+		positions = self._positions[:self._ends[self._rows - 1]].tolist()
+		return ([track_id, entry_time, exit_time] + positions[start:end]
+			for (track_id, (entry_time, exit_time), start, end)
+			in zip(self._ids[:self._rows].tolist(), self._times[:self._rows], starts, self._ends[:self._rows].tolist()))
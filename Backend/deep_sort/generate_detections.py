@@ -75,8 +75,11 @@ def extract_image_patch(image, bbox, patch_shape):
 
 class ImageEncoder(object):
 
-    def __init__(self, checkpoint_filename, input_name="images", output_name="features"):
-        self.session = tf.Session()
+    def __init__(self, checkpoint_filename, input_name="images", output_name="features",
+                 intra_op_threads=0, inter_op_threads=0):
+        self.session = tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads))
         with tf.gfile.GFile(checkpoint_filename, "rb") as file_handle:
             graph_def = tf.GraphDef()
             graph_def.ParseFromString(file_handle.read())
@@ -102,8 +105,42 @@ class ImageEncoder(object):
         return out
 
 
-def create_box_encoder(model_filename, input_name="images:0", output_name="features:0", batch_size=32):
-    image_encoder = ImageEncoder(model_filename, input_name, output_name)
+class TFLiteImageEncoder(object):
+
+    def __init__(self, model_filename, num_threads=0):
+        self.interpreter = tf.lite.Interpreter(
+            model_path=model_filename, num_threads=num_threads or None)
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.feature_dim = int(self.output_detail["shape"][-1])
+        self.image_shape = [int(d) for d in self.input_detail["shape"][1:]]
+        self._batch_size = None
+
+    def __call__(self, data_x, batch_size=32):
+        out = np.zeros((len(data_x), self.feature_dim), np.float32)
+        _run_in_batches(self._run, {"images": data_x}, out, batch_size)
+        return out
+
+    def _run(self, batch_data_dict):
+        data_x = batch_data_dict["images"]
+        if self._batch_size != len(data_x):
+            self.interpreter.resize_tensor_input(
+                self.input_detail["index"], [len(data_x)] + self.image_shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(data_x)
+        self.interpreter.set_tensor(
+            self.input_detail["index"], data_x.astype(self.input_detail["dtype"]))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_detail["index"])
+
+
+def create_box_encoder(model_filename, input_name="images:0", output_name="features:0", batch_size=32,
+                       intra_op_threads=0, inter_op_threads=0):
+    if model_filename.endswith(".tflite"):
+        image_encoder = TFLiteImageEncoder(model_filename, intra_op_threads)
+    else:
+        image_encoder = ImageEncoder(
+            model_filename, input_name, output_name, intra_op_threads, inter_op_threads)
     image_shape = image_encoder.image_shape
 
     def encoder(image, boxes):
@@ -2,11 +2,17 @@
 from __future__ import absolute_import
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from . import kalman_filter
 
 
 INFTY_COST = 1e+5
 
+# Cost matrices with at least this many entries are split into the connected
+# components of their gated bipartite graph before solving.
+PARTITION_MIN_SIZE = 800 * 800
+
 
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
@@ -54,16 +60,49 @@ def min_cost_matching(
 
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
+    return _solve_cost_matrix(
+        cost_matrix, max_distance, track_indices, detection_indices)
+
+
+def _solve_cost_matrix(
+        cost_matrix, max_distance, track_indices, detection_indices):
+    """Solve the assignment problem for a precomputed cost matrix.
+
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix, where N is the number of track indices
+        and M is the number of detection indices. Modified in place.
+    max_distance : float
+        Gating threshold. Associations with cost larger than this value are
+        disregarded.
+    track_indices : List[int]
+        List of track indices that maps rows in `cost_matrix` to tracks.
+    detection_indices : List[int]
+        List of detection indices that maps columns in `cost_matrix` to
+        detections.
+
+    Returns
+    -------
+    (List[(int, int)], List[int], List[int])
+        Returns a tuple with the following three entries:
+        * A list of matched track and detection indices.
+        * A list of unmatched track indices.
+        * A list of unmatched detection indices.
+
+    """
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_sum_assignment(cost_matrix)
-    indices = np.asarray(indices)
-    indices = np.transpose(indices)
+    if cost_matrix.size >= PARTITION_MIN_SIZE:
+        indices = _partitioned_assignment(cost_matrix, max_distance)
+    else:
+        indices = _dense_assignment(cost_matrix)
+    matched_rows, matched_cols = set(indices[:, 0]), set(indices[:, 1])
     matches, unmatched_tracks, unmatched_detections = [], [], []
     for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
+        if col not in matched_cols:
             unmatched_detections.append(detection_idx)
     for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
+        if row not in matched_rows:
             unmatched_tracks.append(track_idx)
     for row, col in indices:
         track_idx = track_indices[row]
@@ -76,6 +115,86 @@ def min_cost_matching(
     return matches, unmatched_tracks, unmatched_detections
 
 
+def _dense_assignment(cost_matrix):
+    """Solve the assignment problem over the full cost matrix.
+
+    Returns
+    -------
+    ndarray
+        A Kx2 integer array of assigned (row, col) pairs.
+
+    """
+    if cost_matrix.shape[0] == 1:
+        # A single track: the optimal assignment is the cheapest detection.
+        return np.array([[0, np.argmin(cost_matrix[0])]])
+    if cost_matrix.shape[1] == 1:
+        # A single detection: the optimal assignment is the cheapest track.
+        return np.array([[np.argmin(cost_matrix[:, 0]), 0]])
+    return np.transpose(np.asarray(linear_sum_assignment(cost_matrix)))
+
+
+def _partitioned_assignment(cost_matrix, max_distance):
+    """Solve the assignment problem independently on each connected component
+    of the gated bipartite graph.
+
+    Pairs with cost above `max_distance` all carry the same cost and are
+    discarded after solving, so the optimal assignment never benefits from
+    crossing components. Solving the components separately therefore yields
+    the same matches as the dense solve, at a fraction of the cubic cost when
+    most pairs are gated.
+
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix, already clipped at `max_distance`.
+    max_distance : float
+        Gating threshold. Associations with cost larger than this value are
+        disregarded.
+
+    Returns
+    -------
+    ndarray
+        A Kx2 integer array of assigned (row, col) pairs. Only pairs inside a
+        component are returned.
+
+    """
+    num_rows = cost_matrix.shape[0]
+    num_nodes = num_rows + cost_matrix.shape[1]
+    edge_rows, edge_cols = np.nonzero(cost_matrix <= max_distance)
+    graph = coo_matrix(
+        (np.ones(len(edge_rows), dtype=bool), (edge_rows, edge_cols + num_rows)),
+        shape=(num_nodes, num_nodes))
+    _, labels = connected_components(graph, directed=False)
+    row_labels, col_labels = labels[:num_rows], labels[num_rows:]
+
+    # Components made of exactly one track and one detection are matched
+    # directly; only larger components go through the solver.
+    num_labels = labels.max() + 1
+    row_counts = np.bincount(row_labels, minlength=num_labels)
+    col_counts = np.bincount(col_labels, minlength=num_labels)
+    is_pair = (row_counts == 1) & (col_counts == 1)
+    pair_rows = np.flatnonzero(is_pair[row_labels])
+    pair_cols = np.flatnonzero(is_pair[col_labels])
+    pair_cols = pair_cols[np.argsort(col_labels[pair_cols])]
+    pair_rows = pair_rows[np.argsort(row_labels[pair_rows])]
+    indices = [np.c_[pair_rows, pair_cols]]
+
+    is_group = (row_counts > 0) & (col_counts > 0) & ~is_pair
+    group_rows = np.flatnonzero(is_group[row_labels])
+    group_cols = np.flatnonzero(is_group[col_labels])
+    group_rows = group_rows[np.argsort(row_labels[group_rows], kind="stable")]
+    group_cols = group_cols[np.argsort(col_labels[group_cols], kind="stable")]
+    row_splits = np.cumsum(row_counts[np.unique(row_labels[group_rows])])[:-1]
+    col_splits = np.cumsum(col_counts[np.unique(col_labels[group_cols])])[:-1]
+    for rows, cols in zip(
+            np.split(group_rows, row_splits), np.split(group_cols, col_splits)):
+        if len(rows) == 0:
+            continue
+        sub_indices = _dense_assignment(cost_matrix[np.ix_(rows, cols)])
+        indices.append(np.c_[rows[sub_indices[:, 0]], cols[sub_indices[:, 1]]])
+    return np.concatenate(indices)
+
+
 def matching_cascade(
         distance_metric, max_distance, cascade_depth, tracks, detections,
         track_indices=None, detection_indices=None):
@@ -120,22 +239,32 @@ def matching_cascade(
     if detection_indices is None:
         detection_indices = list(range(len(detections)))
 
-    unmatched_detections = detection_indices
+    unmatched_detections = list(detection_indices)
     matches = []
-    for level in range(cascade_depth):
+
+    # Group tracks by age so that only non-empty levels are visited.
+    levels = {}
+    for row, k in enumerate(track_indices):
+        level = tracks[k].time_since_update - 1
+        if 0 <= level < cascade_depth:
+            levels.setdefault(level, []).append(row)
+    if len(levels) == 0 or len(unmatched_detections) == 0:
+        return matches, list(track_indices), unmatched_detections
+
+    # Compute the gated cost matrix once and slice it for every level.
+    cost_matrix = distance_metric(
+        tracks, detections, track_indices, unmatched_detections)
+    column_of = {idx: col for col, idx in enumerate(unmatched_detections)}
+    for level in sorted(levels):
         if len(unmatched_detections) == 0:  # No detections left
             break
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
-        if len(track_indices_l) == 0:  # Nothing to match at this level
-            continue
-
+        rows = levels[level]
+        cols = [column_of[idx] for idx in unmatched_detections]
+        track_indices_l = [track_indices[row] for row in rows]
         matches_l, _, unmatched_detections = \
-            min_cost_matching(
-                distance_metric, max_distance, tracks, detections,
+            _solve_cost_matrix(
+                cost_matrix[np.ix_(rows, cols)], max_distance,
                 track_indices_l, unmatched_detections)
         matches += matches_l
     unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+import numpy as np
 
 
 class TrackState:
@@ -31,6 +32,12 @@ class Track:
         Covariance matrix of the initial state distribution.
     track_id : int
         A unique track identifier.
+    entry : int | datetime
+        Time of the detection this track originates from.
+    position : array_like
+        Centroid of the detection this track originates from.
+    frame_index : int
+        Index of the frame of the detection this track originates from.
     n_init : int
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
@@ -61,11 +68,24 @@ class Track:
     features : List[ndarray]
         A cache of features. On each measurement update, the associated feature
         vector is added to this list.
+    last_feature : ndarray | NoneType
+        The feature vector of the most recent associated detection.
+    positions : ndarray
+        An Nx2 int32 array of the centroids recorded on track creation and on
+        each measurement update (a view into the growable history buffer).
+    frames : ndarray
+        An int32 array with the index of the frame each row of `positions`
+        was recorded on.
 
     """
 
-    def __init__(self, mean, covariance, track_id, entry, position, n_init, 
-        max_age, feature=None):
+    __slots__ = (
+        "mean", "covariance", "track_id", "hits", "age", "time_since_update",
+        "state", "features", "last_feature", "_n_init", "_max_age", "_positions", "_frames",
+        "_num_positions", "entry", "exit")
+
+    def __init__(self, mean, covariance, track_id, entry, position, frame_index,
+        n_init, max_age, feature=None):
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
@@ -77,17 +97,41 @@ class Track:
         self.features = []
         if feature is not None:
             self.features.append(feature)
+        self.last_feature = feature
 
         self._n_init = n_init
         self._max_age = max_age
 
         # Movement trails, recorded by centroids
-        self.positions = [position]
+        self._positions = np.empty((16, 2), dtype=np.int32)
+        self._frames = np.empty(16, dtype=np.int32)
+        self._num_positions = 0
+        self._record_position(position, frame_index)
 
         # Initial detection
         self.entry = entry
         self.exit = None
 
+    @property
+    def positions(self):
+        return self._positions[:self._num_positions]
+
+    @property
+    def frames(self):
+        return self._frames[:self._num_positions]
+
+    def _record_position(self, position, frame_index):
+        """Append a centroid and the index of its frame to the movement trail,
+        doubling the history buffers when they are full.
+        """
+        if self._num_positions == len(self._frames):
+            capacity = 2 * len(self._frames)
+            self._positions = np.resize(self._positions, (capacity, 2))
+            self._frames = np.resize(self._frames, capacity)
+        self._positions[self._num_positions] = position
+        self._frames[self._num_positions] = frame_index
+        self._num_positions += 1
+
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
         width, height)`.
@@ -117,7 +161,7 @@ class Track:
         ret[2:] = ret[:2] + ret[2:]
         return ret
 
-    def predict(self, kf):
+    def predict(self, kf, coast=False):
         """Propagate the state distribution to the current time step using a
         Kalman filter prediction step.
 
@@ -125,13 +169,17 @@ class Track:
         ----------
         kf : kalman_filter.KalmanFilter
             The Kalman filter.
+        coast : Optional[bool]
+            If True, the time step has no detector pass. The state is
+            extrapolated, but the step is not counted in `time_since_update`.
 
         """
         self.mean, self.covariance = kf.predict(self.mean, self.covariance)
         self.age += 1
-        self.time_since_update += 1
+        if not coast:
+            self.time_since_update += 1
 
-    def update(self, kf, detection):
+    def update(self, kf, detection, frame_index):
         """Perform Kalman filter measurement update step and update the feature
         cache.
 
@@ -141,12 +189,15 @@ class Track:
             The Kalman filter.
         detection : Detection
             The associated detection.
+        frame_index : int
+            Index of the frame of the detection.
 
         """
         self.mean, self.covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
         self.features.append(detection.feature)
-        self.positions.append(detection.centroid)
+        self.last_feature = detection.feature
+        self._record_position(detection.centroid, frame_index)
 
         self.hits += 1
         self.time_since_update = 0
@@ -1,5 +1,6 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
+import time as timer
 import numpy as np
 from . import kalman_filter
 from . import linear_assignment
@@ -34,6 +35,9 @@ class Tracker:
         A Kalman filter to filter target trajectories in image space.
     tracks : List[Track]
         The list of active tracks at the current time step.
+    association_time : float
+        Wall-clock seconds spent associating detections to tracks during the
+        current time step.
 
     """
 
@@ -46,34 +50,45 @@ class Tracker:
         self.kf = kalman_filter.KalmanFilter()
         self.tracks = []
         self._next_id = 1
+        self.association_time = 0.
 
-    def predict(self):
+    def predict(self, coast=False):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
+        Time steps without a detector pass should call it with `coast=True`
+        and skip `update`.
         """
+        self.association_time = 0.
         for track in self.tracks:
-            track.predict(self.kf)
+            track.predict(self.kf, coast)
 
-    def update(self, detections, time):
+    def update(self, detections, time, frame_index):
         """Perform measurement update and track management.
 
         Parameters
         ----------
         detections : List[deep_sort.detection.Detection]
             A list of detections at the current time step.
+        time : int | datetime
+            Time of the current time step, recorded as track entry and exit.
+        frame_index : int
+            Index of the current frame, recorded with every track position.
 
         """
         # Run matching cascade.
+        start = timer.perf_counter()
         matches, unmatched_tracks, unmatched_detections = self._match(detections)
+        self.association_time = timer.perf_counter() - start
 
         # Update track set.
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(self.kf, detections[detection_idx])
+            self.tracks[track_idx].update(
+                self.kf, detections[detection_idx], frame_index)
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
         for detection_idx in unmatched_detections:
-            self._initiate_track(detections[detection_idx], time)
+            self._initiate_track(detections[detection_idx], time, frame_index)
         expired = []
         for t in self.tracks:
             if t.is_recorded():
@@ -95,6 +110,47 @@ class Tracker:
 
         return expired
 
+    def reusable_features(self, boxes, min_iou):
+        """Find detections that can reuse the appearance feature of a track
+        instead of being encoded again.
+
+        Only tracks that were updated on the previous time step are
+        considered, and each track lends its feature to at most one detection.
+        This function should be called after `predict`.
+
+        Parameters
+        ----------
+        boxes : ndarray
+            An Nx4 matrix of detection bounding boxes in format
+            `(top left x, top left y, width, height)`.
+        min_iou : float
+            Minimum intersection over union between a detection and the
+            predicted track box for the track feature to be reused.
+
+        Returns
+        -------
+        Dict[int, ndarray]
+            Maps detection indices to the last feature of the matching track.
+
+        """
+        tracks = [
+            t for t in self.tracks
+            if t.time_since_update == 1 and t.last_feature is not None]
+        if len(tracks) == 0 or len(boxes) == 0:
+            return {}
+
+        candidates = np.asarray([t.to_tlwh() for t in tracks])
+        available = np.ones(len(tracks), dtype=bool)
+        reused = {}
+        for i, box in enumerate(np.asarray(boxes, dtype=np.float64)):
+            overlaps = iou_matching.iou(box, candidates)
+            overlaps[~available] = 0.
+            best = np.argmax(overlaps)
+            if overlaps[best] >= min_iou:
+                available[best] = False
+                reused[i] = tracks[best].last_feature
+        return reused
+
     def _match(self, detections):
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
@@ -135,9 +191,9 @@ class Tracker:
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
-    def _initiate_track(self, detection, time):
+    def _initiate_track(self, detection, time, frame_index):
         mean, covariance = self.kf.initiate(detection.to_xyah())
         self.tracks.append(Track(
-            mean, covariance, self._next_id, time, detection.centroid, self.n_init, 
-            self.max_age, detection.feature))
+            mean, covariance, self._next_id, time, detection.centroid, frame_index,
+            self.n_init, self.max_age, detection.feature))
         self._next_id += 1
@@ -0,0 +1,46 @@
+import numpy as np
+from config import DENSITY_GRID
+
+def estimate_count(boxes, frame_shape, grid=DENSITY_GRID, scale=4):
+	"""
+	Estimate the number of people from the detection density over a grid.
+	The expected size of one person is taken per grid row from the median
+	detection, since people further from the camera look smaller. Each cell
+	counts at least its detections, and cells where detection boxes cover
+	more area than their detections account for (groups merged into one box
+	in a packed crowd) are extrapolated from that expected size.
+	"""
+	boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+	if len(boxes) == 0:
+		return 0
+	(frame_height, frame_width) = frame_shape[:2]
+	(columns, rows) = grid
+	cell_width = frame_width / columns
+	cell_height = frame_height / rows
+
+	# Grid cell of each detection centroid
+	center_x = boxes[:, 0] + boxes[:, 2] / 2
+	center_y = boxes[:, 1] + boxes[:, 3] / 2
+	cell_columns = np.clip((center_x // cell_width).astype(int), 0, columns - 1)
+	cell_rows = np.clip((center_y // cell_height).astype(int), 0, rows - 1)
+	detected = np.zeros((rows, columns))
+	np.add.at(detected, (cell_rows, cell_columns), 1)
+
+	# Expected area of one person in every grid row
+	areas = boxes[:, 2] * boxes[:, 3]
+	# Rows without detections take the value of the nearest rows that have some
+	measured_rows = np.unique(cell_rows)
+	row_medians = [np.median(areas[cell_rows == row]) for row in measured_rows]
+	person_area = np.interp(np.arange(rows), measured_rows, row_medians)
+
+	# Area covered by the union of the boxes, rasterized on a coarse mask
+	mask = np.zeros((int(np.ceil(frame_height / scale)), int(np.ceil(frame_width / scale))), dtype=bool)
+	for (x, y, w, h) in (boxes / scale).astype(int):
+		mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = True
+	row_edges = np.linspace(0, mask.shape[0], rows + 1).astype(int)
+	column_edges = np.linspace(0, mask.shape[1], columns + 1).astype(int)
+	covered = np.add.reduceat(np.add.reduceat(mask, row_edges[:-1], axis=0), column_edges[:-1], axis=1)
+	covered = covered * scale * scale
+
+	estimated = np.maximum(detected, covered / person_area[:, np.newaxis])
+	return int(round(estimated.sum()))
@@ -0,0 +1,4 @@
+# Settings of `gunicorn api_server:app`, the same as serve.py
+from serve import gunicorn_options
+
+globals().update(gunicorn_options())
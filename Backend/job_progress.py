@@ -0,0 +1,182 @@
+import collections
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from config import PROGRESS_INTERVAL
+from resources import pin_to_cores
+from util import progress
+
+# Set by api_server on the analysis jobs whose progress it streams
+PROGRESS_VAR = "CROWD_ANALYSIS_PROGRESS"
+# Marks the progress lines of a job's stdout
+PROGRESS_PREFIX = "@progress "
+
+class ProgressReporter:
+	"""
+	Progress of a job for api_server: the processed frame, processing FPS
+	and the latest crowd metrics, written as JSON lines on stdout at most
+	every `interval` seconds. Outside api_server the console indicator of
+	util.progress is shown instead.
+	"""
+
+	def __init__(self, total_frames=None, interval=PROGRESS_INTERVAL):
+		self.enabled = os.environ.get(PROGRESS_VAR) == "1"
+		self.total_frames = total_frames
+		self.interval = interval
+		self._t0 = time.time()
+		self._last = None
+		self._pending = None
+
+	def update(self, frame, processed_frames, indicator=True, **metrics):
+		# `indicator` is off while the processed video is displayed instead
+		if not self.enabled:
+			if indicator:
+				progress(processed_frames)
+			return
+		now = time.time()
+		self._pending = {
+			"frame": frame,
+			"total_frames": self.total_frames,
+			"processed_frames": processed_frames,
+			"fps": round(processed_frames / max(now - self._t0, 1e-6), 2),
+			**metrics
+		}
+		if self._last is None or now - self._last >= self.interval:
+			self.flush()
+
+	def flush(self):
+		# Write the latest update, also called once processing ended
+		if self._pending is None:
+			return
+		sys.stdout.write(PROGRESS_PREFIX + json.dumps(self._pending, default=str) + "\n")
+		sys.stdout.flush()
+		self._last = time.time()
+		self._pending = None
+
+def run_with_progress(command, timeout, on_progress, timeout_from=None, cores=None, **kwargs):
+	"""
+	subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+	for a job with a ProgressReporter, every progress line of its stdout is
+	passed to `on_progress` as it arrives instead of being captured. With
+	`timeout_from` (a threading.Event) the timeout only starts once it is set.
+	The job is pinned to `cores` once it started.
+	"""
+	env = dict(kwargs.pop("env", None) or os.environ)
+	env[PROGRESS_VAR] = "1"
+	process = pin_to_cores(subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env, **kwargs), cores)
+	# stderr is drained alongside, a full pipe would block the job
+	stderr = []
+	stderr_reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+	stderr_reader.start()
+	timed_out = threading.Event()
+	watchdog = threading.Timer(timeout, lambda: (timed_out.set(), process.kill()))
+	if timeout_from is None:
+		watchdog.start()
+	else:
+		def arm():
+			while not timeout_from.wait(1.):
+				if process.poll() is not None:
+					return
+			watchdog.start()
+		threading.Thread(target=arm, daemon=True).start()
+	stdout = []
+	try:
+		for line in process.stdout:
+			if line.startswith(PROGRESS_PREFIX):
+				on_progress(json.loads(line[len(PROGRESS_PREFIX):]))
+			else:
+				stdout.append(line)
+		process.wait()
+	finally:
+		watchdog.cancel()
+		stderr_reader.join()
+	if timed_out.is_set():
+		raise subprocess.TimeoutExpired(command, timeout, "".join(stdout), "".join(stderr))
+	return subprocess.CompletedProcess(command, process.returncode, "".join(stdout), "".join(stderr))
+
+class ProgressBroker:
+	"""
+	Progress events of the running jobs by progress id, for the server-sent
+	event streams of api_server. A subscriber first receives the latest
+	event of every type, so it can connect at any time, also before the
+	job published anything. Beyond `max_channels`, the least recently used
+	channels of finished jobs nobody follows are dropped.
+	"""
+
+	def __init__(self, max_channels=256):
+		self.max_channels = max_channels
+		self._channels = collections.OrderedDict()
+		# Subscribers of ids no job published under yet, they join the channel once it is created
+		self._waiting = {}
+		self._lock = threading.Lock()
+
+	def _channel(self, progress_id):
+		channel = self._channels.get(progress_id)
+		if channel is not None:
+			self._channels.move_to_end(progress_id)
+			return channel
+		channel = {"latest": collections.OrderedDict(), "subscribers": self._waiting.pop(progress_id, []), "closed": False}
+		self._channels[progress_id] = channel
+		excess = len(self._channels) - self.max_channels
+		if excess > 0:
+			# Running jobs and followed channels are kept, even over the limit
+			finished = [key for (key, other) in self._channels.items() if other["closed"] and not other["subscribers"]]
+			for key in finished[:excess]:
+				del self._channels[key]
+		return channel
+
+	def publish(self, progress_id, event, data, close=False):
+		if progress_id is None:
+			return
+		with self._lock:
+			channel = self._channel(progress_id)
+			channel["latest"][event] = data
+			channel["latest"].move_to_end(event)
+			channel["closed"] = channel["closed"] or close
+			for subscriber in channel["subscribers"]:
+				subscriber.put((event, data, close))
+
+	def reset(self, progress_id):
+		# A new job reuses the id, drop the previous job's events
+		with self._lock:
+			channel = self._channel(progress_id)
+			channel["latest"].clear()
+			channel["closed"] = False
+
+	def subscribe(self, progress_id, keepalive=15.):
+		"""Yield (event, data) until the job closes its channel, None every `keepalive` seconds without events"""
+		subscriber = queue.Queue()
+		with self._lock:
+			if progress_id in self._channels:
+				channel = self._channel(progress_id)
+				backlog = list(channel["latest"].items())
+				closed = channel["closed"]
+				channel["subscribers"].append(subscriber)
+			else:
+				# Connected before the job started, without a channel of its own
+				(backlog, closed) = ([], False)
+				self._waiting.setdefault(progress_id, []).append(subscriber)
+		try:
+			for (event, data) in backlog:
+				yield event, data
+			while not closed:
+				try:
+					(event, data, closed) = subscriber.get(timeout=keepalive)
+				except queue.Empty:
+					yield None
+					continue
+				yield event, data
+		finally:
+			with self._lock:
+				channel = self._channels.get(progress_id)
+				if channel is not None and subscriber in channel["subscribers"]:
+					channel["subscribers"].remove(subscriber)
+				else:
+					waiting = self._waiting[progress_id]
+					waiting.remove(subscriber)
+					if not waiting:
+						del self._waiting[progress_id]
@@ -0,0 +1,195 @@
+import os
+import re
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from config import LIVE_METRICS_CONFIG
+
+# Shared memory segment of a stream is SEGMENT_PREFIX + stream name
+SEGMENT_PREFIX = "crowd_live_"
+# Stream names are part of the segment name
+STREAM_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Header: sequence number (odd while a record is written), records written, capacity, publisher pid
+HEADER_FIELDS = 4
+HEADER_BYTES = HEADER_FIELDS * 8
+RECORD_DTYPE = np.dtype([
+	("time", "f8"),
+	("count", "i4"),
+	("violations", "i4"),
+	("restricted", "u1"),
+	("abnormal", "u1")
+], align=True)
+
+# Attempts at a consistent copy before giving up on a publisher that keeps writing
+READ_RETRIES = 100
+
+def _views(shm, capacity):
+	header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+	records = np.ndarray((capacity,), dtype=RECORD_DTYPE, buffer=shm.buf, offset=HEADER_BYTES)
+	return header, records
+
+def _attach(name):
+	try:
+		return shared_memory.SharedMemory(name, track=False)
+	except TypeError:
+		# Before Python 3.13 attaching registers the segment with the resource
+		# tracker, which unlinks it when this process exits
+		shm = shared_memory.SharedMemory(name)
+		if os.name == "posix":
+			resource_tracker.unregister(shm._name, "shared_memory")
+		return shm
+
+def _publisher_pid(shm):
+	return int(np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)[3])
+
+def _pid_alive(pid):
+	if pid <= 0:
+		return False
+	if os.name != "posix":
+		# Segments on Windows disappear with the last process that has them open
+		return True
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+def _untrack(shm):
+	# Keep the resource tracker from unlinking a segment this process no longer owns when it exits
+	if os.name == "posix":
+		resource_tracker.unregister(shm._name, "shared_memory")
+
+class LiveMetricsPublisher:
+	"""
+	Crowd metrics of a live stream in a shared memory ring buffer of the
+	last `capacity` processed frames, read by api_server through
+	read_live_metrics() without touching the disk. There is one writer per
+	stream, readers retry while a record is being written (a seqlock). A
+	segment of the same name is only replaced when the process that
+	published it is gone, otherwise FileExistsError is raised.
+	"""
+
+	def __init__(self, stream, capacity=LIVE_METRICS_CONFIG["CAPACITY"]):
+		if not STREAM_NAME.match(stream):
+			raise ValueError(f"Invalid live stream name: {stream}")
+		self.stream = stream
+		self.capacity = capacity
+		size = HEADER_BYTES + capacity * RECORD_DTYPE.itemsize
+		try:
+			self._shm = shared_memory.SharedMemory(SEGMENT_PREFIX + stream, create=True, size=size)
+		except FileExistsError:
+			stale = shared_memory.SharedMemory(SEGMENT_PREFIX + stream)
+			pid = _publisher_pid(stale)
+			if _pid_alive(pid):
+				stale.close()
+				_untrack(stale)
+				raise FileExistsError(f"Live stream {stream} is already published by process {pid}")
+			# Left behind by a publisher that did not exit cleanly
+			print(f"Replacing the live metrics of stream {stream}")
+			stale.close()
+			stale.unlink()
+			self._shm = shared_memory.SharedMemory(SEGMENT_PREFIX + stream, create=True, size=size)
+		(self._header, self._records) = _views(self._shm, capacity)
+		self._header[:] = (0, 0, capacity, os.getpid())
+
+	def publish(self, timestamp, count, violations, restricted, abnormal):
+		(seq, written) = (self._header[0], self._header[1])
+		self._header[0] = seq + 1
+		self._records[written % self.capacity] = (timestamp, count, violations, restricted, abnormal)
+		self._header[1] = written + 1
+		self._header[0] = seq + 2
+
+	def close(self):
+		(self._header, self._records) = (None, None)
+		self._shm.close()
+		# The segment may have been removed, or replaced by a publisher that took this process for dead
+		try:
+			# Registered with the resource tracker already, as this process created the name
+			current = shared_memory.SharedMemory(self._shm.name)
+		except FileNotFoundError:
+			_untrack(self._shm)
+			return
+		try:
+			owned = _publisher_pid(current) == os.getpid()
+		finally:
+			current.close()
+		if not owned:
+			_untrack(self._shm)
+			return
+		try:
+			self._shm.unlink()
+		except FileNotFoundError:
+			_untrack(self._shm)
+
+def _snapshot(shm):
+	# Consistent copy of the records and the header fields, the views are released on return
+	capacity = int(np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)[2])
+	(header, records) = _views(shm, capacity)
+	for _ in range(READ_RETRIES):
+		seq = header[0]
+		if seq % 2:
+			time.sleep(0)
+			continue
+		(written, pid) = (int(header[1]), int(header[3]))
+		count = min(written, capacity)
+		window = records[(written - count + np.arange(count)) % capacity]
+		if header[0] == seq:
+			return written, pid, window
+	return None
+
+def read_live_metrics(stream, seconds=LIVE_METRICS_CONFIG["WINDOW_SECONDS"]):
+	"""
+	Latest metrics of a stream and its records of the last `seconds`, or
+	None while no publisher of that name is running.
+	"""
+	if not STREAM_NAME.match(stream):
+		return None
+	try:
+		shm = _attach(SEGMENT_PREFIX + stream)
+	except FileNotFoundError:
+		return None
+	try:
+		snapshot = _snapshot(shm)
+	finally:
+		shm.close()
+	if snapshot is None:
+		return None
+	(written, pid, window) = snapshot
+
+	if written == 0:
+		return {"stream": stream, "pid": pid, "records": 0, "latest": None, "age": None, "window": None}
+	latest = window[-1]
+	# The latest record is always part of the window
+	in_window = window["time"] >= latest["time"] - seconds
+	in_window[-1] = True
+	window = window[in_window]
+	return {
+		"stream": stream,
+		"pid": pid,
+		"records": written,
+		"latest": {
+			"time": float(latest["time"]),
+			"count": int(latest["count"]),
+			"violations": int(latest["violations"]),
+			"restricted": bool(latest["restricted"]),
+			"abnormal": bool(latest["abnormal"])
+		},
+		# Seconds since the last processed frame, grows while the stream stalls
+		"age": round(time.time() - float(latest["time"]), 3),
+		"window": {
+			"seconds": seconds,
+			"max_count": int(window["count"].max()),
+			"mean_count": round(float(window["count"].mean()), 2),
+			"max_violations": int(window["violations"].max()),
+			"restricted_detected": bool(window["restricted"].any()),
+			"abnormal_detected": bool(window["abnormal"].any()),
+			"time": window["time"].tolist(),
+			"count": window["count"].tolist(),
+			"violations": window["violations"].tolist(),
+			"restricted": window["restricted"].astype(bool).tolist(),
+			"abnormal": window["abnormal"].astype(bool).tolist()
+		}
+	}
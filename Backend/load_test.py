@@ -0,0 +1,117 @@
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+import numpy as np
+from config import RETENTION_CONFIG
+
+# The sample run shipped with the repository
+DEFAULT_REQUEST_ID = RETENTION_CONFIG["PINNED_RUNS"][0]
+
+
+def _endpoints(request_id):
+    """(name, path, headers) of the endpoints under test.
+    """
+    return [
+        ("health", "/api/health", {}),
+        ("storage", "/api/storage", {}),
+        ("results", "/api/results?request_id=%s" % request_id, {}),
+        ("heatmap", "/api/visualizations/heatmap?request_id=%s" % request_id, {}),
+        ("crowd-analysis", "/api/visualizations/crowd-analysis?request_id=%s" % request_id, {}),
+        ("video-range", "/api/processed-video?request_id=%s" % request_id, {"Range": "bytes=0-1048575"}),
+    ]
+
+
+def _worker(url, endpoints, deadline, remaining, lock, results):
+    # One keep-alive connection per worker, as a browser would keep
+    parts = urlsplit(url)
+    connection = None
+    etags = {}
+    index = 0
+    while time.perf_counter() < deadline:
+        with lock:
+            if remaining[0] <= 0:
+                break
+            remaining[0] -= 1
+        (name, path, headers) = endpoints[index % len(endpoints)]
+        index += 1
+        headers = dict(headers)
+        if name in etags:
+            # Repeat requests revalidate like a browser cache does
+            headers["If-None-Match"] = etags[name]
+        t0 = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader("ETag"):
+                etags[name] = response.getheader("ETag")
+        except (OSError, http.client.HTTPException):
+            status = None
+            connection = None
+        results[name].append((time.perf_counter() - t0, status))
+
+
+def run_load_test(args):
+    endpoints = _endpoints(args.request_id)
+    if args.endpoints:
+        endpoints = [endpoint for endpoint in endpoints if endpoint[0] in args.endpoints]
+    results = {name: [] for (name, _, _) in endpoints}
+    lock = threading.Lock()
+    remaining = [args.requests]
+    deadline = time.perf_counter() + args.duration
+
+    t0 = time.perf_counter()
+    workers = [threading.Thread(target=_worker, args=(args.url, endpoints[i % len(endpoints):] + endpoints[:i % len(endpoints)],
+                                                      deadline, remaining, lock, results))
+               for i in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - t0
+
+    print("%d requests from %d connections in %.2f s (%.1f req/s)" % (
+        sum(len(samples) for samples in results.values()), args.concurrency, wall,
+        sum(len(samples) for samples in results.values()) / wall))
+    print("%-16s %8s %8s %10s %10s %10s %10s  %s" % (
+        "endpoint", "requests", "errors", "p50 (ms)", "p90 (ms)", "p99 (ms)", "max (ms)", "statuses"))
+    for (name, samples) in results.items():
+        if not samples:
+            continue
+        latencies = np.array([latency for (latency, _) in samples]) * 1000
+        statuses = [status for (_, status) in samples]
+        errors = sum(status is None or status >= 500 for status in statuses)
+        counts = ", ".join("%s: %d" % (status, statuses.count(status)) for status in sorted(set(statuses), key=str))
+        print("%-16s %8d %8d %10.2f %10.2f %10.2f %10.2f  %s" % (
+            name, len(samples), errors, np.percentile(latencies, 50), np.percentile(latencies, 90),
+            np.percentile(latencies, 99), latencies.max(), counts))
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Concurrent load test of the API's fast endpoints, reports latency percentiles")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of a running server.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent keep-alive connections.")
+    parser.add_argument("--requests", type=int, default=5000, help="Total requests, spread over the endpoints.")
+    parser.add_argument("--duration", type=float, default=60., help="Stop after this many seconds.")
+    parser.add_argument(
+        "--request_id", default=DEFAULT_REQUEST_ID, help="Analysis run whose results are requested.")
+    parser.add_argument(
+        "--endpoints", nargs="+", choices=[name for (name, _, _) in _endpoints("")],
+        help="Only test these endpoints.")
+    return parser.parse_args()
+
+
+def main():
+    run_load_test(parse_args())
+
+
+if __name__ == "__main__":
+    main()
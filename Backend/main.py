@@ -1,4 +1,5 @@
-from config import YOLO_CONFIG, VIDEO_CONFIG, SHOW_PROCESSING_OUTPUT, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE
+from config import YOLO_CONFIG, VIDEO_CONFIG, SHOW_PROCESSING_OUTPUT, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE, DETECT_INTERVAL,\
+	MOTION_GATE, MOTION_THRESH, LIVE_METRICS_CONFIG, RECORD_CONFIG
 
 if FRAME_SIZE > 1920:
 	print("Frame size is too large!")
@@ -7,6 +8,10 @@ elif FRAME_SIZE < 480:
 	print("Frame size is too small! You won't see anything")
 	quit()
 
+# Size the BLAS thread pool before numpy loads it
+from resources import limit_blas_threads, limit_opencv_threads
+limit_blas_threads()
+
 import datetime
 import time
 import numpy as np
@@ -17,12 +22,20 @@ import sys
 import csv
 import json
 from video_process import video_process
+from tracking import load_detector, load_encoder, detect_frames
+from capture import FrameReader, LiveFrames, is_file_source
+from motion import MotionGate
+from uploads import GrowingCapture
+from live_metrics import LiveMetricsPublisher
+from data_recorder import CrowdDataRecorder, MovementDataRecorder
 from deep_sort import nn_matching
 from deep_sort.detection import Detection
 from deep_sort.tracker import Tracker
 from deep_sort import generate_detections as gdet
 
 # Accept video path and output directory from command line for concurrent processing
+# With --follow the video is analysed while it is still being uploaded
+FOLLOW = "--follow" in sys.argv[3:]
 if len(sys.argv) >= 3:
     VIDEO_PATH = sys.argv[1]
     OUTPUT_DIR = sys.argv[2]
@@ -36,22 +49,12 @@ else:
 
 # Read from video
 IS_CAM = VIDEO_CONFIG["IS_CAM"]
-cap = cv2.VideoCapture(VIDEO_PATH)
-
-# Load YOLOv3-tiny weights and config
-WEIGHTS_PATH = YOLO_CONFIG["WEIGHTS_PATH"]
-CONFIG_PATH = YOLO_CONFIG["CONFIG_PATH"]
+cap = GrowingCapture(VIDEO_PATH) if FOLLOW else cv2.VideoCapture(VIDEO_PATH)
 
-# Load the YOLOv3-tiny pre-trained COCO dataset 
-net = cv2.dnn.readNetFromDarknet(CONFIG_PATH, WEIGHTS_PATH)
-# Set the preferable backend to CPU since we are not using GPU
-net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+limit_opencv_threads()
 
-# Get the names of all the layers in the network
-ln = net.getLayerNames()
-# Filter out the layer names we dont need for YOLO
-ln = [ln[i - 1] for i in net.getUnconnectedOutLayers()]
+# Load YOLOv4-tiny in the configured precision
+net, ln = load_detector(YOLO_CONFIG["PRECISION"])
 
 # Tracker parameters
 max_cosine_distance = 0.7
@@ -64,8 +67,9 @@ else:
 	max_age=DATA_RECORD_RATE * TRACK_MAX_AGE
 	if max_age > 30:
 		max_age = 30
-model_filename = 'model_data/mars-small128.pb'
-encoder = gdet.create_box_encoder(model_filename, batch_size=1)
+# Track age only advances on detection frames
+max_age = max(1, int(max_age / DETECT_INTERVAL))
+encoder = load_encoder(YOLO_CONFIG["PRECISION"])
 metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
 tracker = Tracker(metric, max_age=max_age)
 
@@ -77,27 +81,49 @@ if not os.path.exists(OUTPUT_DIR):
 movement_data_path = os.path.join(OUTPUT_DIR, 'movement_data.csv')
 crowd_data_path = os.path.join(OUTPUT_DIR, 'crowd_data.csv')
 
-movement_data_file = open(movement_data_path, 'w') 
-crowd_data_file = open(crowd_data_path, 'w')
+# Rows are written in blocks, live sources also write them every FLUSH_INTERVAL seconds
+flush_interval = RECORD_CONFIG["FLUSH_INTERVAL"] if IS_CAM else None
+movement_data_writer = MovementDataRecorder(movement_data_path, flush_interval=flush_interval)
+crowd_data_writer = CrowdDataRecorder(crowd_data_path, flush_interval=flush_interval)
 # sd_violate_data_file = open('sd_violate_data.csv', 'w')
 # restricted_entry_data_file = open('restricted_entry_data.csv', 'w')
-
-movement_data_writer = csv.writer(movement_data_file)
-crowd_data_writer = csv.writer(crowd_data_file)
 # sd_violate_writer = csv.writer(sd_violate_data_file)
 # restricted_entry_data_writer = csv.writer(restricted_entry_data_file)
 
-if os.path.getsize(movement_data_path) == 0:
-	movement_data_writer.writerow(['Track ID', 'Entry time', 'Exit Time', 'Movement Tracks'])
-if os.path.getsize(crowd_data_path) == 0:
-	crowd_data_writer.writerow(['Time', 'Human Count', 'Social Distance violate', 'Restricted Entry', 'Abnormal Activity'])
+# Live sources are read in the background, only the newest frame is processed
+live_frames = None
+live_metrics = None
+if IS_CAM:
+	latency_data_file = open(os.path.join(OUTPUT_DIR, 'latency_data.csv'), 'w')
+	latency_data_writer = csv.writer(latency_data_file)
+	latency_data_writer.writerow(['Time', 'Latency (ms)', 'Dropped Frames', 'Detect Interval'])
+	# Video files are played back at their frame rate to stand in for a camera
+	reader = FrameReader(cap, FRAME_SIZE, is_file_source(VIDEO_PATH), cap.get(cv2.CAP_PROP_FPS))
+	motion_gate = MotionGate(MOTION_THRESH) if MOTION_GATE else None
+	live_frames = LiveFrames(reader, lambda frame: detect_frames(net, ln, [frame])[0], VIDEO_CONFIG["LATENCY_BUDGET"],
+		DETECT_INTERVAL, VIDEO_CONFIG["MAX_DETECT_INTERVAL"], motion_gate, latency_data_writer)
+	reader.start()
+	# The latest metrics are served by api_server at /api/live/<stream>
+	if LIVE_METRICS_CONFIG["ENABLED"]:
+		live_metrics = LiveMetricsPublisher(LIVE_METRICS_CONFIG["STREAM"])
 
 START_TIME = time.time()
 
-processing_FPS = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, movement_data_writer, crowd_data_writer, OUTPUT_DIR)
+processing_FPS, processing_stats = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, movement_data_writer, crowd_data_writer, OUTPUT_DIR,
+	frames=live_frames, live_metrics=live_metrics)
 cv2.destroyAllWindows()
-movement_data_file.close()
-crowd_data_file.close()
+movement_data_writer.close()
+crowd_data_writer.close()
+if IS_CAM:
+	# The reader thread may still be in cap.read(), it releases the capture itself once it ends
+	reader.stop()
+	reader.join()
+	latency_data_file.close()
+	if live_metrics is not None:
+		live_metrics.close()
+	processing_stats["LIVE_CAPTURE"] = live_frames.stats()
+	if motion_gate is not None:
+		processing_stats["MOTION_GATE"] = motion_gate.stats()
 
 END_TIME = time.time()
 PROCESS_TIME = END_TIME - START_TIME
@@ -106,6 +132,9 @@ if IS_CAM:
 	print("Processed FPS: ", processing_FPS)
 	VID_FPS = processing_FPS
 	DATA_RECORD_FRAME = 1
+	print("Frames dropped to keep up with the camera: ", live_frames.stats()["FRAMES_DROPPED"])
+	START_TIME = datetime.datetime.fromtimestamp(START_TIME)
+	END_TIME = datetime.datetime.fromtimestamp(END_TIME)
 else:
 	print("Processed FPS: ", round(cap.get(cv2.CAP_PROP_FRAME_COUNT) / PROCESS_TIME, 2))
 	VID_FPS = cap.get(cv2.CAP_PROP_FPS)
@@ -115,7 +144,8 @@ else:
 	END_TIME = START_TIME + datetime.timedelta(seconds=time_elapsed)
 
 
-cap.release()
+if not IS_CAM:
+	cap.release()
 
 video_data = {
 	"IS_CAM": IS_CAM,
@@ -124,7 +154,8 @@ video_data = {
 	"PROCESSED_FRAME_SIZE": FRAME_SIZE,
 	"TRACK_MAX_AGE": TRACK_MAX_AGE,
 	"START_TIME": START_TIME.strftime("%d/%m/%Y, %H:%M:%S"),
-	"END_TIME": END_TIME.strftime("%d/%m/%Y, %H:%M:%S")
+	"END_TIME": END_TIME.strftime("%d/%m/%Y, %H:%M:%S"),
+	"PROCESSING_STATS": processing_stats
 }
 
 video_data_path = os.path.join(OUTPUT_DIR, 'video_data.json')
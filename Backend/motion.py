@@ -0,0 +1,46 @@
+import numpy as np
+import cv2
+
+class MotionGate:
+	"""
+	Cheap change detector for fixed cameras. Each frame is downscaled, blurred
+	and compared with the last frame that went through the detector. Frames
+	where less than `threshold` of the pixels changed are reported as static
+	so that detection can be skipped.
+	"""
+
+	def __init__(self, threshold, width=160, pixel_threshold=25):
+		self.threshold = threshold
+		self.width = width
+		self.pixel_threshold = pixel_threshold
+		self._reference = None
+
+		# Gate statistics
+		self.frames_checked = 0
+		self.frames_skipped = 0
+		self.total_change = 0.
+
+	def is_static(self, frame):
+		(height, width) = frame.shape[:2]
+		small = cv2.resize(frame, (self.width, max(1, int(height * self.width / width))), interpolation=cv2.INTER_AREA)
+		gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+		self.frames_checked += 1
+		if self._reference is None:
+			self._reference = gray
+			return False
+		change = np.count_nonzero(cv2.absdiff(gray, self._reference) > self.pixel_threshold) / gray.size
+		self.total_change += change
+		if change < self.threshold:
+			self.frames_skipped += 1
+			return True
+		# The frame goes through the detector and becomes the new reference
+		self._reference = gray
+		return False
+
+	def stats(self):
+		return {
+			"FRAMES_CHECKED": self.frames_checked,
+			"FRAMES_SKIPPED": self.frames_skipped,
+			"MEAN_CHANGE": round(float(self.total_change) / max(1, self.frames_checked - 1), 5)
+		}
@@ -0,0 +1,186 @@
+from config import YOLO_CONFIG, VIDEO_CONFIG, FRAME_SIZE, TRACK_MAX_AGE, DETECT_INTERVAL, STREAM_BATCH_WAIT, MOTION_GATE, MOTION_THRESH,\
+	LIVE_METRICS_CONFIG, RECORD_CONFIG
+
+# Size the BLAS thread pool before numpy loads it
+from resources import limit_blas_threads, limit_opencv_threads
+limit_blas_threads()
+
+import argparse
+import datetime
+import threading
+import queue
+import time
+import cv2
+import os
+import csv
+import json
+from video_process import video_process
+from tracking import load_detector, load_encoder, detect_frames
+from capture import FrameReader, LiveFrames, is_file_source
+from motion import MotionGate
+from live_metrics import LiveMetricsPublisher
+from data_recorder import CrowdDataRecorder, MovementDataRecorder
+from deep_sort import nn_matching
+from deep_sort.tracker import Tracker
+
+class SharedDetector(threading.Thread):
+	"""
+	Runs the detector for every stream. Requests that arrive within
+	`max_wait` seconds of each other go through one batched forward pass.
+	Each stream waits for its own request, so a batch holds at most one
+	frame per stream and requests are served in arrival order.
+	"""
+
+	def __init__(self, net, ln, max_batch, max_wait=STREAM_BATCH_WAIT):
+		super().__init__(daemon=True)
+		self.net = net
+		self.ln = ln
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self._requests = queue.Queue()
+
+		# Detector statistics
+		self.batches = 0
+		self.frames = 0
+
+	def detect(self, frame):
+		# Called from the stream threads, blocks until the frame went through the detector
+		request = {"frame": frame, "done": threading.Event()}
+		self._requests.put(request)
+		request["done"].wait()
+		if "error" in request:
+			raise request["error"]
+		return request["detections"]
+
+	def stop(self):
+		self._requests.put(None)
+
+	def run(self):
+		while True:
+			request = self._requests.get()
+			if request is None:
+				return
+			batch = [request]
+			deadline = time.time() + self.max_wait
+			while len(batch) < self.max_batch:
+				try:
+					request = self._requests.get(timeout=max(0, deadline - time.time()))
+				except queue.Empty:
+					break
+				if request is None:
+					# Serve the batch before stopping
+					self._requests.put(None)
+					break
+				batch.append(request)
+			try:
+				detections = detect_frames(self.net, self.ln, [request["frame"] for request in batch])
+				for request, frame_detections in zip(batch, detections):
+					request["detections"] = frame_detections
+			except Exception as e:
+				for request in batch:
+					request["error"] = e
+			for request in batch:
+				request["done"].set()
+			self.batches += 1
+			self.frames += len(batch)
+
+class _LockedEncoder:
+	# The re-ID model is shared by the stream threads, TFLite interpreters are not thread safe
+	def __init__(self, encoder):
+		self.encoder = encoder
+		self.lock = threading.Lock()
+
+	def __call__(self, frame, boxes):
+		with self.lock:
+			return self.encoder(frame, boxes)
+
+def _open_source(source, frame_size):
+	# Webcam index, stream URL or video file, files are played back at their frame rate
+	cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+	return FrameReader(cap, frame_size, is_file_source(source), cap.get(cv2.CAP_PROP_FPS))
+
+def _create_tracker():
+	max_cosine_distance = 0.7
+	nn_budget = None
+	# Track age only advances on detection frames
+	max_age = max(1, int(VIDEO_CONFIG["CAM_APPROX_FPS"] * TRACK_MAX_AGE / DETECT_INTERVAL))
+	metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
+	return Tracker(metric, max_age=max_age)
+
+def process_stream(source, reader, detector, encoder, output_dir):
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+	movement_data_writer = MovementDataRecorder(os.path.join(output_dir, 'movement_data.csv'), flush_interval=RECORD_CONFIG["FLUSH_INTERVAL"])
+	crowd_data_writer = CrowdDataRecorder(os.path.join(output_dir, 'crowd_data.csv'), flush_interval=RECORD_CONFIG["FLUSH_INTERVAL"])
+	latency_data_file = open(os.path.join(output_dir, 'latency_data.csv'), 'w')
+	latency_data_writer = csv.writer(latency_data_file)
+	latency_data_writer.writerow(['Time', 'Latency (ms)', 'Dropped Frames', 'Detect Interval'])
+
+	start_time = datetime.datetime.now()
+	motion_gate = MotionGate(MOTION_THRESH) if MOTION_GATE else None
+	frames = LiveFrames(reader, detector.detect, VIDEO_CONFIG["LATENCY_BUDGET"], DETECT_INTERVAL, VIDEO_CONFIG["MAX_DETECT_INTERVAL"],
+		motion_gate, latency_data_writer)
+	# Published as the name of the stream's output directory, stream_<n>
+	live_metrics = LiveMetricsPublisher(os.path.basename(output_dir)) if LIVE_METRICS_CONFIG["ENABLED"] else None
+	(processing_FPS, processing_stats) = video_process(None, FRAME_SIZE, None, None, encoder, _create_tracker(), movement_data_writer,
+		crowd_data_writer, output_dir, frames=frames, detect=detector.detect, show_output=False, live_metrics=live_metrics)
+	end_time = datetime.datetime.now()
+	movement_data_writer.close()
+	crowd_data_writer.close()
+	latency_data_file.close()
+	if live_metrics is not None:
+		live_metrics.close()
+
+	processing_stats["LIVE_CAPTURE"] = frames.stats()
+	if motion_gate is not None:
+		processing_stats["MOTION_GATE"] = motion_gate.stats()
+	video_data = {
+		"IS_CAM": True,
+		"SOURCE": source,
+		"DATA_RECORD_FRAME" : 1,
+		"VID_FPS" : processing_FPS,
+		"PROCESSED_FRAME_SIZE": FRAME_SIZE,
+		"TRACK_MAX_AGE": TRACK_MAX_AGE,
+		"START_TIME": start_time.strftime("%d/%m/%Y, %H:%M:%S"),
+		"END_TIME": end_time.strftime("%d/%m/%Y, %H:%M:%S"),
+		"PROCESSING_STATS": processing_stats
+	}
+	with open(os.path.join(output_dir, 'video_data.json'), 'w') as video_data_file:
+		json.dump(video_data, video_data_file)
+	print(f"\nStream {source}: {processing_stats['PROCESSED_FRAMES']} frames processed, "
+		f"{reader.frames_dropped} dropped, results saved to: {output_dir}")
+
+def main():
+	parser = argparse.ArgumentParser(description="Analyse several cameras or videos with one shared detector")
+	parser.add_argument("sources", nargs="+", help="webcam index, stream URL or video file")
+	parser.add_argument("--output-dir", default="processed_data", help="one stream_<n> directory per source is created here")
+	args = parser.parse_args()
+
+	limit_opencv_threads()
+	(net, ln) = load_detector(YOLO_CONFIG["PRECISION"])
+	encoder = _LockedEncoder(load_encoder(YOLO_CONFIG["PRECISION"]))
+
+	detector = SharedDetector(net, ln, len(args.sources))
+	readers = [_open_source(source, FRAME_SIZE) for source in args.sources]
+	workers = [threading.Thread(target=process_stream, args=(source, reader, detector, encoder,
+		os.path.join(args.output_dir, "stream_{}".format(i)))) for i, (source, reader) in enumerate(zip(args.sources, readers))]
+	detector.start()
+	for reader in readers:
+		reader.start()
+	for worker in workers:
+		worker.start()
+	try:
+		for worker in workers:
+			while worker.is_alive():
+				worker.join(0.5)
+	except KeyboardInterrupt:
+		# Readers end their streams, the workers then record the remaining tracks
+		for reader in readers:
+			reader.stop()
+		for worker in workers:
+			worker.join()
+	detector.stop()
+	print("Detector ran {} batches, {:.2f} frames per batch".format(detector.batches, detector.frames / max(1, detector.batches)))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,109 @@
+import argparse
+import numpy as np
+import imutils
+import cv2
+from config import YOLO_CONFIG, FRAME_SIZE
+from tracking import load_detector, detect_frames, reid_model_path
+from deep_sort.generate_detections import extract_image_patch, tf
+
+
+def sample_frames(video_path, num_frames):
+    """Read `num_frames` frames spread evenly over the video, resized to
+    FRAME_SIZE.
+    """
+    cap = cv2.VideoCapture(video_path)
+    frame_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for index in np.linspace(0, max(0, frame_total - 1), num_frames).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        (ret, frame) = cap.read()
+        if ret:
+            frames.append(imutils.resize(frame, width=FRAME_SIZE))
+    cap.release()
+    return frames
+
+
+def write_detector_calibration(frames, output_path):
+    """Save the detector input blobs used to quantize YOLO at load time.
+
+    OpenCV cannot serialize a quantized Darknet network, so the int8
+    detector is quantized from these blobs whenever it is loaded.
+    """
+    input_size = YOLO_CONFIG["INPUT_SIZE"]
+    blob = cv2.dnn.blobFromImages(frames, 1 / 255.0, (input_size, input_size),
+                                  swapRB=True, crop=False)
+    np.save(output_path, blob)
+    print("Saved %d detector calibration frames to %s" % (len(frames), output_path))
+
+
+def person_patches(frames, patch_shape):
+    """Extract re-ID input patches of the people the FP32 detector finds.
+    """
+    net, ln = load_detector("fp32")
+    patches = []
+    for frame in frames:
+        boxes, _, _ = detect_frames(net, ln, [frame])[0]
+        for box in boxes:
+            patch = extract_image_patch(frame, box, patch_shape)
+            if patch is not None:
+                patches.append(patch)
+    return patches
+
+
+def convert_reid_model(precision, patches):
+    """Convert the frozen re-ID graph to a TensorFlow Lite model.
+
+    fp16 stores the weights as float16. int8 quantizes weights and
+    activations, calibrated on `patches`.
+    """
+    model_filename = YOLO_CONFIG["REID_MODEL_PATH"]
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(
+        model_filename, input_arrays=["images"], output_arrays=["features"],
+        input_shapes={"images": [1] + list(patches[0].shape)})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if precision == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        converter.representative_dataset = lambda: ([patch[np.newaxis]] for patch in patches)
+
+    output_filename = reid_model_path(precision)
+    with open(output_filename, "wb") as file_handle:
+        file_handle.write(converter.convert())
+    print("Saved %s re-ID model to %s" % (precision, output_filename))
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Prepare reduced precision detector and re-ID models")
+    parser.add_argument(
+        "--video", default="uploads/Testing_video.mp4",
+        help="Video used to calibrate the quantized models.")
+    parser.add_argument(
+        "--num_frames", type=int, default=50,
+        help="Number of calibration frames sampled from the video.")
+    parser.add_argument(
+        "--precisions", nargs="+", choices=["fp16", "int8"],
+        default=["fp16", "int8"])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    frames = sample_frames(args.video, args.num_frames)
+    if len(frames) == 0:
+        raise ValueError("Failed to read frames from '%s'" % args.video)
+
+    if "int8" in args.precisions:
+        write_detector_calibration(frames, YOLO_CONFIG["CALIBRATION_PATH"])
+
+    patches = person_patches(frames, (128, 64))
+    if len(patches) == 0:
+        raise ValueError("No people detected in '%s' to calibrate the re-ID model" % args.video)
+    for precision in args.precisions:
+        convert_reid_model(precision, patches)
+
+
+if __name__ == "__main__":
+    main()
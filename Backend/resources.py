@@ -0,0 +1,104 @@
+import os
+import threading
+from contextlib import contextmanager
+from config import RESOURCE_CONFIG
+
+# Thread counts read by the BLAS and OpenMP runtimes when they are loaded
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+# Comma separated list of the cores reserved for an analysis job
+JOB_CORES_VAR = "CROWD_ANALYSIS_CORES"
+
+def available_cores():
+	if hasattr(os, "sched_getaffinity"):
+		return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count()))
+
+def job_cores():
+	# Cores reserved for this process by api_server, None when running without a budget
+	cores = os.environ.get(JOB_CORES_VAR)
+	if not cores:
+		return None
+	return [int(core) for core in cores.split(",")]
+
+def stage_threads(stage):
+	# Configured threads win, otherwise a job with a budget gets one thread per reserved core
+	threads = RESOURCE_CONFIG[stage]
+	cores = job_cores()
+	if threads > 0 or cores is None:
+		return threads
+	# Parallel independent ops only oversubscribe a small budget
+	if stage == "TF_INTER_OP_THREADS":
+		return 1
+	return len(cores)
+
+def limit_blas_threads():
+	# Must run before numpy is imported
+	threads = RESOURCE_CONFIG["BLAS_THREADS"]
+	if threads > 0:
+		for var in BLAS_THREAD_VARS:
+			os.environ[var] = str(threads)
+
+def limit_opencv_threads():
+	# Imported here, cv2 loads numpy and with it the BLAS thread pool
+	import cv2
+	threads = stage_threads("OPENCV_THREADS")
+	if threads > 0:
+		cv2.setNumThreads(threads)
+
+def job_environment(cores):
+	# Environment of a job subprocess, thread pools are sized before the libraries load
+	env = dict(os.environ)
+	if cores is None:
+		return env
+	env[JOB_CORES_VAR] = ",".join(str(core) for core in cores)
+	threads = RESOURCE_CONFIG["BLAS_THREADS"] or len(cores)
+	for var in BLAS_THREAD_VARS:
+		env[var] = str(threads)
+	return env
+
+def pin_to_cores(process, cores):
+	# Pin a job subprocess right after it started, its threads inherit the affinity.
+	# Not done in preexec_fn, which can deadlock the child of a threaded server before exec
+	if cores is None or not RESOURCE_CONFIG["PIN_CPUS"] or not hasattr(os, "sched_setaffinity"):
+		return process
+	try:
+		os.sched_setaffinity(process.pid, cores)
+	except ProcessLookupError:
+		# Exited already
+		pass
+	return process
+
+class CoreAllocator:
+	"""
+	Hands out disjoint blocks of `cores_per_job` cores to concurrent jobs.
+	Jobs wait for a free block, so the total number of running jobs never
+	exceeds the available cores. With `cores_per_job` 0 every job runs
+	unrestricted.
+	"""
+
+	def __init__(self, cores_per_job, cores=None):
+		self.cores_per_job = cores_per_job
+		cores = available_cores() if cores is None else cores
+		self._free = []
+		if cores_per_job > 0:
+			self._free = [cores[i:i + cores_per_job] for i in range(0, len(cores) - cores_per_job + 1, cores_per_job)]
+			# A budget larger than the machine runs one job at a time on every core
+			if len(self._free) == 0:
+				self._free = [cores]
+		self._condition = threading.Condition()
+
+	@contextmanager
+	def reserve(self):
+		if self.cores_per_job <= 0:
+			yield None
+			return
+		with self._condition:
+			while len(self._free) == 0:
+				self._condition.wait()
+			cores = self._free.pop(0)
+		try:
+			yield cores
+		finally:
+			with self._condition:
+				self._free.append(cores)
+				self._condition.notify()
@@ -0,0 +1,253 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from analysis_cache import directory_size
+
+# Touched whenever a run's results are read, its age counts from then
+LAST_USED_FILENAME = ".last_used"
+# Written when a run is compacted, holds the summary of the dropped CSVs
+SUMMARY_FILENAME = "summary.json"
+# Results gzipped once a run finished
+COMPRESSED_FILES = ["crowd_data.csv", "movement_data.csv", "latency_data.csv"]
+# Results dropped when a run is compacted, the plots, video_data.json and the summary stay
+HEAVY_FILES = ["processed_video.mp4", "processed_video_preview.mp4", "annotations.jsonl"] + \
+	COMPRESSED_FILES + [filename + ".gz" for filename in COMPRESSED_FILES]
+
+DAY = 24 * 60 * 60
+GB = 1024 ** 3
+
+class RetentionManager(threading.Thread):
+	"""
+	Background sweeper of the analysis runs in `processed_root` and the
+	videos in `uploads_root`. Every `config["SWEEP_INTERVAL"]` seconds it
+	gzips the CSVs of finished runs, compacts runs unused for a while down to
+	their summary and plots, deletes old runs and uploads, and deletes the
+	least recently used runs and uploads while the total exceeds the quota or
+	the disk runs short. Runs inside active(), runs the analysis cache is
+	serving, the runs listed in `config["PINNED_RUNS"]` and the uploads
+	returned by `active_uploads` are never touched. `summarize(request_id)` gives the summary kept by a
+	compacted run, and runs removed or compacted are forgotten by the
+	analysis cache. `forget_upload(filename)` is called for every upload
+	deleted. Sweeps run one at a time.
+	"""
+
+	def __init__(self, processed_root, uploads_root, config, cache=None, summarize=None, active_uploads=None, forget_upload=None):
+		super().__init__(daemon=True)
+		self.processed_root = processed_root
+		self.uploads_root = uploads_root
+		self.config = config
+		self.cache = cache
+		self.summarize = summarize
+		self.active_uploads = active_uploads or set
+		self.forget_upload = forget_upload
+		# Number of active() blocks of each run and upload, several analyses can share an upload
+		self._active = Counter()
+		self._active_uploads = Counter()
+		self._lock = threading.Lock()
+		# Held for a whole sweep, the background and requested sweeps write the same temporary files
+		self._sweep_lock = threading.Lock()
+		self._stopped = threading.Event()
+
+		self.last_sweep = None
+		self.last_sweep_stats = {}
+
+	def run(self):
+		while not self._stopped.wait(self.config["SWEEP_INTERVAL"]):
+			try:
+				self.sweep()
+			except Exception as e:
+				print(f"Retention sweep failed: {e}")
+
+	def stop(self):
+		self._stopped.set()
+
+	@contextmanager
+	def active(self, run_dir, video_path=None):
+		# Keep the sweeper away from a run, and the upload it analyses, while the run is being produced
+		name = os.path.basename(os.path.normpath(run_dir))
+		upload = os.path.basename(video_path) if video_path is not None else None
+		with self._lock:
+			self._active[name] += 1
+			self._active_uploads[upload] += 1
+		try:
+			yield
+		finally:
+			with self._lock:
+				self._active -= Counter([name])
+				self._active_uploads -= Counter([upload])
+			self.touch(run_dir)
+
+	def touch(self, run_dir):
+		# Record a use of the run, paths outside processed_root are ignored
+		run_dir = os.path.normpath(run_dir)
+		if os.path.dirname(run_dir) != os.path.normpath(self.processed_root) or not os.path.isdir(run_dir):
+			return
+		with open(os.path.join(run_dir, LAST_USED_FILENAME), 'a'):
+			pass
+		os.utime(os.path.join(run_dir, LAST_USED_FILENAME))
+
+	def runs(self):
+		with self._lock:
+			active = set(self._active) | set(self.config["PINNED_RUNS"])
+		for name in os.listdir(self.processed_root):
+			path = os.path.join(self.processed_root, name)
+			if os.path.isdir(path):
+				# Runs in claim() or reading() are being answered from the cache
+				yield name, path, name in active or (self.cache is not None and self.cache.in_use(name))
+
+	def last_used(self, run_dir):
+		marker = os.path.join(run_dir, LAST_USED_FILENAME)
+		return os.path.getmtime(marker if os.path.exists(marker) else run_dir)
+
+	def uploads(self):
+		with self._lock:
+			active = set(self._active_uploads) | set(self.active_uploads())
+		for name in os.listdir(self.uploads_root):
+			path = os.path.join(self.uploads_root, name)
+			if os.path.isfile(path):
+				yield name, path, name in active
+
+	def sweep(self):
+		with self._sweep_lock:
+			return self._sweep()
+
+	def _sweep(self):
+		now = time.time()
+		stats = {"compressed": 0, "compacted": 0, "deleted_runs": 0, "deleted_uploads": 0, "freed_bytes": 0}
+
+		for (name, path, active) in self.runs():
+			if active:
+				continue
+			age = now - self.last_used(path)
+			before = directory_size(path)
+			if age > self.config["DELETE_AFTER_DAYS"] * DAY:
+				self._delete_run(name, path)
+				stats["deleted_runs"] += 1
+			elif age > self.config["COMPACT_AFTER_DAYS"] * DAY:
+				if self._compact(name, path):
+					stats["compacted"] += 1
+			elif age > self.config["COMPRESS_AFTER"]:
+				if self._compress(name, path):
+					stats["compressed"] += 1
+			stats["freed_bytes"] += before - directory_size(path)
+
+		for (name, path, active) in self.uploads():
+			if not active and now - os.path.getmtime(path) > self.config["UPLOAD_MAX_AGE_DAYS"] * DAY:
+				stats["freed_bytes"] += os.path.getsize(path)
+				self._delete_upload(name, path)
+				stats["deleted_uploads"] += 1
+
+		(deleted_runs, deleted_uploads, freed) = self._enforce_quota()
+		stats["deleted_runs"] += deleted_runs
+		stats["deleted_uploads"] += deleted_uploads
+		stats["freed_bytes"] += freed
+
+		self.last_sweep = now
+		self.last_sweep_stats = stats
+		if any(stats.values()):
+			print(f"Retention sweep: {stats}")
+		return stats
+
+	def _enforce_quota(self):
+		# Delete the least recently used runs and uploads until the total fits the quota and enough disk is free
+		quota = self.config["QUOTA_GB"] * GB
+		min_free = self.config["MIN_FREE_GB"] * GB
+		items = [(self.last_used(path), directory_size(path), name, path, True) for (name, path, active) in self.runs() if not active] + \
+			[(os.path.getmtime(path), os.path.getsize(path), name, path, False) for (name, path, active) in self.uploads() if not active]
+		total = self.usage()["total_bytes"]
+		free = shutil.disk_usage(self.processed_root).free
+		(deleted_runs, deleted_uploads, freed) = (0, 0, 0)
+		for (_, size, name, path, is_run) in sorted(items):
+			if (not quota or total <= quota) and free >= min_free:
+				break
+			print(f"Retention: deleting {'run' if is_run else 'upload'} {name} ({size} bytes) to free space")
+			if is_run:
+				self._delete_run(name, path)
+				deleted_runs += 1
+			else:
+				self._delete_upload(name, path)
+				deleted_uploads += 1
+			(total, free, freed) = (total - size, free + size, freed + size)
+		return deleted_runs, deleted_uploads, freed
+
+	def _delete_run(self, name, path):
+		if self.cache is not None:
+			self.cache.forget(name)
+		shutil.rmtree(path, ignore_errors=True)
+
+	def _delete_upload(self, name, path):
+		os.remove(path)
+		if self.forget_upload is not None:
+			self.forget_upload(name)
+
+	def _compress(self, name, path):
+		compressed = False
+		for filename in COMPRESSED_FILES:
+			csv_path = os.path.join(path, filename)
+			if not os.path.exists(csv_path):
+				continue
+			with open(csv_path, 'rb') as src, gzip.open(csv_path + ".gz.tmp", 'wb') as dst:
+				shutil.copyfileobj(src, dst)
+			os.replace(csv_path + ".gz.tmp", csv_path + ".gz")
+			os.remove(csv_path)
+			compressed = True
+		if compressed and self.cache is not None:
+			self.cache.record_size(name)
+		return compressed
+
+	def _compact(self, name, path):
+		summary_path = os.path.join(path, SUMMARY_FILENAME)
+		if os.path.exists(summary_path):
+			return False
+		summary = self.summarize(name) if self.summarize is not None else {}
+		with open(summary_path, 'w') as f:
+			json.dump(summary, f)
+		for filename in HEAVY_FILES:
+			if os.path.exists(os.path.join(path, filename)):
+				os.remove(os.path.join(path, filename))
+		# Without its data the run can no longer answer a repeated request
+		if self.cache is not None:
+			self.cache.forget(name)
+		return True
+
+	def usage(self):
+		# Disk usage of every run and upload
+		runs = []
+		for (name, path, active) in self.runs():
+			files = {}
+			for filename in os.listdir(path):
+				if os.path.isfile(os.path.join(path, filename)) and filename != LAST_USED_FILENAME:
+					files[filename] = os.path.getsize(os.path.join(path, filename))
+			runs.append({
+				"request_id": name,
+				"bytes": sum(files.values()),
+				"files": files,
+				"last_used": self.last_used(path),
+				"active": active,
+				"compressed": any(filename.endswith(".csv.gz") for filename in files),
+				"compacted": SUMMARY_FILENAME in files,
+				"cached": self.cache is not None and self.cache.contains(name)
+			})
+		runs.sort(key=lambda run: run["last_used"], reverse=True)
+		uploads = [{"filename": name, "bytes": os.path.getsize(path), "modified": os.path.getmtime(path), "active": active}
+			for (name, path, active) in self.uploads()]
+		processed = sum(run["bytes"] for run in runs)
+		uploaded = sum(upload["bytes"] for upload in uploads)
+		disk = shutil.disk_usage(self.processed_root)
+		return {
+			"processed_bytes": processed,
+			"uploads_bytes": uploaded,
+			"total_bytes": processed + uploaded,
+			"quota_bytes": self.config["QUOTA_GB"] * GB,
+			"disk_free_bytes": disk.free,
+			"disk_total_bytes": disk.total,
+			"last_sweep": self.last_sweep,
+			"last_sweep_stats": self.last_sweep_stats,
+			"runs": runs,
+			"uploads": uploads
+		}
@@ -0,0 +1,72 @@
+"""
+Production server for the API.
+
+    python serve.py
+
+Runs api_server under gunicorn with threaded workers on Linux/macOS, or
+under waitress on Windows, configured by SERVER_CONFIG. Running
+`gunicorn api_server:app` from this directory picks up the same settings
+through gunicorn.conf.py.
+"""
+import os
+import sys
+from config import SERVER_CONFIG
+
+
+def total_threads():
+    # Every pool gets its own threads, so a full analysis, upload or stream pool never delays the fast endpoints
+    return SERVER_CONFIG["READ_THREADS"] + SERVER_CONFIG["ANALYSIS_THREADS"] + SERVER_CONFIG["UPLOAD_THREADS"] + \
+        SERVER_CONFIG["STREAM_THREADS"]
+
+
+def gunicorn_options():
+    return {
+        "bind": SERVER_CONFIG["BIND"],
+        "workers": SERVER_CONFIG["WORKERS"],
+        "worker_class": "gthread",
+        "threads": total_threads(),
+        "timeout": SERVER_CONFIG["TIMEOUT"],
+        "graceful_timeout": SERVER_CONFIG["TIMEOUT"],
+        "keepalive": SERVER_CONFIG["KEEPALIVE"],
+        # The app starts the retention sweeper thread, which would not survive a fork from a preloaded master
+        "preload_app": False,
+        "accesslog": "-",
+    }
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options().items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from api_server import app
+            return app
+
+    Server().run()
+
+
+def run_waitress():
+    from waitress import serve
+    from api_server import app
+    serve(app, listen=SERVER_CONFIG["BIND"], threads=total_threads(),
+          channel_timeout=SERVER_CONFIG["TIMEOUT"])
+
+
+def main():
+    print(f"Crowd Analysis API on http://{SERVER_CONFIG['BIND']} "
+          f"({SERVER_CONFIG['WORKERS']} worker(s), {total_threads()} threads)")
+    try:
+        if os.name == "nt":
+            run_waitress()
+        else:
+            run_gunicorn()
+    except ImportError as e:
+        sys.exit(f"{e.name} is not installed, run pip install -r requirements.txt")
+
+
+if __name__ == "__main__":
+    main()
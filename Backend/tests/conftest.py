@@ -0,0 +1,9 @@
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The Backend modules import each other and config.py as top-level modules
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+# Helpers shared by the tests, e.g. tracking_helpers
+sys.path.insert(0, TESTS_DIR)
@@ -0,0 +1,28 @@
+import os
+from analysis_cache import AnalysisCache
+
+def _produce(cache, key):
+	with cache.claim(key) as cached:
+		assert not cached
+		with open(os.path.join(cache.path(key), "crowd_data.csv"), 'w') as f:
+			f.write("x" * 100)
+		cache.store(key, key + ".mp4")
+
+def test_claimed_runs_are_not_evicted(tmp_path):
+	cache = AnalysisCache(str(tmp_path), quota_bytes=150)
+	_produce(cache, "a")
+	with cache.claim("a") as cached:
+		assert cached
+		_produce(cache, "b")
+		# Over the quota, but "a" is being served
+		assert os.path.isdir(cache.path("a"))
+	_produce(cache, "c")
+	assert not os.path.isdir(cache.path("a"))
+
+def test_read_runs_are_not_evicted(tmp_path):
+	cache = AnalysisCache(str(tmp_path), quota_bytes=150)
+	_produce(cache, "a")
+	with cache.reading("a"):
+		_produce(cache, "b")
+		assert cache.contains("a")
+	assert cache._readers == {}
@@ -0,0 +1,21 @@
+import numpy as np
+from capture import FrameReader
+
+class _Camera:
+	def __init__(self):
+		self.releases = 0
+
+	def read(self):
+		return True, np.zeros((48, 64, 3), dtype=np.uint8)
+
+	def release(self):
+		self.releases += 1
+
+def test_stopped_reader_releases_the_capture_once():
+	camera = _Camera()
+	reader = FrameReader(camera, 32, paced=True, fps=100)
+	reader.start()
+	next(reader.frames())
+	reader.stop()
+	reader.join()
+	assert camera.releases == 1
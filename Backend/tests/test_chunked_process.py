@@ -0,0 +1,21 @@
+from chunked_process import RecordingTracker
+from deep_sort import nn_matching
+from tracking import detect_human, track_human, skip_tracking
+from tracking_helpers import FRAME, EMPTY, person, encoder
+
+def test_positions_keep_their_frame_counts():
+	metric = nn_matching.NearestNeighborDistanceMetric("cosine", 0.7, None)
+	tracker = RecordingTracker(metric, 30, 0)
+	# Frame counts of the processed frames with what happened on each
+	schedule = [(5, person(100)), (10, person(102)), (15, person(104)), (20, None), (25, EMPTY), (30, "density"),
+		(35, person(106)), (40, person(108))]
+	for (frame_count, detections) in schedule:
+		if detections is None:
+			track_human(tracker)
+		elif detections == "density":
+			skip_tracking(tracker, frame_count, frame_count)
+		else:
+			detect_human(None, None, FRAME, encoder, tracker, frame_count, frame_count, detections)
+	[track] = tracker.tracks
+	assert track.frames.tolist() == [5, 10, 15, 35, 40]
+	assert len(track.positions) == 5
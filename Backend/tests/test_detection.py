@@ -0,0 +1,61 @@
+import numpy as np
+from tracking import detect_frames, _merge_tiles, _tile_regions
+
+class _Net:
+	"""One person in the middle of every image of the blob"""
+
+	def setInput(self, blob):
+		self.images = len(blob)
+
+	def forward(self, ln):
+		row = np.zeros(85, dtype=np.float32)
+		row[:6] = (0.5, 0.5, 0.2, 0.5, 0.9, 0.9)
+		return [np.tile(row, (self.images, 1))]
+
+def test_batch_of_frames_with_different_shapes():
+	frames = [np.zeros((240, 320, 3), dtype=np.uint8), np.zeros((480, 640, 3), dtype=np.uint8)]
+	[small, large] = detect_frames(_Net(), None, frames, input_size=64, tiles=(1, 1))
+	assert small[0] == [[128, 60, 64, 120]]
+	assert large[0] == [[256, 120, 128, 240]]
+	assert large[1] == [(320, 240)]
+
+def test_tiles_follow_the_shape_of_each_frame():
+	frames = [np.zeros((480, 640, 3), dtype=np.uint8), np.zeros((240, 320, 3), dtype=np.uint8)]
+	detections = detect_frames(_Net(), None, frames, input_size=64, tiles=(2, 1))
+	for (frame, [boxes, _, _]) in zip(frames, detections):
+		(height, width) = frame.shape[:2]
+		assert len(boxes) == 2
+		# Every box lies inside its own frame
+		assert all(x >= 0 and y >= 0 and x + w <= width and y + h <= height for (x, y, w, h) in boxes)
+
+def _cut(box, regions):
+	# The pieces of a frame box that the tiles see, in tile coordinates
+	(x, y, w, h) = box
+	tile_detections = []
+	for (x0, y0, tw, th) in regions:
+		(left, top) = (max(x, x0), max(y, y0))
+		(right, bottom) = (min(x + w, x0 + tw), min(y + h, y0 + th))
+		if right - left > 0 and bottom - top > 0:
+			tile_detections.append([[[left - x0, top - y0, right - left, bottom - top]], [None], [0.8]])
+		else:
+			tile_detections.append([[], [], []])
+	return tile_detections
+
+def test_box_spanning_three_tiles_is_joined():
+	regions = _tile_regions(900, 300, (3, 1))
+	[boxes, centroids, confidences] = _merge_tiles(_cut([100, 50, 700, 200], regions), regions, (3, 1))
+	assert boxes == [[100, 50, 700, 200]]
+	assert centroids == [(450, 150)]
+
+def test_box_spanning_four_tiles_is_joined():
+	regions = _tile_regions(600, 600, (2, 2))
+	[boxes, _, _] = _merge_tiles(_cut([200, 150, 200, 300], regions), regions, (2, 2))
+	assert boxes == [[200, 150, 200, 300]]
+
+def test_people_on_both_sides_of_a_seam_are_not_joined():
+	regions = _tile_regions(600, 300, (2, 1))
+	w = regions[0][2]
+	# Both are cut by the seam, one in the upper and one in the lower half of the frame
+	tile_detections = [[[[w - 40, 20, 40, 100]], [None], [0.8]], [[[0, 180, 30, 100]], [None], [0.8]]]
+	[boxes, _, _] = _merge_tiles(tile_detections, regions, (2, 1))
+	assert len(boxes) == 2
@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+import pytest
+from job_progress import ProgressReporter, ProgressBroker, run_with_progress, PROGRESS_VAR, PROGRESS_PREFIX
+
+def test_progress_is_reported_while_the_video_is_displayed(monkeypatch, capsys):
+	monkeypatch.setenv(PROGRESS_VAR, "1")
+	reporter = ProgressReporter(total_frames=10, interval=0)
+	reporter.update(1, 1, indicator=False, count=2)
+	line = capsys.readouterr().out.strip()
+	assert line.startswith(PROGRESS_PREFIX)
+	assert json.loads(line[len(PROGRESS_PREFIX):])["count"] == 2
+
+def test_indicator_is_hidden_while_the_video_is_displayed(monkeypatch, capsys):
+	monkeypatch.delenv(PROGRESS_VAR, raising=False)
+	ProgressReporter().update(1, 1, indicator=False, count=2)
+	assert capsys.readouterr().out == ""
+
+def test_running_and_followed_channels_are_not_evicted():
+	broker = ProgressBroker(max_channels=2)
+	broker.publish("job", "stage", {"stage": "analysis"})
+	events = broker.subscribe("job", keepalive=0.01)
+	assert next(events) == ("stage", {"stage": "analysis"})
+	for i in range(5):
+		broker.publish(f"other_{i}", "done", {}, close=True)
+	broker.publish("job", "done", {"request_id": "r"}, close=True)
+	assert next(events) == ("done", {"request_id": "r"})
+	assert list(events) == []
+	# Only finished channels nobody follows were dropped
+	assert len(broker._channels) == 2
+
+def test_subscribing_to_unknown_ids_creates_no_channels():
+	broker = ProgressBroker(max_channels=2)
+	early = broker.subscribe("job", keepalive=0.01)
+	assert next(early) is None
+	for i in range(5):
+		unknown = broker.subscribe(f"unknown_{i}", keepalive=0.01)
+		assert next(unknown) is None
+		unknown.close()
+	assert list(broker._channels) == []
+	assert list(broker._waiting) == ["job"]
+	# The early subscriber receives the job once it starts
+	broker.publish("job", "done", {}, close=True)
+	assert list(early) == [("done", {})]
+	assert broker._waiting == {}
+
+def test_job_is_pinned_after_it_started():
+	if not hasattr(os, "sched_setaffinity"):
+		pytest.skip("CPU affinity is Linux only")
+	core = sorted(os.sched_getaffinity(0))[0]
+	command = [sys.executable, "-c", "import os; print(sorted(os.sched_getaffinity(0)))"]
+	result = run_with_progress(command, 30, lambda data: None, cores=[core])
+	assert result.stdout.strip() == str([core])
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import pytest
+from live_metrics import LiveMetricsPublisher, read_live_metrics
+
+def test_live_publisher_is_not_replaced():
+	stream = f"test_{os.getpid()}"
+	publisher = LiveMetricsPublisher(stream, capacity=8)
+	try:
+		with pytest.raises(FileExistsError):
+			LiveMetricsPublisher(stream, capacity=8)
+		publisher.publish(1., 3, 0, False, False)
+		assert read_live_metrics(stream)["latest"]["count"] == 3
+	finally:
+		publisher.close()
+	assert read_live_metrics(stream) is None
+	# Closing again does not fail on the removed segment
+	publisher.close()
+
+def test_segment_of_a_dead_publisher_is_replaced():
+	stream = f"test_dead_{os.getpid()}"
+	# A publisher killed before close leaves its segment behind
+	script = ("import os, sys; sys.path.insert(0, '.'); from live_metrics import LiveMetricsPublisher; "
+		f"from multiprocessing import resource_tracker; p = LiveMetricsPublisher('{stream}', capacity=8); "
+		"resource_tracker.unregister(p._shm._name, 'shared_memory'); os._exit(0)")
+	subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	assert read_live_metrics(stream) is not None
+	publisher = LiveMetricsPublisher(stream, capacity=8)
+	try:
+		assert read_live_metrics(stream)["pid"] == os.getpid()
+	finally:
+		publisher.close()
+	assert read_live_metrics(stream) is None
+
+def test_window_keeps_the_latest_record():
+	stream = f"test_window_{os.getpid()}"
+	publisher = LiveMetricsPublisher(stream, capacity=8)
+	try:
+		publisher.publish(1., 3, 0, False, False)
+		publisher.publish(2., 5, 1, False, False)
+		for seconds in (-1, float("nan"), 0):
+			window = read_live_metrics(stream, seconds)["window"]
+			assert (window["count"], window["max_count"]) == ([5], 5)
+	finally:
+		publisher.close()
@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+from analysis_cache import AnalysisCache
+from retention import RetentionManager
+
+CONFIG = {"SWEEP_INTERVAL": 0, "COMPRESS_AFTER": 0, "COMPACT_AFTER_DAYS": 3, "DELETE_AFTER_DAYS": 30,
+	"UPLOAD_MAX_AGE_DAYS": 2, "QUOTA_GB": 0, "MIN_FREE_GB": 0, "PINNED_RUNS": []}
+
+def _retention(tmp_path, **kwargs):
+	(processed, uploads) = (tmp_path / "processed_data", tmp_path / "uploads")
+	processed.mkdir()
+	uploads.mkdir()
+	return RetentionManager(str(processed), str(uploads), CONFIG, **kwargs)
+
+def test_deleted_uploads_are_forgotten(tmp_path):
+	forgotten = []
+	retention = _retention(tmp_path, forget_upload=forgotten.append)
+	path = os.path.join(retention.uploads_root, "id_video.mp4.part")
+	open(path, 'wb').close()
+	old = time.time() - 3 * 24 * 60 * 60
+	os.utime(path, (old, old))
+	assert retention.sweep()["deleted_uploads"] == 1
+	assert forgotten == ["id_video.mp4.part"]
+
+def test_concurrent_sweeps_compress_once(tmp_path):
+	retention = _retention(tmp_path)
+	for i in range(20):
+		run = os.path.join(retention.processed_root, f"run_{i}")
+		os.mkdir(run)
+		with open(os.path.join(run, "crowd_data.csv"), 'w') as f:
+			f.write("Time,Human Count\n" * 10000)
+	sweeps = [threading.Thread(target=retention.sweep) for _ in range(4)]
+	for sweep in sweeps:
+		sweep.start()
+	for sweep in sweeps:
+		sweep.join()
+	for i in range(20):
+		assert os.listdir(os.path.join(retention.processed_root, f"run_{i}")) == ["crowd_data.csv.gz"]
+
+def test_shared_upload_stays_active_until_the_last_analysis_ends(tmp_path):
+	retention = _retention(tmp_path)
+	video_path = os.path.join(retention.uploads_root, "id_video.mp4")
+	open(video_path, 'wb').close()
+	runs = [os.path.join(retention.processed_root, name) for name in ("first", "second")]
+	with retention.active(runs[0], video_path):
+		with retention.active(runs[1], video_path):
+			pass
+		assert [active for (_, _, active) in retention.uploads()] == [True]
+	assert [active for (_, _, active) in retention.uploads()] == [False]
+
+def test_quota_skips_runs_read_from_the_cache(tmp_path):
+	cache = AnalysisCache(str(tmp_path / "cache"), 0)
+	retention = _retention(tmp_path, cache=cache)
+	retention.config = dict(CONFIG, QUOTA_GB=1e-9)
+	run = os.path.join(retention.processed_root, "cached_run")
+	os.mkdir(run)
+	with open(os.path.join(run, "crowd_data.csv.gz"), 'wb') as f:
+		f.write(b"0" * 1000)
+	with cache.reading("cached_run"):
+		assert retention.sweep()["deleted_runs"] == 0
+	assert retention.sweep()["deleted_runs"] == 1
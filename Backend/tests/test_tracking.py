@@ -0,0 +1,67 @@
+from deep_sort import nn_matching
+from deep_sort.tracker import Tracker
+from motion import MotionGate
+from tracking import detect_human, track_human, tracker_uncertain
+from tracking_helpers import FRAME, EMPTY, person, encoder
+
+PERSON = person(100)
+
+def _tracker(max_age=3):
+	metric = nn_matching.NearestNeighborDistanceMetric("cosine", 0.7, None)
+	return Tracker(metric, max_age=max_age)
+
+def _confirm(tracker, frames=4):
+	for time in range(frames):
+		[tracked, _, _] = detect_human(None, None, FRAME, encoder, tracker, time, time, PERSON)
+	assert len(tracked) == 1
+	return frames
+
+def test_empty_detection_frame_ages_tracks():
+	tracker = _tracker()
+	time = _confirm(tracker)
+	detect_human(None, None, FRAME, encoder, tracker, time, time, EMPTY)
+	assert tracker.tracks[0].time_since_update == 1
+
+def test_empty_scene_expires_tracks_between_coasted_frames():
+	tracker = _tracker(max_age=3)
+	time = _confirm(tracker)
+	expired = []
+	for time in range(time, time + 10):
+		[_, frame_expired, _] = detect_human(None, None, FRAME, encoder, tracker, time, time, EMPTY)
+		expired += frame_expired
+		# Frames between detections only extrapolate the tracks
+		for _ in range(3):
+			[tracked, _, _] = track_human(tracker)
+	assert len(expired) == 1
+	assert tracked == []
+	assert tracker.tracks == []
+
+def _gated_counts(frames, detect, tracker):
+	# The detection schedule of video_process with the motion gate on
+	gate = MotionGate(0.002)
+	counts = []
+	forced = []
+	for (time, frame) in enumerate(frames):
+		detections = None if gate.is_static(frame) else detect(frame)
+		if detections is not None or tracker_uncertain(tracker, missed=True):
+			forced.append(detections is None)
+			if detections is None:
+				detections = detect(frame)
+			[tracked, _, _] = detect_human(None, None, frame, encoder, tracker, time, time, detections)
+		else:
+			forced.append(False)
+			[tracked, _, _] = track_human(tracker)
+		counts.append(len(tracked))
+	return counts, forced
+
+def test_static_empty_scene_reports_zero():
+	person = FRAME.copy()
+	person[50:170, 100:140] = 255
+	# A person stands still, then leaves and the scene stays empty and static
+	frames = [person] * 6 + [FRAME] * 30
+	detect = lambda frame: PERSON if frame.any() else EMPTY
+	(counts, forced) = _gated_counts(frames, detect, _tracker(max_age=3))
+	assert counts[5] == 1
+	assert counts[-1] == 0
+	# Once the track expired the static frames are no longer detected
+	assert not any(forced[-10:])
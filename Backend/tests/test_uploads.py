@@ -0,0 +1,38 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from job_progress import run_with_progress
+from uploads import GrowingCapture, UploadSession, UploadStalled
+
+def test_uploads_of_the_same_name_do_not_collide(tmp_path):
+	first = UploadSession(str(tmp_path), "video.mp4", 4)
+	second = UploadSession(str(tmp_path), "video.mp4", 4)
+	assert first.path != second.path
+	assert first.append(io.BytesIO(b"aaaa"), 0, 4)
+	assert second.append(io.BytesIO(b"bbbb"), 0, 4)
+	with open(first.path, 'rb') as f:
+		assert f.read() == b"aaaa"
+	assert first.completed.is_set()
+
+def test_stalled_upload_fails_the_followed_analysis(tmp_path):
+	path = str(tmp_path / "video.mp4")
+	with open(path + ".part", 'wb') as f:
+		f.write(bytes(64))
+	stalled = time.time() - 120
+	os.utime(path + ".part", (stalled, stalled))
+	cap = GrowingCapture(path, poll_interval=0.01, stall_timeout=60)
+	with pytest.raises(UploadStalled):
+		cap.read()
+
+def test_timeout_starts_when_the_upload_completes():
+	command = [sys.executable, "-c", "import time; time.sleep(1.5)"]
+	completed = threading.Event()
+	# Still arriving, the job is not stopped
+	assert run_with_progress(command, 0.5, lambda data: None, timeout_from=completed).returncode == 0
+	completed.set()
+	with pytest.raises(subprocess.TimeoutExpired):
+		run_with_progress(command, 0.5, lambda data: None, timeout_from=completed)
@@ -0,0 +1,36 @@
+import threading
+import time
+import numpy as np
+import video_writer
+from video_writer import BackgroundVideoWriter
+
+FRAME = np.zeros((48, 64, 3), dtype=np.uint8)
+
+class _SlowWriter:
+	def write(self, frame):
+		time.sleep(0.01)
+
+	def release(self):
+		pass
+
+def test_blocking_writes_keep_every_frame(monkeypatch):
+	monkeypatch.setattr(video_writer, "open_video_writer", lambda path, fps, size: (_SlowWriter(), "test"))
+	out = BackgroundVideoWriter("unused.mp4", 10, queue_size=1)
+	out.start()
+	for _ in range(20):
+		out.write(FRAME, block=True)
+	out.close()
+	assert (out.frames_written, out.frames_dropped) == (20, 0)
+
+def test_close_returns_after_the_encoder_died(monkeypatch):
+	def fail(path, fps, size):
+		raise RuntimeError("encoder crashed")
+	monkeypatch.setattr(video_writer, "open_video_writer", fail)
+	monkeypatch.setattr(threading, "excepthook", lambda args: None)
+	out = BackgroundVideoWriter("unused.mp4", 10, queue_size=1)
+	out.start()
+	for _ in range(3):
+		out.write(FRAME, block=True)
+	out.close()
+	assert not out.is_alive()
+	assert out.frames_dropped > 0
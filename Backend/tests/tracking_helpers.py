@@ -0,0 +1,14 @@
+import numpy as np
+
+# Blank frame, the tests pass the detections themselves
+FRAME = np.zeros((240, 320, 3), dtype=np.uint8)
+# Detector output of a frame without people
+EMPTY = [[], [], []]
+
+def person(x):
+	# Detector output of one person standing at x
+	return [[[x, 50, 40, 120]], [(x + 20, 110)], [0.9]]
+
+def encoder(frame, boxes):
+	# Same appearance for every box, tracks are told apart by position
+	return np.ones((len(boxes), 128), dtype=np.float32) / np.sqrt(128)
@@ -1,79 +1,272 @@
+import os
 import numpy as np
 import cv2
-from config import MIN_CONF, NMS_THRESH 
+from resources import stage_threads
+from config import YOLO_CONFIG, MIN_CONF, NMS_THRESH, REID_REUSE_IOU, DETECT_TILES, TILE_OVERLAP
 
 from deep_sort import nn_matching
 from deep_sort.detection import Detection
 from deep_sort.tracker import Tracker
-from deep_sort import generate_detections as gdet
-
-def detect_human (net, ln, frame, encoder, tracker, time):
-# Get the dimension of the frame
-	(frame_height, frame_width) = frame.shape[:2]
-	# Initialize lists needed for detection
-	boxes = []
-	centroids = []
-	confidences = []
-
-	# Construct a blob from the input frame 
-	blob = cv2.dnn.blobFromImage(frame, 1 / 255.0, (416, 416),
+
+def load_detector(precision=YOLO_CONFIG["PRECISION"]):
+	# Load the YOLOv4-tiny pre-trained COCO dataset 
+	net = cv2.dnn.readNetFromDarknet(YOLO_CONFIG["CONFIG_PATH"], YOLO_CONFIG["WEIGHTS_PATH"])
+	if precision == "int8":
+		# Quantize the weights and activations with the calibration frames from quantize_models.py
+		calibration = np.load(YOLO_CONFIG["CALIBRATION_PATH"])
+		net = net.quantize([calibration], cv2.CV_32F, cv2.CV_32F)
+	# Set the preferable backend to CPU since we are not using GPU
+	net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+	if precision == "fp16" and hasattr(cv2.dnn, "DNN_TARGET_CPU_FP16"):
+		net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU_FP16)
+	else:
+		if precision == "fp16":
+			print("FP16 CPU inference is not supported by this OpenCV build, using FP32 detector")
+		net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+	# Get the names of the YOLO output layers
+	ln = net.getLayerNames()
+	ln = [ln[i - 1] for i in np.asarray(net.getUnconnectedOutLayers()).flatten()]
+	return net, ln
+
+def reid_model_path(precision=YOLO_CONFIG["PRECISION"]):
+	# Reduced precision re-ID models are TensorFlow Lite files next to the FP32 graph
+	model_filename = YOLO_CONFIG["REID_MODEL_PATH"]
+	if precision == "fp32":
+		return model_filename
+	return "{}_{}.tflite".format(os.path.splitext(model_filename)[0], precision)
+
+def load_encoder(precision=YOLO_CONFIG["PRECISION"]):
+	# Imported here so that tracking can be used without loading TensorFlow
+	from deep_sort import generate_detections as gdet
+	return gdet.create_box_encoder(reid_model_path(precision), batch_size=1,
+		intra_op_threads=stage_threads("TF_INTRA_OP_THREADS"),
+		inter_op_threads=stage_threads("TF_INTER_OP_THREADS"))
+
+def detect_frames(net, ln, frames, input_size=YOLO_CONFIG["INPUT_SIZE"], tiles=DETECT_TILES):
+	# Split each frame into overlapping tiles, a single tile covers the whole frame.
+	# Batches may mix streams of different sizes, so the tiles follow the shape of each frame
+	shape_regions = {}
+	frame_regions = []
+	for frame in frames:
+		(frame_height, frame_width) = frame.shape[:2]
+		if (frame_width, frame_height) not in shape_regions:
+			shape_regions[(frame_width, frame_height)] = _tile_regions(frame_width, frame_height, tiles)
+		frame_regions.append(shape_regions[(frame_width, frame_height)])
+	images = [frame[y:y + h, x:x + w] for (frame, regions) in zip(frames, frame_regions) for (x, y, w, h) in regions]
+
+	# Construct a single blob from the tiles of every frame in the batch, each tile is resized to the input size
+	blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (input_size, input_size),
 		swapRB=True, crop=False)
 
-	# Perform forward pass of YOLOv3, output are the boxes and probabilities
+	# Perform one forward pass of YOLO for the whole batch, output are the boxes and probabilities
 	net.setInput(blob)
 	layer_outputs = net.forward(ln)
+	# Split the outputs per tile, batched outputs carry a leading batch dimension
+	layer_outputs = [output.reshape(len(images), -1, output.shape[-1]) for output in layer_outputs]
 
-	# For each output
-	for output in layer_outputs:
-		# For each detection in output 
-		for detection in output:
-			# Extract the class ID and confidence 
-			scores = detection[5:]
-			class_id = np.argmax(scores)
-			confidence = scores[class_id]
-			# Class ID for person is 0, check if the confidence meet threshold
-			if class_id == 0 and confidence > MIN_CONF:
-				# Scale the bounding box coordinates back to the size of the image
-				box = detection[0:4] * np.array([frame_width, frame_height, frame_width, frame_height])
-				(center_x, center_y, width, height) = box.astype("int")
-				# Derive the coordinates for the top left corner of the bounding box
-				x = int(center_x - (width / 2))
-				y = int(center_y - (height / 2))
-				# Add processed results to respective list
-				boxes.append([x, y, int(width), int(height)])
-				centroids.append((center_x, center_y))
-				confidences.append(float(confidence))
+	detections = []
+	k = 0
+	for regions in frame_regions:
+		tile_detections = []
+		for (x, y, w, h) in regions:
+			tile_detections.append(_decode_detections([output[k] for output in layer_outputs], w, h))
+			k += 1
+		if len(regions) == 1:
+			frame_detections = tile_detections[0]
+		else:
+			frame_detections = _merge_tiles(tile_detections, regions, tiles)
+		detections.append(_suppress_detections(frame_detections))
+	return detections
+
+def _suppress_detections(detections):
 	# Perform Non-maxima suppression to suppress weak and overlapping boxes
 	# It will filter out unnecessary boxes, i.e. box within box
-	# Output will be indexs of useful boxes
-	idxs = cv2.dnn.NMSBoxes(boxes, confidences, MIN_CONF, NMS_THRESH)
+	[boxes, centroids, confidences] = detections
+	# Output will be indexs of useful boxes, kept in detection order
+	idxs = sorted(np.asarray(cv2.dnn.NMSBoxes(boxes, confidences, MIN_CONF, NMS_THRESH), dtype=int).flatten())
+	return [[boxes[i] for i in idxs], [centroids[i] for i in idxs], [confidences[i] for i in idxs]]
 
-	tracked_bboxes = []
-	expired = []
-	if len(idxs) > 0:
-		del_idxs = []
-		for i in range(len(boxes)):
-			if i not in idxs:
-				del_idxs.append(i)
-		for i in sorted(del_idxs, reverse=True):
-			del boxes[i]
-			del centroids[i]
-			del confidences[i]
+def _tile_regions(frame_width, frame_height, tiles):
+	# Compute (x, y, w, h) of each tile in row-major order, neighbouring tiles share TILE_OVERLAP of their size
+	(columns, rows) = tiles
+	tile_width = int(np.ceil(frame_width / (columns - (columns - 1) * TILE_OVERLAP)))
+	tile_height = int(np.ceil(frame_height / (rows - (rows - 1) * TILE_OVERLAP)))
+	xs = np.linspace(0, frame_width - tile_width, columns).astype(int).tolist()
+	ys = np.linspace(0, frame_height - tile_height, rows).astype(int).tolist()
+	return [(x, y, tile_width, tile_height) for y in ys for x in xs]
+
+def _merge_tiles(tile_detections, regions, tiles):
+	# Move tile detections to frame coordinates and join boxes cut apart by tile seams,
+	# overlapping duplicates inside the shared area are left to non-maxima suppression
+	(columns, rows) = tiles
+	pieces = []
+	for j, ([tile_boxes, _, tile_confidences], (x0, y0, w, h)) in enumerate(zip(tile_detections, regions)):
+		(column, row) = (j % columns, j // columns)
+		margin = 0.01 * max(w, h)
+		for (x, y, bw, bh), confidence in zip(tile_boxes, tile_confidences):
+			pieces.append({
+				"box": [x + x0, y + y0, bw, bh],
+				"confidence": confidence,
+				# First and last tile column and row the box covers
+				"columns": (column, column),
+				"rows": (row, row),
+				# Inner tile edges the box is cut off at
+				"left": column > 0 and x <= margin,
+				"right": column < columns - 1 and x + bw >= w - margin,
+				"top": row > 0 and y <= margin,
+				"bottom": row < rows - 1 and y + bh >= h - margin})
+
+	# A box spanning several tiles is joined one seam at a time, until no seam joins anything
+	joined = True
+	while joined:
+		joined = False
+		for column in range(columns - 1):
+			joined = _join_seam(pieces, column, vertical=True) or joined
+		for row in range(rows - 1):
+			joined = _join_seam(pieces, row, vertical=False) or joined
+
+	boxes = [piece["box"] for piece in pieces]
+	confidences = [piece["confidence"] for piece in pieces]
+	centroids = [(x + w // 2, y + h // 2) for (x, y, w, h) in boxes]
+	return [boxes, centroids, confidences]
+
+def _join_seam(pieces, index, vertical):
+	# Join the boxes cut at the seam after tile column (vertical) or row `index`, True if any were joined.
+	# Only boxes cut at that seam are compared, in order along the seam
+	if vertical:
+		(before_edge, after_edge, span, other_span, axis) = ("right", "left", "columns", "rows", 1)
+	else:
+		(before_edge, after_edge, span, other_span, axis) = ("bottom", "top", "rows", "columns", 0)
+	before = sorted((piece for piece in pieces if piece[before_edge] and piece[span][1] == index),
+		key=lambda piece: piece["box"][axis])
+	after = sorted((piece for piece in pieces if piece[after_edge] and piece[span][0] == index + 1),
+		key=lambda piece: piece["box"][axis])
 
+	joined = set()
+	for a in before:
+		a_end = a["box"][axis] + a["box"][axis + 2]
+		for b in after:
+			if b["box"][axis] >= a_end:
+				break
+			if id(b) in joined or a[other_span][0] > b[other_span][1] or b[other_span][0] > a[other_span][1]:
+				continue
+			if _seam_pair(a["box"], b["box"], axis):
+				_join(a, b, vertical)
+				joined.add(id(b))
+				break
+	pieces[:] = [piece for piece in pieces if id(piece) not in joined]
+	return len(joined) > 0
+
+def _seam_pair(box_a, box_b, axis):
+	# Box b continues box a across the seam, most of their extent along the seam (axis) is shared
+	across = 1 - axis
+	overlap = min(box_a[axis] + box_a[axis + 2], box_b[axis] + box_b[axis + 2]) - max(box_a[axis], box_b[axis])
+	return box_b[across] <= box_a[across] + box_a[across + 2] and overlap >= 0.5 * max(box_a[axis + 2], box_b[axis + 2])
+
+def _join(a, b, vertical):
+	# Grow box a by box b, the joined box is still cut where either part was, except at the joined seam
+	(xa, ya, wa, ha) = a["box"]
+	(xb, yb, wb, hb) = b["box"]
+	(x, y) = (min(xa, xb), min(ya, yb))
+	a["box"] = [x, y, max(xa + wa, xb + wb) - x, max(ya + ha, yb + hb) - y]
+	a["confidence"] = max(a["confidence"], b["confidence"])
+	a["columns"] = (min(a["columns"][0], b["columns"][0]), max(a["columns"][1], b["columns"][1]))
+	a["rows"] = (min(a["rows"][0], b["rows"][0]), max(a["rows"][1], b["rows"][1]))
+	if vertical:
+		(a["right"], a["top"], a["bottom"]) = (b["right"], a["top"] or b["top"], a["bottom"] or b["bottom"])
+	else:
+		(a["bottom"], a["left"], a["right"]) = (b["bottom"], a["left"] or b["left"], a["right"] or b["right"])
+
+def _decode_detections(layer_outputs, frame_width, frame_height, profile=YOLO_CONFIG["DECODE_PROFILE"]):
+	# Each output row holds the box, the objectness and the scores of the 80 COCO classes
+	if profile == "person":
+		# Only touch the box and person columns, the person score already includes the objectness
+		output = np.concatenate([output[:, :6] for output in layer_outputs])
+		confidences = output[:, 5]
+		keep = confidences > MIN_CONF
+	elif profile == "coco":
+		# Extract the class ID and confidence, class ID for person is 0
+		output = np.concatenate(layer_outputs)
+		scores = output[:, 5:]
+		class_ids = np.argmax(scores, axis=1)
+		confidences = scores[np.arange(len(scores)), class_ids]
+		keep = (class_ids == 0) & (confidences > MIN_CONF)
+	else:
+		raise ValueError("Invalid decode profile; must be either 'coco' or 'person'")
+
+	# Scale the bounding box coordinates back to the size of the image
+	box = output[keep, 0:4] * np.array([frame_width, frame_height, frame_width, frame_height])
+	(center_x, center_y, width, height) = box.astype("int").T
+	# Derive the coordinates for the top left corner of the bounding box
+	x = (center_x - (width / 2)).astype("int")
+	y = (center_y - (height / 2)).astype("int")
+
+	boxes = np.stack([x, y, width, height], axis=1).tolist()
+	centroids = list(zip(center_x.tolist(), center_y.tolist()))
+	confidences = confidences[keep].astype(float).tolist()
+	return [boxes, centroids, confidences]
+
+def detect_human (net, ln, frame, encoder, tracker, time, frame_index, detections=None):
+	# Run the detector unless the frame was already part of a detection batch
+	if detections is None:
+		detections = detect_frames(net, ln, [frame])[0]
+	[boxes, centroids, confidences] = detections
+
+	# Tracks age on every detection frame, also without boxes, so people who left expire
+	tracker.predict()
+	reused = 0
+	detections = []
+	if len(boxes) > 0:
 		boxes = np.array(boxes)
 		centroids = np.array(centroids)
 		confidences = np.array(confidences)
-		features = np.array(encoder(frame, boxes))
-		detections = [Detection(bbox, score, centroid, feature) for bbox, score, centroid, feature in zip(boxes, scores, centroids, features)]
+		[features, reused] = _encode(encoder, frame, boxes, tracker)
+		detections = [Detection(bbox, score, centroid, feature) for bbox, score, centroid, feature in zip(boxes, confidences, centroids, features)]
+
+	expired = tracker.update(detections, time, frame_index)
+
+	# Obtain info from the tracks
+	tracked_bboxes = _confirmed_tracks(tracker)
 
-		tracker.predict()
-		expired = tracker.update(detections, time)
+	return [tracked_bboxes, expired, reused]
 
+def skip_tracking(tracker, time, frame_index):
+	# Let the tracks age without detections while the scene is counted by density
+	tracker.predict()
+	expired = tracker.update([], time, frame_index)
+	return [[], expired]
 
-		# Obtain info from the tracks
-		for track in tracker.tracks:
-				if not track.is_confirmed() or track.time_since_update > 5:
-						continue 
-				tracked_bboxes.append(track)
+def track_human(tracker):
+	# Extrapolate the tracks with the Kalman filter, without running the detector
+	tracker.predict(coast=True)
+	return [_confirmed_tracks(tracker), [], 0]
 
-	return [tracked_bboxes, expired]
\ No newline at end of file
+def _encode(encoder, frame, boxes, tracker):
+	# Reuse the feature of a track the detection has barely moved away from,
+	# only the remaining boxes go through the re-ID network
+	reusable = tracker.reusable_features(boxes, REID_REUSE_IOU)
+	encode_idxs = [i for i in range(len(boxes)) if i not in reusable]
+	features = [None] * len(boxes)
+	if len(encode_idxs) > 0:
+		for i, feature in zip(encode_idxs, encoder(frame, boxes[encode_idxs])):
+			features[i] = feature
+	for i, feature in reusable.items():
+		features[i] = feature
+	return [features, len(reusable)]
+
+def tracker_uncertain(tracker, missed=False):
+	# Tentative tracks need consecutive detections before they are confirmed
+	if any(track.is_tentative() for track in tracker.tracks):
+		return True
+	# With `missed`, tracks the last detection did not find are confirmed or expired by detecting again,
+	# a motion gate would otherwise coast them for as long as the scene stays static
+	return missed and any(track.time_since_update > 0 for track in tracker.tracks)
+
+def _confirmed_tracks(tracker):
+	tracked_bboxes = []
+	for track in tracker.tracks:
+			if not track.is_confirmed() or track.time_since_update > 5:
+					continue 
+			tracked_bboxes.append(track)
+	return tracked_bboxes
\ No newline at end of file
@@ -0,0 +1,342 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+import uuid
+import cv2
+from analysis_cache import remember_digest
+
+# A video still being uploaded is written to its path with this suffix
+PARTIAL_SUFFIX = ".part"
+# Bytes copied from the request to disk at a time
+UPLOAD_BLOCK_SIZE = 1 << 20
+# Bytes received before the container is probed
+PROBE_BYTES = 4 << 20
+# Containers that can be analysed while they are still being written, when their index comes first
+FOLLOW_EXTENSIONS = {'mp4', 'mov'}
+
+def probe_video(path):
+	# Open the video with OpenCV and decode its first frame, None if it is not readable
+	cap = cv2.VideoCapture(path)
+	try:
+		if not cap.isOpened():
+			return None
+		(ret, frame) = cap.read()
+		if not ret:
+			return None
+		return {
+			"fps": cap.get(cv2.CAP_PROP_FPS),
+			"frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+			"width": frame.shape[1],
+			"height": frame.shape[0]
+		}
+	finally:
+		cap.release()
+
+def _mp4_boxes(data, start, end):
+	# Yield (type, content start, box end) of the boxes between start and end
+	offset = start
+	while offset + 8 <= end:
+		(size, box_type) = struct.unpack_from(">I4s", data, offset)
+		header = 8
+		if size == 1:
+			if offset + 16 > end:
+				return
+			size = struct.unpack_from(">Q", data, offset + 8)[0]
+			header = 16
+		elif size == 0:
+			size = end - offset
+		if size < header:
+			return
+		yield box_type, offset + header, min(offset + size, end)
+		offset += size
+
+def _mp4_top_level(f, size):
+	# Yield (type, offset, box size) of the top level boxes written so far
+	offset = 0
+	while offset + 8 <= size:
+		f.seek(offset)
+		header = f.read(16)
+		(box_size, box_type) = struct.unpack_from(">I4s", header)
+		if box_size == 1:
+			if len(header) < 16:
+				return
+			box_size = struct.unpack_from(">Q", header, 8)[0]
+		elif box_size == 0:
+			box_size = size - offset
+		if box_size < 8:
+			return
+		yield box_type, offset, box_size
+		offset += box_size
+
+def mp4_index_first(path):
+	"""
+	Walk the top level boxes of an MP4/MOV file. True if the index (moov)
+	comes before the media data (mdat), as in fast-start files, False if it
+	comes after, None if the bytes written so far do not tell.
+	"""
+	with open(path, 'rb') as f:
+		for (box_type, _, _) in _mp4_top_level(f, os.fstat(f.fileno()).st_size):
+			if box_type == b"moov":
+				return True
+			if box_type == b"mdat":
+				return False
+	return None
+
+def mp4_video_sample_ends(path):
+	"""
+	Byte offset where each sample of the first video track ends, from the
+	sample tables of the MP4/MOV index. None if the index is not there yet.
+	"""
+	with open(path, 'rb') as f:
+		size = os.fstat(f.fileno()).st_size
+		for (box_type, offset, box_size) in _mp4_top_level(f, size):
+			if box_type == b"moov":
+				if offset + box_size > size:
+					return None
+				f.seek(offset)
+				moov = f.read(box_size)
+				break
+		else:
+			return None
+
+	def child(start, end, wanted):
+		return next(((s, e) for (t, s, e) in _mp4_boxes(moov, start, end) if t == wanted), None)
+
+	(_, moov_start, moov_end) = next(_mp4_boxes(moov, 0, len(moov)))
+	for (box_type, start, end) in _mp4_boxes(moov, moov_start, moov_end):
+		if box_type != b"trak":
+			continue
+		mdia = child(start, end, b"mdia")
+		hdlr = mdia and child(*mdia, b"hdlr")
+		if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+			continue
+		minf = child(*mdia, b"minf")
+		stbl = minf and child(*minf, b"stbl")
+		if stbl is None:
+			return None
+		(stsz, stsc) = (child(*stbl, b"stsz"), child(*stbl, b"stsc"))
+		stco = child(*stbl, b"stco")
+		(chunk_offsets, offset_format) = (stco, ">I") if stco is not None else (child(*stbl, b"co64"), ">Q")
+		if stsz is None or stsc is None or chunk_offsets is None:
+			return None
+
+		(sample_size, sample_count) = struct.unpack_from(">II", moov, stsz[0] + 4)
+		sizes = [sample_size] * sample_count if sample_size else \
+			struct.unpack_from(f">{sample_count}I", moov, stsz[0] + 12)
+		chunk_count = struct.unpack_from(">I", moov, chunk_offsets[0] + 4)[0]
+		offsets = struct.unpack_from(f">{chunk_count}{offset_format[1]}", moov, chunk_offsets[0] + 8)
+		run_count = struct.unpack_from(">I", moov, stsc[0] + 4)[0]
+		runs = [struct.unpack_from(">II", moov, stsc[0] + 8 + 12 * i) for i in range(run_count)]
+
+		ends = []
+		for (i, (first_chunk, samples_per_chunk)) in enumerate(runs):
+			last_chunk = runs[i + 1][0] - 1 if i + 1 < run_count else chunk_count
+			for chunk in range(first_chunk - 1, last_chunk):
+				end = offsets[chunk]
+				for _ in range(samples_per_chunk):
+					if len(ends) == sample_count:
+						return ends
+					end += sizes[len(ends)]
+					ends.append(end)
+		return ends
+	return None
+
+class UploadStalled(Exception):
+	"""The upload a GrowingCapture follows stopped arriving before it was complete"""
+
+class GrowingCapture:
+	"""
+	A cv2.VideoCapture over a video that is still being uploaded to
+	`path + PARTIAL_SUFFIX`. A frame is only decoded once its sample and the
+	`lookahead` samples after it, which reordered frames may depend on, are
+	on disk, so the analysis never sees a half written frame. The index at
+	the start of a fast-start MP4/MOV tells where the samples end, without
+	it reading waits for the whole upload. The upload is over once it was
+	renamed to `path`. When it has not grown for `stall_timeout` seconds
+	UploadStalled is raised, the analysis of a partial video fails.
+	"""
+
+	def __init__(self, path, poll_interval=1., stall_timeout=60., lookahead=16):
+		self.path = path
+		self.partial_path = path + PARTIAL_SUFFIX
+		self.poll_interval = poll_interval
+		self.stall_timeout = stall_timeout
+		self.lookahead = lookahead
+		self.frames_read = 0
+		self.sample_ends = None
+		if os.path.exists(self.partial_path):
+			self.sample_ends = mp4_video_sample_ends(self.partial_path)
+		self.cap = self._open()
+
+	def _open(self):
+		cap = cv2.VideoCapture(self.partial_path if os.path.exists(self.partial_path) else self.path)
+		if not cap.isOpened():
+			# Renamed while opening
+			cap = cv2.VideoCapture(self.path)
+		if self.frames_read:
+			cap.set(cv2.CAP_PROP_POS_FRAMES, self.frames_read)
+		return cap
+
+	def _available(self):
+		# Bytes on disk while the upload is still growing, None once it is complete
+		try:
+			stat = os.stat(self.partial_path)
+		except FileNotFoundError:
+			return None
+		if time.time() - stat.st_mtime >= self.stall_timeout:
+			if not os.path.exists(self.path):
+				raise UploadStalled(f"{self.partial_path} did not grow for {self.stall_timeout:g} seconds")
+			# Completed meanwhile
+			return None
+		return stat.st_size
+
+	def read(self):
+		# Wait until the frame can be decoded whole, without an index until the upload is complete
+		while True:
+			available = self._available()
+			if available is None:
+				break
+			if self.sample_ends is not None and self.frames_read < len(self.sample_ends):
+				if available >= self.sample_ends[min(self.frames_read + self.lookahead, len(self.sample_ends) - 1)]:
+					break
+			time.sleep(self.poll_interval)
+		if not self.cap.isOpened():
+			# Could not be opened before its index arrived
+			self.cap = self._open()
+		(ret, frame) = self.cap.read()
+		if not ret and self.sample_ends is not None and self.frames_read < len(self.sample_ends):
+			# The demuxer read ahead into the end of the partial file, reopen at the same frame
+			self.cap.release()
+			self.cap = self._open()
+			(ret, frame) = self.cap.read()
+		if ret:
+			self.frames_read += 1
+		return ret, frame
+
+	def isOpened(self):
+		return self.cap.isOpened()
+
+	def get(self, prop):
+		return self.cap.get(prop)
+
+	def set(self, prop, value):
+		if prop == cv2.CAP_PROP_POS_FRAMES:
+			self.frames_read = int(value)
+		return self.cap.set(prop, value)
+
+	def release(self):
+		self.cap.release()
+
+class UploadSession:
+	"""
+	A resumable upload of `filename` to `folder`, written straight to
+	`<path>.part` in the order it arrives and renamed to `path` once `size`
+	bytes are in. The upload id prefixes the file name, so uploads of the
+	same name do not overwrite each other. The container is
+	probed once the first PROBE_BYTES are on disk. MP4/MOV files with their
+	index at the end cannot be opened before they are complete, they are
+	probed then.
+	"""
+
+	def __init__(self, folder, filename, size):
+		self.upload_id = str(uuid.uuid4())
+		self.path = os.path.join(folder, f"{self.upload_id}_{filename}")
+		self.partial_path = self.path + PARTIAL_SUFFIX
+		self.size = size
+		self.probe = None
+		self.lock = threading.Lock()
+		# Set once the upload is complete
+		self.completed = threading.Event()
+		# Time the last chunk arrived
+		self.updated = time.time()
+		# Content hash built as the chunks arrive, for the analysis cache
+		self._digest = hashlib.sha256()
+		# Analysis started while the upload is still arriving
+		self.analysis = None
+		open(self.partial_path, 'wb').close()
+
+	@property
+	def received(self):
+		if os.path.exists(self.path):
+			return self.size
+		if os.path.exists(self.partial_path):
+			return os.path.getsize(self.partial_path)
+		# Removed by the retention sweeper
+		return 0
+
+	@property
+	def complete(self):
+		return os.path.exists(self.path)
+
+	@property
+	def extension(self):
+		return self.path.rsplit('.', 1)[-1].lower()
+
+	def append(self, stream, start, length):
+		# Copy `length` bytes of the request body to disk block by block, False if start is not where the upload stands
+		with self.lock:
+			if self.complete or start != self.received:
+				return False
+			with open(self.partial_path, 'ab') as f:
+				remaining = min(length, self.size - start)
+				while remaining > 0:
+					block = stream.read(min(UPLOAD_BLOCK_SIZE, remaining))
+					if not block:
+						break
+					f.write(block)
+					self._digest.update(block)
+					remaining -= len(block)
+			self.updated = time.time()
+			if self.received >= self.size:
+				os.replace(self.partial_path, self.path)
+				remember_digest(self.path, self._digest.hexdigest())
+				self.completed.set()
+			return True
+
+	def check(self):
+		# Probe the container once enough of it arrived, False if the upload is not a readable video
+		if self.probe is not None:
+			return True
+		received = self.received
+		if received < min(PROBE_BYTES, self.size):
+			return True
+		self.probe = probe_video(self.path if self.complete else self.partial_path)
+		if self.probe is not None:
+			return True
+		# The index of this MP4/MOV is still to come
+		if not self.complete and self.extension in FOLLOW_EXTENSIONS and mp4_index_first(self.partial_path) is not True:
+			return True
+		return False
+
+	@property
+	def followable(self):
+		# Whether the video can be analysed before it is complete, the index is needed to reopen it at later frames
+		return self.probe is not None and (self.complete or
+			(self.extension in FOLLOW_EXTENSIONS and mp4_index_first(self.partial_path) is True))
+
+	def receiving(self, timeout):
+		# Not complete yet and a chunk arrived within the last `timeout` seconds
+		return not self.complete and time.time() - self.updated < timeout
+
+	def idle(self, timeout):
+		# No chunk arrived for `timeout` seconds and no analysis of the upload is running
+		return time.time() - self.updated >= timeout and \
+			(self.analysis is None or not self.analysis['thread'].is_alive())
+
+	def discard(self):
+		for path in (self.partial_path, self.path):
+			if os.path.exists(path):
+				os.remove(path)
+
+	def status(self):
+		return {
+			"upload_id": self.upload_id,
+			"filename": os.path.basename(self.path),
+			"size": self.size,
+			"received": self.received,
+			"complete": self.complete,
+			"probe": self.probe,
+			"analysis_started": self.analysis is not None
+		}
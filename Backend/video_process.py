@@ -7,11 +7,17 @@ import os
 import time
 from math import ceil
 from scipy.spatial.distance import euclidean
-from tracking import detect_human
-from util import rect_distance, progress, kinetic_energy
+from tracking import detect_human, detect_frames, track_human, skip_tracking, tracker_uncertain
+from util import rect_distance, kinetic_energy
 from colors import RGB_COLORS
+from motion import MotionGate
+from video_writer import BackgroundVideoWriter
+from annotations import AnnotationWriter, VIOLATION, RESTRICTED, ABNORMAL as ABNORMAL_FLAG
+from density import estimate_count
+from job_progress import ProgressReporter
 from config import SHOW_DETECT, DATA_RECORD, RE_CHECK, RE_START_TIME, RE_END_TIME, SD_CHECK, SHOW_VIOLATION_COUNT, SHOW_TRACKING_ID, SOCIAL_DISTANCE,\
-	SHOW_PROCESSING_OUTPUT, YOLO_CONFIG, VIDEO_CONFIG, DATA_RECORD_RATE, ABNORMAL_CHECK, ABNORMAL_ENERGY, ABNORMAL_THRESH, ABNORMAL_MIN_PEOPLE
+	SHOW_PROCESSING_OUTPUT, YOLO_CONFIG, VIDEO_CONFIG, DATA_RECORD_RATE, ABNORMAL_CHECK, ABNORMAL_ENERGY, ABNORMAL_THRESH, ABNORMAL_MIN_PEOPLE,\
+	DETECT_INTERVAL, DETECT_BATCH_SIZE, MOTION_GATE, MOTION_THRESH, DENSITY_SWITCH_COUNT, OUTPUT_VIDEO_CONFIG
 from deep_sort import nn_matching
 from deep_sort.detection import Detection
 from deep_sort.tracker import Tracker
@@ -20,61 +26,113 @@ IS_CAM = VIDEO_CONFIG["IS_CAM"]
 HIGH_CAM = VIDEO_CONFIG["HIGH_CAM"]
 
 def _record_movement_data(movement_data_writer, movement):
-	track_id = movement.track_id 
-	entry_time = movement.entry 
-	exit_time = movement.exit			
-	positions = movement.positions
-	positions = np.array(positions).flatten()
-	positions = list(positions)
-	data = [track_id] + [entry_time] + [exit_time] + positions
-	movement_data_writer.writerow(data)
+	# Buffered by the recorder, the positions are copied without building a row list
+	movement_data_writer.record(movement.track_id, movement.entry, movement.exit, movement.positions)
 
 def _record_crowd_data(time, human_count, violate_count, restricted_entry, abnormal_activity, crowd_data_writer):
-	data = [time, human_count, violate_count, int(restricted_entry), int(abnormal_activity)]
-	crowd_data_writer.writerow(data)
+	crowd_data_writer.record(time, human_count, violate_count, restricted_entry, abnormal_activity)
 
 def _end_video(tracker, frame_count, movement_data_writer):
 	for t in tracker.tracks:
 		if t.is_confirmed():
 			t.exit = frame_count
 			_record_movement_data(movement_data_writer, t)
-		
 
-def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writer, crowd_data_writer, output_dir='processed_data'):
+def _read_frames(cap, frame_size, data_record_frame, start_frame=0, end_frame=None):
+	# Yield every frame read as (frame_count, frame), frames skipped by the record rate are None
+	# start_frame and end_frame select a range of 0-based frame positions, frame counts stay absolute
+	if start_frame > 0:
+		cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+	frame_count = start_frame
+	while end_frame is None or frame_count < end_frame:
+		(ret, frame) = cap.read()
+		if not ret:
+			return
+		if frame_count > 1000000:
+			frame_count = 0
+		frame_count += 1
+		if frame_count % data_record_frame != 0:
+			yield frame_count, None
+		else:
+			# Resize Frame to given size
+			yield frame_count, imutils.resize(frame, width=frame_size)
+
+def _detect_in_batches(frames, net, ln, batch_size, detect_interval, motion_gate=None):
+	# Run the detector once per batch of frames scheduled for detection
+	# Yield (frame_count, frame, detections) in reading order, detections is None for unscheduled frames
+	buffer = []
+	scheduled = []
+	sampled_count = 0
+	for frame_count, frame in frames:
+		if frame is not None:
+			if sampled_count % detect_interval == 0:
+				# Static frames are left to the tracker's prediction
+				if motion_gate is None or not motion_gate.is_static(frame):
+					scheduled.append(len(buffer))
+			sampled_count += 1
+		buffer.append([frame_count, frame, None])
+		if len(scheduled) == batch_size:
+			_fill_detections(buffer, scheduled, net, ln)
+			yield from buffer
+			buffer = []
+			scheduled = []
+	_fill_detections(buffer, scheduled, net, ln)
+	yield from buffer
+
+def _fill_detections(buffer, scheduled, net, ln):
+	if len(scheduled) == 0:
+		return
+	detections = detect_frames(net, ln, [buffer[i][1] for i in scheduled])
+	for i, frame_detections in zip(scheduled, detections):
+		buffer[i][2] = frame_detections
+
+
+def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writer, crowd_data_writer, output_dir='processed_data',
+	frames=None, detect=None, show_output=SHOW_PROCESSING_OUTPUT, start_frame=0, end_frame=None, live_metrics=None):
+	# frames replaces reading cap with live (frame_count, frame, detections) tuples, detect replaces
+	# running net on a single frame, both are used by the multi-stream runner to share one detector
+	# start_frame and end_frame limit a video to a range of frames, used by chunked processing
+	# live_metrics receives the metrics of every processed frame of a live source
 	def _calculate_FPS():
+		nonlocal VID_FPS
 		t1 = time.time() - t0
-		VID_FPS = frame_count / t1
+		VID_FPS = display_frame_count / t1
 
-	if IS_CAM:
+	if detect is None:
+		detect = lambda frame: detect_frames(net, ln, [frame])[0]
+	live = IS_CAM or frames is not None
+	if live:
 		VID_FPS = None
 		DATA_RECORD_FRAME = 1
-		TIME_STEP = 1
+		# Energy of live sources is measured per captured frame
+		FRAME_TIME = 1
 		t0 = time.time()
 	else:
 		VID_FPS = cap.get(cv2.CAP_PROP_FPS)
 		DATA_RECORD_FRAME = int(VID_FPS / DATA_RECORD_RATE)
-		TIME_STEP = DATA_RECORD_FRAME/VID_FPS
+		FRAME_TIME = 1/VID_FPS
+
+	# Annotations are burned into the processed video, or written as a track the frontend draws over the upload
+	overlay = OUTPUT_VIDEO_CONFIG["MODE"] == "overlay"
+	# Frames are only drawn on for the processed video or the local display
+	burn = show_output or not overlay
+	annotation_writer = AnnotationWriter(os.path.join(output_dir, 'annotations.jsonl')) if overlay else None
 
-	# Initialize VideoWriter to save processed video for web display
+	# Annotated frames are encoded on a background thread to save the processed video for web display
 	output_video_path = os.path.join(output_dir, 'processed_video.mp4')
-	# Try multiple codecs for best browser compatibility
-	# H.264 (best) -> XVID (good) -> mp4v (fallback)
-	codecs_to_try = ['avc1', 'H264', 'X264', 'XVID', 'mp4v']
-	fourcc = None
-	for codec in codecs_to_try:
-		try:
-			test_fourcc = cv2.VideoWriter_fourcc(*codec)
-			fourcc = test_fourcc
-			print(f"Using video codec: {codec}")
-			break
-		except:
-			continue
-	if fourcc is None:
-		fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Ultimate fallback
-		print("Using fallback codec: mp4v")
-	# We'll initialize the VideoWriter after we get the first frame to know the dimensions
 	out = None
-	first_frame = True
+	if not live and not overlay:
+		preview_path = os.path.join(output_dir, 'processed_video_preview.mp4') if OUTPUT_VIDEO_CONFIG["PREVIEW"] else None
+		# Only every DATA_RECORD_FRAME-th frame is processed
+		out = BackgroundVideoWriter(output_video_path, VID_FPS / DATA_RECORD_FRAME, preview_path=preview_path)
+		out.start()
+
+	# Progress streamed by api_server, or the console indicator
+	if live:
+		total_frames = None
+	else:
+		total_frames = end_frame if end_frame is not None else int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+	reporter = ProgressReporter(total_frames)
 
 	frame_count = 0
 	display_frame_count = 0
@@ -85,52 +143,54 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 	RE = False
 	ABNORMAL = False
 
-	while True:
-		(ret, frame) = cap.read()
-
-		# Stop the loop when video ends
-		if not ret:
-			_end_video(tracker, frame_count, movement_data_writer)
-			if not VID_FPS:
-				_calculate_FPS()
-			break
+	association_time = 0
+	detection_frames = 0
+	reused_features = 0
+	density_frames = 0
+	# Crowd count of the last density frame, held until the next detection
+	density_count = None
 
-		# Update frame count
-		if frame_count > 1000000:
-			if not VID_FPS:
-				_calculate_FPS()
-			frame_count = 0
+	motion_gate = MotionGate(MOTION_THRESH) if MOTION_GATE and frames is None else None
+	if frames is None:
+		frames = _detect_in_batches(_read_frames(cap, frame_size, DATA_RECORD_FRAME, start_frame, end_frame), net, ln, DETECT_BATCH_SIZE, DETECT_INTERVAL, motion_gate)
+	for (frame_count, frame, detections) in frames:
+		# Frame count restarts after 1000000 frames
+		if frame_count == 1:
 			display_frame_count = 0
-		frame_count += 1
-		
+
 		# Skip frames according to given rate
-		if frame_count % DATA_RECORD_FRAME != 0:
+		if frame is None:
 			continue
 
 		display_frame_count += 1
 
-		# Resize Frame to given size
-		frame = imutils.resize(frame, width=frame_size)
-
-		# Initialize VideoWriter on first frame (now we know the dimensions)
-		if first_frame and not IS_CAM:
-			height, width = frame.shape[:2]
-			out = cv2.VideoWriter(output_video_path, fourcc, VID_FPS, (width, height))
-			first_frame = False
-			print(f"Initializing processed video output: {output_video_path}")
-			print(f"Video dimensions: {width}x{height}, FPS: {VID_FPS}")
-
 		# Get current time
 		current_datetime = datetime.datetime.now()
 
 		# Run detection algorithm
-		if IS_CAM:
+		if live:
 			record_time = current_datetime
 		else:
 			record_time = frame_count
 		
-		# Run tracking algorithm
-		[humans_detected, expired] = detect_human(net, ln, frame, encoder, tracker, record_time)
+		# Run tracking algorithm, extrapolating tracks between detection frames
+		if detections is not None or tracker_uncertain(tracker, missed=MOTION_GATE):
+			if detections is None:
+				detections = detect(frame)
+			detection_frames += 1
+			if DENSITY_SWITCH_COUNT > 0 and len(detections[0]) > DENSITY_SWITCH_COUNT:
+				# Too crowded to track individuals, count from the detection density instead
+				density_count = estimate_count(detections[0], frame.shape)
+				[humans_detected, expired] = skip_tracking(tracker, record_time, frame_count)
+				density_frames += 1
+			else:
+				[humans_detected, expired, reused] = detect_human(net, ln, frame, encoder, tracker, record_time, frame_count, detections)
+				reused_features += reused
+				association_time += tracker.association_time
+				density_count = None
+		else:
+			[humans_detected, expired, _] = track_human(tracker)
+		human_count = len(humans_detected) if density_count is None else density_count
 
 		# Record movement data
 		for movement in expired:
@@ -143,6 +203,8 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 				if len(humans_detected) > 0:
 					RE = True
 			
+		# Annotated boxes of the frame, [id, x1, y1, x2, y2, flags, violations]
+		boxes = []
 		# Initiate video process loop
 		if SHOW_PROCESSING_OUTPUT or SHOW_DETECT or SD_CHECK or RE_CHECK or ABNORMAL_CHECK:
 			# Initialize set for violate so an individual will be recorded only once
@@ -180,10 +242,17 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 
 				# Compute energy level for each detection
 				if ABNORMAL_CHECK:
-					ke = kinetic_energy(track.positions[-1], track.positions[-2], TIME_STEP)
+					# Positions are recorded on detection frames only, the frame indices give the time between them
+					steps = track.frames[-1] - track.frames[-2]
+					ke = kinetic_energy(track.positions[-1], track.positions[-2], FRAME_TIME * steps)
 					if ke > ABNORMAL_ENERGY:
 						abnormal_individual.append(track.track_id)
 
+				flags = (RESTRICTED if RE else 0) | (VIOLATION if i in violate_set else 0)
+				boxes.append([int(idx), x, y, w, h, flags, int(violate_count[i])])
+				if not burn:
+					continue
+
 				# If restrited entry is on, draw red boxes around each detection
 				if RE:
 					cv2.rectangle(frame, (x + 5 , y + 5 ), (w - 5, h - 5), RGB_COLORS["red"], 5)
@@ -215,7 +284,7 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 			else: 
 				sd_warning_timeout -= 1
 			# Display violation warning and count on screen
-			if sd_warning_timeout > 0:
+			if sd_warning_timeout > 0 and burn:
 				text = "Violation count: {}".format(len(violate_set))
 				cv2.putText(frame, text, (200, frame.shape[0] - 30),
 					cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
@@ -228,7 +297,7 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 			else: 
 				re_warning_timeout -= 1
 			# Display restricted entry warning and count on screen
-			if re_warning_timeout > 0:
+			if re_warning_timeout > 0 and burn:
 				if display_frame_count % 3 != 0 :
 					cv2.putText(frame, "RESTRICTED ENTRY", (200, 100),
 						cv2.FONT_HERSHEY_SIMPLEX, 1, RGB_COLORS["red"], 3)
@@ -239,20 +308,21 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 				# Warning stays on screen for 10 frames
 				ab_warning_timeout = 10
 				# Draw blue boxes over the the abnormally behave detection if abnormal activity detected
-				for track in humans_detected:
-					if track.track_id in abnormal_individual:
-						[x, y, w, h] = list(map(int, track.to_tlbr().tolist()))
-						cv2.rectangle(frame, (x , y ), (w, h), RGB_COLORS["blue"], 5)
+				for box in boxes:
+					if box[0] in abnormal_individual:
+						box[5] |= ABNORMAL_FLAG
+						if burn:
+							cv2.rectangle(frame, (box[1], box[2]), (box[3], box[4]), RGB_COLORS["blue"], 5)
 			else:
 				ab_warning_timeout -= 1
-			if ab_warning_timeout > 0:
+			if ab_warning_timeout > 0 and burn:
 				if display_frame_count % 3 != 0:
 					cv2.putText(frame, "ABNORMAL ACTIVITY", (130, 250),
 						cv2.FONT_HERSHEY_SIMPLEX, 1.5, RGB_COLORS["blue"], 5)
 
 		# Display crowd count on screen
-		if SHOW_DETECT:
-			text = "Crowd count: {}".format(len(humans_detected))
+		if SHOW_DETECT and burn:
+			text = "Crowd count: {}".format(human_count)
 			cv2.putText(frame, text, (10, 30),
 				cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 3)
 
@@ -264,31 +334,90 @@ def video_process(cap, frame_size, net, ln, encoder, tracker, movement_data_writ
 		
 		# Record crowd data to file
 		if DATA_RECORD:
-			_record_crowd_data(record_time, len(humans_detected), len(violate_set), RE, ABNORMAL, crowd_data_writer)
+			_record_crowd_data(record_time, human_count, len(violate_set), RE, ABNORMAL, crowd_data_writer)
+
+		# Publish the frame's metrics to api_server's live endpoint
+		if live_metrics is not None:
+			live_metrics.publish(record_time.timestamp(), human_count, len(violate_set), RE, ABNORMAL)
+
+		# Live sources write their buffered rows at least every FLUSH_INTERVAL seconds
+		crowd_data_writer.flush_due()
+		movement_data_writer.flush_due()
 
-		# Display video output or processing indicator
-		if SHOW_PROCESSING_OUTPUT:
+		# Record the frame's annotations for the frontend overlay
+		if annotation_writer is not None:
+			warnings = {
+				"violation_count": len(violate_set) if SD_CHECK and sd_warning_timeout > 0 else 0,
+				"restricted": RE_CHECK and re_warning_timeout > 0,
+				"abnormal": ABNORMAL_CHECK and ab_warning_timeout > 0
+			}
+			annotation_time = record_time.isoformat() if live else round((frame_count - 1) / VID_FPS, 3)
+			annotation_writer.write(frame_count, annotation_time, frame.shape, None if live else VID_FPS / DATA_RECORD_FRAME,
+				human_count, boxes, warnings)
+
+		# Progress of every frame for api_server, the console indicator only without the video output
+		reporter.update(frame_count, display_frame_count, indicator=not show_output,
+			time=record_time.isoformat() if live else round((frame_count - 1) / VID_FPS, 3), count=human_count,
+			violations=len(violate_set) if SD_CHECK else 0, restricted=RE_CHECK and bool(RE), abnormal=ABNORMAL_CHECK and bool(ABNORMAL))
+
+		# Display video output
+		if show_output:
 			cv2.imshow("Processed Output", frame)
-		else:
-			progress(display_frame_count)
 
-		# Write frame to output video file for web display
+		# Queue frame for the output video file, waits for the encoder so the video keeps
+		# every frame of crowd_data.csv and the annotations
 		if out is not None:
-			out.write(frame)
+			out.write(frame, block=True)
 
 		# Press 'Q' to stop the video display
-		if cv2.waitKey(1) & 0xFF == ord('q'):
+		if show_output and cv2.waitKey(1) & 0xFF == ord('q'):
 			# Record the movement when video ends
 			_end_video(tracker, frame_count, movement_data_writer)
 			# Compute the processing speed
 			if not VID_FPS:
 				_calculate_FPS()
 			break
+	else:
+		# Record the movement when video ends
+		_end_video(tracker, frame_count, movement_data_writer)
+		if not VID_FPS:
+			_calculate_FPS()
 	
-	# Release VideoWriter and save processed video
+	reporter.flush()
+	# Write the remaining rows, the caller closes the files
+	crowd_data_writer.flush()
+	movement_data_writer.flush()
+
+	if annotation_writer is not None:
+		annotation_writer.close()
+		print(f"Annotations saved to: {annotation_writer.path}")
+
+	# Finish encoding and save processed video
 	if out is not None:
-		out.release()
-		print(f"Processed video saved to: {output_video_path}")
+		out.close()
+		if out.codec is not None:
+			print(f"Processed video saved to: {output_video_path}")
 	
-	cv2.destroyAllWindows()
-	return VID_FPS
+	# Processing statistics saved with the video data
+	stats = {
+		"PROCESSED_FRAMES": display_frame_count,
+		"DETECTION_FRAMES": detection_frames,
+		"REID_REUSED_PER_FRAME": round(reused_features / max(1, detection_frames - density_frames), 2),
+		"ASSOCIATION_MS_PER_FRAME": round(association_time / max(1, detection_frames - density_frames) * 1000, 3),
+		"DENSITY_FRAMES": density_frames
+	}
+	if motion_gate is not None:
+		stats["MOTION_GATE"] = motion_gate.stats()
+	if out is not None:
+		stats["VIDEO_OUTPUT"] = out.stats()
+		print("Average encode time per frame (ms): ", stats["VIDEO_OUTPUT"]["ENCODE_MS_PER_FRAME"])
+	stats["DATA_RECORD"] = {"CROWD": crowd_data_writer.stats(), "MOVEMENT": movement_data_writer.stats()}
+	print("Detection ran on {} of {} processed frames".format(detection_frames, display_frame_count))
+	if density_frames > 0:
+		print("Crowd counted by density on {} detection frames".format(density_frames))
+	print("Re-ID encodings saved per detection frame: ", stats["REID_REUSED_PER_FRAME"])
+	print("Average association time per frame (ms): ", stats["ASSOCIATION_MS_PER_FRAME"])
+
+	if show_output:
+		cv2.destroyAllWindows()
+	return VID_FPS, stats
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+import cv2
+from config import OUTPUT_VIDEO_CONFIG
+
+def open_video_writer(path, fps, size, codecs=OUTPUT_VIDEO_CONFIG["CODECS"]):
+	# Return (writer, codec) for the first codec whose encoder actually opens, (None, None) if none does
+	for codec in codecs:
+		writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+		if writer.isOpened():
+			return writer, codec
+		writer.release()
+	return None, None
+
+class BackgroundVideoWriter(threading.Thread):
+	"""
+	Encodes annotated frames on a background thread. Frames wait in a queue
+	of `queue_size`, when the encoder falls that far behind writes with
+	`block` wait for it (video files), other writes drop the frame so a live
+	processing loop never blocks. The writer is opened on the
+	first frame, once its size is known. With `preview_width` a smaller copy
+	of every `preview_step`-th frame is written to `preview_path` as well.
+	"""
+
+	def __init__(self, path, fps, queue_size=OUTPUT_VIDEO_CONFIG["QUEUE_SIZE"], preview_path=None,
+		preview_width=OUTPUT_VIDEO_CONFIG["PREVIEW_WIDTH"], preview_step=OUTPUT_VIDEO_CONFIG["PREVIEW_STEP"]):
+		super().__init__(daemon=True)
+		self.path = path
+		self.fps = fps
+		self.preview_path = preview_path
+		self.preview_width = preview_width
+		self.preview_step = preview_step
+		self._queue = queue.Queue(maxsize=queue_size)
+
+		# Writer statistics
+		self.codec = None
+		self.frames_written = 0
+		self.frames_dropped = 0
+		self.encode_time = 0.
+
+	def write(self, frame, block=False):
+		# Offline callers block instead of dropping frames
+		try:
+			if block:
+				self._put(frame)
+			else:
+				self._queue.put(frame, block=False)
+		except queue.Full:
+			self.frames_dropped += 1
+
+	def close(self):
+		# Wait for the queued frames to be encoded
+		try:
+			self._put(None)
+		except queue.Full:
+			pass
+		self.join()
+
+	def _put(self, item):
+		# Wait for room in the queue while the encoder thread runs, a thread that died never makes room
+		while True:
+			try:
+				self._queue.put(item, timeout=1.)
+				return
+			except queue.Full:
+				if not self.is_alive():
+					raise
+
+	def run(self):
+		out = None
+		preview = None
+		while True:
+			frame = self._queue.get()
+			if frame is None:
+				break
+			t0 = time.time()
+			if out is None:
+				(height, width) = frame.shape[:2]
+				(out, self.codec) = open_video_writer(self.path, self.fps, (width, height))
+				if out is None:
+					print(f"No working video codec found, {self.path} is not written")
+					self._drain()
+					return
+				print(f"Writing processed video: {self.path} ({self.codec}, {width}x{height}, FPS: {self.fps})")
+				if self.preview_path is not None:
+					preview_size = (self.preview_width, int(height * self.preview_width / width) // 2 * 2)
+					(preview, _) = open_video_writer(self.preview_path, self.fps / self.preview_step, preview_size)
+			out.write(frame)
+			if preview is not None and self.frames_written % self.preview_step == 0:
+				preview.write(cv2.resize(frame, preview_size, interpolation=cv2.INTER_AREA))
+			self.frames_written += 1
+			self.encode_time += time.time() - t0
+		if out is not None:
+			out.release()
+		if preview is not None:
+			preview.release()
+
+	def _drain(self):
+		# Without an encoder, keep accepting frames until close
+		while self._queue.get() is not None:
+			pass
+
+	def stats(self):
+		return {
+			"CODEC": self.codec,
+			"FRAMES_WRITTEN": self.frames_written,
+			"FRAMES_DROPPED": self.frames_dropped,
+			"ENCODE_MS_PER_FRAME": round(self.encode_time / max(1, self.frames_written) * 1000, 3)
+		}
@@ -2,6 +2,10 @@ import { useState, useRef, useEffect } from 'react'
 import './index.css'
 
 const API_BASE_URL = 'http://localhost:5000/api'
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+const UPLOAD_RETRIES = 3
+// Recent crowd counts shown while an analysis runs
+const PROGRESS_HISTORY = 120
 
 interface AnalysisResult {
   video_data: {
@@ -29,10 +33,204 @@ interface AnalysisResult {
   }
 }
 
+// Latest 'stage' and 'progress' events of /api/progress/<progress_id>
+interface LiveProgress {
+  stage: string
+  frame?: number
+  total_frames?: number | null
+  fps?: number
+  count?: number
+  violations?: number
+  restricted?: boolean
+  abnormal?: boolean
+}
+
+interface AnnotationFrame {
+  frame: number
+  time: number
+  count: number
+  // [id, x1, y1, x2, y2, flags, violations]
+  boxes: number[][]
+  warnings: {
+    violation_count: number
+    restricted: boolean
+    abnormal: boolean
+  }
+}
+
+interface AnnotationTrack {
+  width: number
+  height: number
+  flags: { violation: number; restricted: number; abnormal: number }
+  frames: AnnotationFrame[]
+}
+
+// Parse the JSON lines annotation track, the first line describes the processed frames
+function parseAnnotations(text: string): AnnotationTrack {
+  const [header, ...lines] = text.split('\n').filter(line => line.trim() !== '').map(line => JSON.parse(line))
+  return { width: header.width, height: header.height, flags: header.flags, frames: lines }
+}
+
+// Latest annotated frame at or before the given video time
+function frameAt(frames: AnnotationFrame[], time: number): AnnotationFrame | null {
+  let low = 0
+  let high = frames.length - 1
+  let found: AnnotationFrame | null = null
+  while (low <= high) {
+    const mid = (low + high) >> 1
+    if (frames[mid].time <= time) {
+      found = frames[mid]
+      low = mid + 1
+    } else {
+      high = mid - 1
+    }
+  }
+  return found
+}
+
+function drawAnnotations(ctx: CanvasRenderingContext2D, track: AnnotationTrack, frame: AnnotationFrame) {
+  ctx.clearRect(0, 0, track.width, track.height)
+  ctx.font = '22px sans-serif'
+  for (const [id, x1, y1, x2, y2, flags] of frame.boxes) {
+    if (flags & track.flags.restricted) {
+      ctx.strokeStyle = 'red'
+      ctx.lineWidth = 5
+      ctx.strokeRect(x1 + 5, y1 + 5, x2 - x1 - 10, y2 - y1 - 10)
+    }
+    ctx.strokeStyle = flags & track.flags.abnormal ? 'blue' : flags & track.flags.violation ? 'yellow' : 'lime'
+    ctx.lineWidth = flags & track.flags.abnormal ? 5 : 2
+    ctx.strokeRect(x1, y1, x2 - x1, y2 - y1)
+    ctx.fillStyle = 'lime'
+    ctx.fillText(String(id), x1, y1 - 10)
+  }
+  ctx.fillStyle = 'white'
+  ctx.font = 'bold 28px sans-serif'
+  ctx.fillText(`Crowd count: ${frame.count}`, 10, 35)
+  if (frame.warnings.violation_count > 0) {
+    ctx.fillStyle = 'red'
+    ctx.fillText(`Violation count: ${frame.warnings.violation_count}`, 200, track.height - 30)
+  }
+  if (frame.warnings.restricted) {
+    ctx.fillStyle = 'red'
+    ctx.fillText('RESTRICTED ENTRY', 200, 100)
+  }
+  if (frame.warnings.abnormal) {
+    ctx.fillStyle = 'blue'
+    ctx.font = 'bold 40px sans-serif'
+    ctx.fillText('ABNORMAL ACTIVITY', 130, 250)
+  }
+}
+
+// Original video with the annotation track drawn on a canvas over it
+function AnnotatedVideo({ src, track }: { src: string; track: AnnotationTrack }) {
+  const videoRef = useRef<HTMLVideoElement>(null)
+  const canvasRef = useRef<HTMLCanvasElement>(null)
+
+  useEffect(() => {
+    const video = videoRef.current
+    const ctx = canvasRef.current?.getContext('2d')
+    if (!video || !ctx) return
+    let handle = 0
+    let drawn: AnnotationFrame | null = null
+    const draw = () => {
+      const frame = frameAt(track.frames, video.currentTime)
+      if (frame !== drawn) {
+        if (frame) {
+          drawAnnotations(ctx, track, frame)
+        } else {
+          ctx.clearRect(0, 0, track.width, track.height)
+        }
+        drawn = frame
+      }
+      handle = requestAnimationFrame(draw)
+    }
+    handle = requestAnimationFrame(draw)
+    return () => cancelAnimationFrame(handle)
+  }, [track])
+
+  return (
+    <div className="relative">
+      <video ref={videoRef} src={src} controls className="w-full bg-black block">
+        Your browser does not support the video tag.
+      </video>
+      <canvas
+        ref={canvasRef}
+        width={track.width}
+        height={track.height}
+        className="absolute inset-0 w-full h-full pointer-events-none"
+      />
+    </div>
+  )
+}
+
+// Crowd counts of the running analysis as a line
+function Sparkline({ values }: { values: number[] }) {
+  if (values.length < 2) return null
+  const max = Math.max(...values, 1)
+  const points = values
+    .map((value, i) => `${(i / (values.length - 1)) * 100},${30 - (value / max) * 28}`)
+    .join(' ')
+  return (
+    <svg viewBox="0 0 100 30" preserveAspectRatio="none" className="w-full h-10 mt-3">
+      <polyline points={points} fill="none" stroke="#8b5cf6" strokeWidth="1.5" vectorEffect="non-scaling-stroke" />
+    </svg>
+  )
+}
+
+// Repeat a request the server turned away with 503 because all its slots were busy, waiting as long as it asks
+async function fetchWhenAvailable(url: string, init: RequestInit) {
+  while (true) {
+    const response = await fetch(url, init)
+    if (response.status !== 503) return response
+    const retryAfter = Number(response.headers.get('Retry-After')) || 5
+    await new Promise(resolve => setTimeout(resolve, retryAfter * 1000))
+  }
+}
+
+// Upload in chunks the server writes straight to disk, resuming from the server's offset after a failed chunk
+async function uploadInChunks(file: File, onProgress: (percent: number) => void) {
+  const created = await fetch(`${API_BASE_URL}/uploads`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size, analyze_early: true }),
+  })
+  let upload = await created.json()
+  if (!created.ok) throw new Error(upload.error || 'Upload failed')
+
+  let failures = 0
+  while (!upload.complete) {
+    const start = upload.received
+    const end = Math.min(start + UPLOAD_CHUNK_SIZE, file.size)
+    try {
+      const response = await fetchWhenAvailable(`${API_BASE_URL}/uploads/${upload.upload_id}`, {
+        method: 'PUT',
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'Content-Range': `bytes ${start}-${end - 1}/${file.size}`,
+        },
+        body: file.slice(start, end),
+      })
+      const data = await response.json()
+      // 409: the server has a different offset, continue from there
+      if (!response.ok && response.status !== 409) throw new Error(data.error || 'Upload failed')
+      upload = { ...upload, ...data }
+      failures = 0
+    } catch (err) {
+      // fetch rejects with a TypeError when the connection fails, anything else is final
+      if (!(err instanceof TypeError) || ++failures > UPLOAD_RETRIES) throw err
+      const status = await fetch(`${API_BASE_URL}/uploads/${upload.upload_id}`)
+      upload = await status.json()
+    }
+    onProgress(Math.round((upload.received / file.size) * 100))
+  }
+  return upload
+}
+
 function App() {
   const [selectedFile, setSelectedFile] = useState<File | null>(null)
   const [isDragging, setIsDragging] = useState(false)
   const [isUploading, setIsUploading] = useState(false)
+  const [uploadProgress, setUploadProgress] = useState(0)
   const [isAnalyzing, setIsAnalyzing] = useState(false)
   const [analysisResult, setAnalysisResult] = useState<AnalysisResult | null>(null)
   const [videoPreview, setVideoPreview] = useState<string | null>(null)
@@ -40,6 +238,9 @@ function App() {
   const [requestId, setRequestId] = useState<string | null>(null)
   const [error, setError] = useState<string | null>(null)
   const [analysisProgress, setAnalysisProgress] = useState(0)
+  const [liveProgress, setLiveProgress] = useState<LiveProgress | null>(null)
+  const [countHistory, setCountHistory] = useState<number[]>([])
+  const [annotations, setAnnotations] = useState<AnnotationTrack | null>(null)
   const fileInputRef = useRef<HTMLInputElement>(null)
 
   useEffect(() => {
@@ -50,6 +251,16 @@ function App() {
       .catch(err => console.error('API not available:', err))
   }, [])
 
+  // Analyses run in overlay mode publish an annotation track instead of a processed video
+  useEffect(() => {
+    setAnnotations(null)
+    if (!requestId) return
+    fetch(`${API_BASE_URL}/annotations?request_id=${requestId}`)
+      .then(res => (res.ok ? res.text() : null))
+      .then(text => setAnnotations(text ? parseAnnotations(text) : null))
+      .catch(() => setAnnotations(null))
+  }, [requestId])
+
   const handleDragOver = (e: React.DragEvent) => {
     e.preventDefault()
     setIsDragging(true)
@@ -90,40 +301,49 @@ function App() {
     if (!selectedFile) return
 
     setIsUploading(true)
+    setUploadProgress(0)
     setError(null)
 
-    const formData = new FormData()
-    formData.append('video', selectedFile)
-
     try {
-      const response = await fetch(`${API_BASE_URL}/upload`, {
-        method: 'POST',
-        body: formData,
-      })
-
-      const data = await response.json()
-
-      if (response.ok) {
-        setUploadedFilename(data.filename)
-        setIsUploading(false)
-        handleAnalyze(data.filename)
-      } else {
-        throw new Error(data.error || 'Upload failed')
-      }
+      const upload = await uploadInChunks(selectedFile, setUploadProgress)
+      setUploadedFilename(upload.filename)
+      setIsUploading(false)
+      handleAnalyze(upload.filename, upload.upload_id)
     } catch (err: any) {
       setError(err.message || 'Failed to upload video')
       setIsUploading(false)
     }
   }
 
-  const handleAnalyze = async (filename?: string) => {
+  const handleAnalyze = async (filename?: string, uploadId?: string) => {
     const fileToAnalyze = filename || uploadedFilename
     if (!fileToAnalyze) return
 
     setIsAnalyzing(true)
     setError(null)
     setAnalysisProgress(0)
-
+    setLiveProgress(null)
+    setCountHistory([])
+
+    // The server streams the job's progress, the timer below only runs until the first frame arrives
+    const progressId = uploadId || crypto.randomUUID()
+    const events = new EventSource(`${API_BASE_URL}/progress/${progressId}`)
+    events.addEventListener('stage', (event) => {
+      const { stage } = JSON.parse((event as MessageEvent).data)
+      setLiveProgress(prev => ({ ...prev, stage }))
+      if (stage === 'visualization') setAnalysisProgress(95)
+    })
+    events.addEventListener('progress', (event) => {
+      const data = JSON.parse((event as MessageEvent).data)
+      clearInterval(progressInterval)
+      setLiveProgress(prev => ({ ...prev, stage: 'analysis', ...data }))
+      setCountHistory(prev => [...prev, data.count].slice(-PROGRESS_HISTORY))
+      if (data.total_frames) {
+        setAnalysisProgress(Math.min(95, Math.round((data.frame / data.total_frames) * 95)))
+      }
+    })
+    events.addEventListener('done', () => events.close())
+    events.addEventListener('failed', () => events.close())
 
     const progressInterval = setInterval(() => {
       setAnalysisProgress(prev => {
@@ -136,16 +356,19 @@ function App() {
     }, 1000)
 
     try {
-      const response = await fetch(`${API_BASE_URL}/analyze`, {
+      // All analysis slots may be busy, the request is repeated until the server takes it
+      const response = await fetchWhenAvailable(`${API_BASE_URL}/analyze`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ filename: fileToAnalyze }),
+        // An analysis the server started while the upload was arriving is picked up by upload_id
+        body: JSON.stringify(uploadId ? { upload_id: uploadId } : { filename: fileToAnalyze, progress_id: progressId }),
       })
 
       const data = await response.json()
       clearInterval(progressInterval)
+      events.close()
 
       if (response.ok) {
         setAnalysisResult(data.data)
@@ -157,6 +380,7 @@ function App() {
       }
     } catch (err: any) {
       clearInterval(progressInterval)
+      events.close()
       setError(err.message || 'Failed to analyze video')
       setIsAnalyzing(false)
       setAnalysisProgress(0)
@@ -172,6 +396,8 @@ function App() {
     setUploadedFilename(null)
     setError(null)
     setAnalysisProgress(0)
+    setLiveProgress(null)
+    setCountHistory([])
   }
 
   return (
@@ -286,6 +512,23 @@ function App() {
                         ></div>
                       </div>
                       <p className="text-sm text-gray-400 mt-2">{analysisProgress}% Complete</p>
+                      {liveProgress && (
+                        <div className="text-sm text-gray-600 mt-2">
+                          {liveProgress.stage === 'queued' && <p>Waiting for a free CPU slot...</p>}
+                          {liveProgress.stage === 'visualization' && <p>Generating visualizations...</p>}
+                          {liveProgress.frame !== undefined && (
+                            <p>
+                              Frame {liveProgress.frame}{liveProgress.total_frames ? ` / ${liveProgress.total_frames}` : ''}
+                              {' · '}{liveProgress.fps} FPS
+                              {' · '}{liveProgress.count} people
+                              {' · '}{liveProgress.violations} violations
+                              {liveProgress.restricted && ' · ⛔ restricted entry'}
+                              {liveProgress.abnormal && ' · ⚠️ abnormal activity'}
+                            </p>
+                          )}
+                          <Sparkline values={countHistory} />
+                        </div>
+                      )}
                     </div>
                   </div>
                 </div>
@@ -301,7 +544,7 @@ function App() {
                     {isUploading ? (
                       <span className="flex items-center justify-center gap-3">
                         <div className="w-6 h-6 border-3 border-white border-t-transparent rounded-full animate-spin"></div>
-                        Uploading...
+                        Uploading... {uploadProgress}%
                       </span>
                     ) : (
                       <span className="flex items-center justify-center gap-2">
@@ -456,7 +699,7 @@ function App() {
                     <h4 className="font-semibold mb-2 text-cyan-600 text-sm">📍 Heatmap</h4>
                     <div className="rounded-lg overflow-hidden border border-gray-200">
                       <img
-                        src={`${API_BASE_URL}/visualizations/heatmap?request_id=${requestId}&t=${Date.now()}`}
+                        src={`${API_BASE_URL}/visualizations/heatmap?request_id=${requestId}`}
                         alt="Crowd Heatmap"
                         className="w-full h-auto"
                         onError={(e) => {
@@ -472,7 +715,7 @@ function App() {
                     <h4 className="font-semibold mb-2 text-purple-600 text-sm">🔄 Movement Tracks</h4>
                     <div className="rounded-lg overflow-hidden border border-gray-200">
                       <img
-                        src={`${API_BASE_URL}/visualizations/movement-tracks?request_id=${requestId}&t=${Date.now()}`}
+                        src={`${API_BASE_URL}/visualizations/movement-tracks?request_id=${requestId}`}
                         alt="Movement Tracks"
                         className="w-full h-auto"
                         onError={(e) => {
@@ -488,7 +731,7 @@ function App() {
                     <h4 className="font-semibold mb-2 text-pink-600 text-sm">📊 Crowd Analysis</h4>
                     <div className="rounded-lg overflow-hidden border border-gray-200">
                       <img
-                        src={`${API_BASE_URL}/visualizations/crowd-analysis?request_id=${requestId}&t=${Date.now()}`}
+                        src={`${API_BASE_URL}/visualizations/crowd-analysis?request_id=${requestId}`}
                         alt="Crowd Analysis"
                         className="w-full h-auto"
                         onError={(e) => {
@@ -504,7 +747,7 @@ function App() {
                     <h4 className="font-semibold mb-2 text-yellow-600 text-sm">⚡ Energy Distribution</h4>
                     <div className="rounded-lg overflow-hidden border border-gray-200">
                       <img
-                        src={`${API_BASE_URL}/visualizations/energy-distribution?request_id=${requestId}&t=${Date.now()}`}
+                        src={`${API_BASE_URL}/visualizations/energy-distribution?request_id=${requestId}`}
                         alt="Energy Distribution"
                         className="w-full h-auto"
                         onError={(e) => {
@@ -526,17 +769,21 @@ function App() {
                   Watch the complete analysis with bounding boxes, tracking IDs, and real-time annotations
                 </p>
                 <div className="rounded-xl overflow-hidden border-2 border-purple-500/30 neon-glow">
-                  <video
-                    key={`processed-video-${Date.now()}`}
-                    src={`${API_BASE_URL}/processed-video?request_id=${requestId}&t=${Date.now()}`}
-                    controls
-                    className="w-full bg-black"
-                    onError={() => {
-                      console.error('Error loading processed video');
-                    }}
-                  >
-                    Your browser does not support the video tag.
-                  </video>
+                  {annotations && videoPreview ? (
+                    <AnnotatedVideo src={videoPreview} track={annotations} />
+                  ) : (
+                    <video
+                      key={`processed-video-${requestId}`}
+                      src={`${API_BASE_URL}/processed-video?request_id=${requestId}`}
+                      controls
+                      className="w-full bg-black"
+                      onError={() => {
+                        console.error('Error loading processed video');
+                      }}
+                    >
+                      Your browser does not support the video tag.
+                    </video>
+                  )}
                 </div>
                 <div className="mt-3 flex items-center justify-between text-sm">
                   <p className="text-gray-600">
@@ -545,11 +792,11 @@ function App() {
                     <span className="text-pink-600 ml-2">●</span> Violation Markers
                   </p>
                   <a
-                    href={`${API_BASE_URL}/processed-video?request_id=${requestId}`}
-                    download="processed_video.mp4"
+                    href={annotations ? `${API_BASE_URL}/annotations?request_id=${requestId}` : `${API_BASE_URL}/processed-video?request_id=${requestId}`}
+                    download={annotations ? 'annotations.jsonl' : 'processed_video.mp4'}
                     className="px-4 py-2 glass-card rounded-lg hover:bg-white/10 transition-all text-sm font-semibold neon-glow"
                   >
-                    📥 Download Video
+                    📥 {annotations ? 'Download Annotations' : 'Download Video'}
                   </a>
                 </div>
               </div>